@@ -1,3 +1,42 @@
+import os
+
 import taichi as ti
+from taichi.lang import impl
+
+# key of the random streams of the cats (see cat.set_clock())
+SEED = 231827438
+
+TI_INIT_ARGS = {
+    "arch": ti.cpu,
+    "default_fp": ti.f32,
+    "default_ip": ti.i32,
+    "random_seed": SEED,
+}
+
+# compiled kernels are kept here between runs (Taichi offline cache),
+# CATSIM_CACHE_DIR="" turns the cache off
+CACHE_DIR = os.environ.get(
+    "CATSIM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "catsim")
+)
+
+
+def init(**params):
+    """
+    Initializes the Taichi runtime (nothing is initialized on import),
+    params override TI_INIT_ARGS, e.g. init(kernel_profiler=True).
+
+    Fields and kernels of the previous runtime are lost; kernels compiled by
+    earlier runs with the same compile time settings are loaded from CACHE_DIR.
+    """
+    args = dict(TI_INIT_ARGS)
+    if CACHE_DIR:
+        args.update(offline_cache=True, offline_cache_file_path=CACHE_DIR)
+    else:
+        args.update(offline_cache=False)
+    args.update(params)
+
+    ti.init(**args)
+
 
-ti.init(arch=ti.cpu, default_fp=ti.f32, default_ip=ti.i32, random_seed=231827438)
+def is_initialized() -> bool:
+    return impl.get_runtime().prog is not None
@@ -1,98 +1,253 @@
-import taichi as ti
-from taichi.lang.argpack import np
-
-import catsim.config as cfg
-from catsim.cat import Cat, init_cat_env
-from catsim.constants import INTERACTION_LEVEL_0, INTERACTION_LEVEL_1, INTERACTION_NO
-from catsim.grid import setup_grid, update_statuses
-
-
-@ti.kernel
-def move_cats(cats: ti.template()):
-    for idx in range(cfg.CATS_N):
-        cats[idx].move()
-
-
-def status_to_color(status: ti.i32):
-    if status == INTERACTION_NO:
-        return cfg.COLOR_LEVEL_NO
-
-    if status == INTERACTION_LEVEL_0:
-        return cfg.COLOR_LEVEL_0
-
-    if status == INTERACTION_LEVEL_1:
-        return cfg.COLOR_LEVEL_1
-
-    raise ValueError(status)
-
-
-to_color_vf = np.vectorize(status_to_color)
+import argparse
+import json
+import sys
+from typing import Optional
 
+import numpy as np
+import taichi as ti
 
-def mainloop(cats: ti.template()):
-    GUI = ti.GUI("cat simulation", res=(cfg.PLATE_WIDTH, cfg.PLATE_HEIGHT))
+import catsim
+from catsim.constants import COMPACT_CAT, GGUI_RENDERER, GUI_RENDERER
+from catsim.domain import run_domain
+from catsim.pipeline import RenderThread, SnapshotBuffer
+from catsim.profiler import (
+    enable_kernel_profiler,
+    format_profile,
+    kernel_profiler_enabled,
+    kernel_times,
+    summarize,
+    timed,
+)
+from catsim.render import (
+    get_positions,
+    get_vertex_colors,
+    setup_render,
+    snapshot,
+    update_colors,
+)
+from catsim.settings import Config, load_config, parse_override
+from catsim.simulation import (
+    close_simulation,
+    get_config,
+    init_simulation,
+    load_checkpoint,
+    pair_check_stats,
+    run_headless,
+    step,
+)
+
+
+def advance(cats: ti.template(), config: Config, timings: Optional[dict] = None):
+    """steps done between two rendered frames"""
+    for _ in range(config.STEPS_PER_FRAME):
+        step(cats, timings)
+
+
+def mainloop(cats: ti.template(), config: Config, timings: Optional[dict] = None):
+    """timings: if given, wall time of every phase is added (see profiler.timed)"""
+    GUI = ti.GUI("cat simulation", res=(config.PLATE_WIDTH, config.PLATE_HEIGHT))
+    positions = np.zeros((config.CATS_N, 2), dtype=np.float32)
+    colors = np.zeros((config.CATS_N,), dtype=np.uint32)
 
     while GUI.running:
-        move_cats(cats)
-        update_statuses(cats, cfg.DISTANCE)
-
-        GUI.circles(
-            pos=cats.norm_point.to_numpy(),
-            radius=cats.radius.to_numpy(),
-            color=to_color_vf(cats.status.to_numpy()),
+        advance(cats, config, timings)
+        with timed(timings, "snapshot"):
+            snapshot(cats, positions, colors)
+
+        with timed(timings, "draw"):
+            GUI.circles(pos=positions, radius=config.CAT_RADIUS, color=colors)
+        with timed(timings, "show"):
+            GUI.show()
+
+
+def mainloop_threaded(
+    cats: ti.template(), config: Config, timings: Optional[dict] = None
+):
+    """
+    The window is drawn by RenderThread, the simulation runs at its own pace
+    and hands a snapshot over whenever the previous one has been drawn.
+    (timings: only the phases of the simulation thread)
+    """
+    buffer = SnapshotBuffer(config.CATS_N)
+    renderer = RenderThread(
+        buffer, res=(config.PLATE_WIDTH, config.PLATE_HEIGHT), radius=config.CAT_RADIUS
+    )
+    renderer.start()
+
+    try:
+        while renderer.is_alive():
+            advance(cats, config, timings)
+
+            if buffer.wants_snapshot():
+                with timed(timings, "snapshot"):
+                    snapshot(cats, *buffer.back())
+                buffer.publish()
+    finally:
+        renderer.stop()
+        renderer.join()
+
+
+def mainloop_ggui(
+    cats: ti.template(),
+    window: ti.ui.Window,
+    config: Config,
+    timings: Optional[dict] = None,
+):
+    """
+    Draws `cats.norm_point` (written by `move_cats()`) and the color field
+    straight from Taichi memory, no `to_numpy()` per frame.
+    (CompactCat has no norm_point, its positions are computed in a kernel)
+    """
+    canvas = window.get_canvas()
+    radius = config.CAT_RADIUS / config.PLATE_HEIGHT
+
+    while window.running:
+        advance(cats, config, timings)
+        with timed(timings, "update_colors"):
+            update_colors(cats)
+
+        with timed(timings, "draw"):
+            canvas.circles(
+                get_positions(cats), radius=radius, per_vertex_color=get_vertex_colors()
+            )
+        with timed(timings, "show"):
+            window.show()
+
+
+def open_ggui_window(config: Config):
+    """returns None if GGUI can not be used here (no Vulkan or display)"""
+    try:
+        return ti.ui.Window(
+            "cat simulation", res=(config.PLATE_WIDTH, config.PLATE_HEIGHT), vsync=False
         )
-        GUI.show()
-
+    except RuntimeError as e:
+        print(f"GGUI is not available ({e}), falling back to ti.GUI", file=sys.stderr)
+        return None
 
-@ti.kernel
-def set_cat_init_positions(cats: ti.template()):
-    for idx in range(cfg.CATS_N):
-        cats[idx].init_cat(cfg.CAT_RADIUS)
 
-
-def validate_config():
-    if cfg.PLATE_HEIGHT <= 0 or cfg.PLATE_WIDTH <= 0:
-        raise ValueError("Plate height/width must be > 0")
-
-    if cfg.CATS_N <= 0:
-        raise ValueError("Number of cats must be > 0")
-
-    if (
-        cfg.CAT_RADIUS <= 0
-        or cfg.MOVE_RADIUS <= 0
-        or cfg.RADIUS_0 <= 0
-        or cfg.RADIUS_1 <= 0
-    ):
-        raise ValueError("Radii must be > 0")
-
-    if cfg.RADIUS_1 <= cfg.RADIUS_0:
-        raise ValueError("Radius 1 must be > Radius 0")
-
-
-def main():
-    validate_config()
-
-    init_cat_env(
-        move_radius=cfg.MOVE_RADIUS,
-        r0=cfg.RADIUS_0,
-        r1=cfg.RADIUS_1,
-        width=cfg.PLATE_WIDTH,
-        height=cfg.PLATE_HEIGHT,
-        move_pattern=cfg.MOVE_PATTERN_ID,
-        prob_inter=cfg.PROB_INTERACTION,
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m catsim")
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="run without a window and print timings as JSON",
     )
-
-    setup_grid(
-        cat_n=cfg.CATS_N,
-        r1=cfg.RADIUS_1,
-        width=cfg.PLATE_WIDTH,
-        height=cfg.PLATE_HEIGHT,
+    parser.add_argument(
+        "--steps", type=int, default=1000, help="number of steps in headless mode"
+    )
+    parser.add_argument(
+        "--config",
+        help="TOML or JSON file with parameters (the rest are from catsim.config)",
+    )
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="override one parameter, e.g. --set CATS_N=1000 "
+        "--set DISTANCE=MANHATTAN_DISTANCE",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="FILE",
+        help="continue from a checkpoint (its config is used, --set still applies)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time every phase of the step and of the main loop "
+        "(with the Taichi kernel profiler) and print the breakdown",
+    )
+    return parser.parse_args(argv)
+
+
+def overrides_from_args(args) -> dict:
+    overrides = dict(map(parse_override, args.overrides))
+    if args.profile:
+        overrides["PROFILE"] = True
+    return overrides
+
+
+def config_from_args(args) -> Config:
+    config = Config() if args.config is None else load_config(args.config)
+    return config.replace(**overrides_from_args(args))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.resume is None:
+        config = config_from_args(args)
+        if config.TILE_COLS * config.TILE_ROWS > 1:
+            run_tiles(args, config)
+            return
+
+    if args.profile:
+        enable_kernel_profiler()
+    else:
+        catsim.init()
+
+    if args.resume is None:
+        cats = init_simulation(config)
+    else:
+        cats = load_checkpoint(args.resume, overrides_from_args(args))
+    config = get_config()
+
+    try:
+        run(args, config, cats)
+    finally:
+        close_simulation()
+
+
+def run_tiles(args, config: Config):
+    """every tile is simulated by its own process (see domain.py), no window"""
+    if not args.headless:
+        raise SystemExit("Tiles (TILE_COLS x TILE_ROWS > 1) need --headless")
+
+    json.dump(run_domain(config, steps=args.steps, warmup=1), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+def run(args, config: Config, cats: ti.template()):
+    if args.headless:
+        json.dump(run_headless(cats, steps=args.steps, warmup=1), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+
+    window = None
+    if config.RENDERER == GGUI_RENDERER:
+        window = open_ggui_window(config)
+
+    setup_render(
+        cat_n=config.CATS_N,
+        color_no=config.COLOR_LEVEL_NO,
+        color_l1=config.COLOR_LEVEL_1,
+        color_l0=config.COLOR_LEVEL_0,
+        renderer=GUI_RENDERER if window is None else GGUI_RENDERER,
+        plate_size=(
+            (config.PLATE_WIDTH, config.PLATE_HEIGHT)
+            # norm_point of all replicas can not be drawn as is
+            if config.CAT_TYPE == COMPACT_CAT or config.REPLICA_N > 1
+            else None
+        ),
     )
 
-    cats = Cat.field(shape=(cfg.CATS_N,))
-    set_cat_init_positions(cats)
-
-    mainloop(cats)
+    timings = {} if config.PROFILE else None
+    if window is not None:
+        mainloop_ggui(cats, window, config, timings)
+    elif config.RENDER_THREAD:
+        mainloop_threaded(cats, config, timings)
+    else:
+        mainloop(cats, config, timings)
+
+    if timings:
+        checked = pair_check_stats()["checked"]
+        report = format_profile(
+            summarize(timings),
+            kernel_times() if kernel_profiler_enabled() else None,
+            {"pair checks per cat": checked / (config.CATS_N * config.REPLICA_N)},
+        )
+        print(report, file=sys.stderr)
 
 
 if __name__ == "__main__":
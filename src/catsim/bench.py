@@ -0,0 +1,249 @@
+"""
+Headless throughput benchmark.
+
+Usage:
+    python -m catsim.bench [--suite sim|scan] [--steps N] [--warmup N] [--quick]
+                           [--config FILE] [--output FILE]
+
+`sim` suite: each case starts from the base config (`catsim.config` or
+`--config FILE`) and overrides one parameter, so every axis (`CATS_N`, `RADIUS_1`, move pattern, distance type)
+is swept around the same base point. The grid and Verlet list engines are
+also compared on a slow random walk, and a small config is run alone and as
+an ensemble of 64 replicas.
+
+`scan` suite: cost of the cell prefix sum (`tools.exclusive_scan`) versus
+the number of grid cells, next to a serial scan as a reference.
+
+The report is printed (or written to FILE) as JSON.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+from typing import Optional
+
+import numpy as np
+import taichi as ti
+
+import catsim
+import catsim.constants as const
+from catsim.settings import Config, load_config
+from catsim.simulation import (
+    grid_cell_size,
+    init_simulation,
+    percentile,
+    run_headless,
+)
+from catsim.tools import exclusive_scan, scan_block_size
+
+_MOVE_PATTERNS = {
+    "random": const.MOVE_PATTERN_RANDOM_ID,
+    "line": const.MOVE_PATTERN_LINE_ID,
+    "phis": const.MOVE_PATTERN_PHIS_ID,
+}
+
+_DISTANCES = {
+    "euclidean": const.EUCLIDEAN_DISTANCE,
+    "manhattan": const.MANHATTAN_DISTANCE,
+    "chebyshev": const.CHEBYSHEV_DISTANCE,
+}
+
+
+def default_suite(base: Config, quick: bool = False) -> list:
+    """Returns the list of overrides of the base config to benchmark."""
+    cats_n = [10_000, 100_000] if quick else [10_000, 100_000, 500_000]
+    r1_scale = [1, 4] if quick else [0.5, 1, 2, 4]
+
+    overrides = [("CATS_N", n) for n in cats_n]
+    overrides += [("RADIUS_1", base.RADIUS_1 * scale) for scale in r1_scale]
+    overrides += [("MOVE_PATTERN_ID", pattern) for pattern in _MOVE_PATTERNS.values()]
+    overrides += [("DISTANCE", distance) for distance in _DISTANCES.values()]
+    overrides += [("NEIGHBOUR_STENCIL", const.HALF_STENCIL)]
+    overrides += [("CAT_LAYOUT", const.SOA_LAYOUT), ("CAT_TYPE", const.COMPACT_CAT)]
+    overrides += [("FUSED_STEP", not base.FUSED_STEP)]
+    overrides += [("SPATIAL_INDEX", const.ADAPTIVE_GRID)]
+    overrides += [("NEIGHBOUR_ENGINE", const.VERLET_ENGINE)]
+
+    # the base config is measured once, not once per axis
+    suite = [{}] + [
+        {name: value} for name, value in overrides if getattr(base, name) != value
+    ]
+
+    # slow random walk: the grid vs Verlet lists, which are rebuilt rarely here,
+    # and vs the grid updated only for cats changing their cell
+    suite += [
+        {
+            "MOVE_PATTERN_ID": const.MOVE_PATTERN_RANDOM_ID,
+            "MOVE_RADIUS": base.MOVE_RADIUS / 40,
+            "NEIGHBOUR_ENGINE": engine,
+            "INCREMENTAL_GRID": incremental,
+        }
+        for engine, incremental in (
+            (const.GRID_ENGINE, False),
+            (const.VERLET_ENGINE, False),
+            (const.GRID_ENGINE, True),
+        )
+    ]
+
+    # many small runs: one run per launch vs an ensemble of them
+    suite += [{"CATS_N": 1000, "REPLICA_N": n} for n in (1, 64)]
+    return suite
+
+
+def run_case(base: Config, params: dict, steps: int, warmup: int) -> dict:
+    # every case gets a fresh runtime, so fields of previous cases are freed
+    ti.reset()
+    catsim.init()
+
+    config = base.replace(**params)
+    cats = init_simulation(config)
+    result = run_headless(cats, steps=steps, warmup=warmup)
+
+    result["params"] = {
+        name: getattr(config, name)
+        for name in (
+            "CATS_N",
+            "RADIUS_1",
+            "MOVE_RADIUS",
+            "PLATE_WIDTH",
+            "PLATE_HEIGHT",
+            "MOVE_PATTERN_ID",
+            "DISTANCE",
+            "NEIGHBOUR_STENCIL",
+            "CAT_LAYOUT",
+            "CAT_TYPE",
+            "FUSED_STEP",
+            "SPATIAL_INDEX",
+            "INCREMENTAL_GRID",
+            "NEIGHBOUR_ENGINE",
+            "VERLET_SKIN",
+            "REPLICA_N",
+        )
+    }
+    result["params"]["GRID_CELL_SIZE"] = grid_cell_size(config)
+    result["overrides"] = sorted(params)
+
+    return result
+
+
+@ti.kernel
+def _parallel_scan(
+    values: ti.template(),
+    out: ti.template(),
+    block_sums: ti.template(),
+    n: ti.i32,
+    block_sz: ti.i32,
+):
+    exclusive_scan(values, out, block_sums, n, block_sz)
+
+
+@ti.kernel
+def _serial_scan(values: ti.template(), out: ti.template(), n: ti.i32):
+    out[0] = 0
+    ti.loop_config(serialize=True)
+    for idx in range(n):
+        out[idx + 1] = out[idx] + values[idx]
+
+
+def scan_suite(quick: bool = False) -> list:
+    """Returns the list of cell counts to benchmark."""
+    if quick:
+        return [10_000, 100_000, 1_000_000]
+    return [10_000, 100_000, 1_000_000, 4_000_000, 16_000_000]
+
+
+def run_scan_case(cell_n: int, steps: int, warmup: int) -> dict:
+    ti.reset()
+    catsim.init()
+
+    block_sz = scan_block_size(cell_n)
+    values = ti.field(dtype=ti.i32, shape=(cell_n,))
+    out = ti.field(dtype=ti.i32, shape=(cell_n + 1,))
+    block_sums = ti.field(dtype=ti.i32, shape=(-(-cell_n // block_sz),))
+    values.from_numpy(np.random.default_rng(0).integers(0, 4, cell_n, np.int32))
+
+    scans = {
+        "parallel": lambda: _parallel_scan(values, out, block_sums, cell_n, block_sz),
+        "serial": lambda: _serial_scan(values, out, cell_n),
+    }
+
+    result = {"params": {"CELL_N": cell_n, "SCAN_BLOCK_SZ": block_sz}, "scan_ms": {}}
+    for name, scan in scans.items():
+        for _ in range(warmup):
+            scan()
+        ti.sync()
+
+        times = []
+        for _ in range(steps):
+            t0 = time.perf_counter()
+            scan()
+            ti.sync()
+            times.append(time.perf_counter() - t0)
+
+        times.sort()
+        result["scan_ms"][name] = {
+            "mean": sum(times) / len(times) * 1e3,
+            "p50": percentile(times, 0.50) * 1e3,
+        }
+
+    return result
+
+
+def environment_info() -> dict:
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "taichi": ".".join(map(str, ti.__version__)),
+        "arch": str(catsim.TI_INIT_ARGS["arch"]),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_suite(
+    suite: str, quick: bool, steps: int, warmup: int, base: Optional[Config] = None
+) -> dict:
+    if suite == "scan":
+        results = [run_scan_case(n, steps, warmup) for n in scan_suite(quick)]
+    else:
+        base = Config() if base is None else base
+        results = [
+            run_case(base, params, steps, warmup)
+            for params in default_suite(base, quick)
+        ]
+
+    return {"environment": environment_info(), "suite": suite, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m catsim.bench", description="Headless throughput benchmark"
+    )
+    parser.add_argument(
+        "--suite", choices=["sim", "scan"], default="sim", help="what to measure"
+    )
+    parser.add_argument("--steps", type=int, default=100, help="measured steps")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured steps")
+    parser.add_argument("--quick", action="store_true", help="use a smaller sweep")
+    parser.add_argument("--config", help="base config file (TOML or JSON)")
+    parser.add_argument("--output", help="write JSON report to this file")
+    args = parser.parse_args(argv)
+
+    base = None if args.config is None else load_config(args.config)
+    report = run_suite(args.suite, args.quick, args.steps, args.warmup, base)
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
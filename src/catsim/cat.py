@@ -1,6 +1,9 @@
+from typing import Any
+
 import taichi as ti
 import taichi.math as tm
 
+import catsim
 from catsim.constants import (
     # PROBABILISTIC INTERACTION #
     DISABLE_PROB_INTER,
@@ -13,20 +16,49 @@ from catsim.constants import (
     MOVE_PATTERN_RANDOM_ID,
 )
 from catsim.tools import (
-    get_distance,
+    distance_key_of,
+    get_distance_key,
+    is_squared,
     move_pattern_line,
     move_pattern_phis,
     move_pattern_random,
+    rng_f32,
+    rng_stream,
 )
 
-_RADIUS_0: ti.f32
+# compile time settings (pair checks and the grid depend on them)
 _RADIUS_1: ti.f32
 _PLATE_WIDTH: ti.i32
 _PLATE_HEIGHT: ti.i32
-_MOVE_RADIUS: ti.f32
-_MOVE_PATTERN: ti.i32
 _PROB_INTER: ti.i32
 
+"""
+contains settings read at runtime (set_params() changes them without
+recompiling kernels, so kernels of configs differing only in them are the same
+and are found in the offline cache):
+    - 0-d field of _Params
+    - radius_0: distance of INTERACTION_LEVEL_0 (see interaction_level())
+    - radius_0_sq: radius_0 ** 2 (compared with squared euclidean distances)
+"""
+_Params = ti.types.struct(
+    move_radius=ti.f32, move_pattern=ti.i32, radius_0=ti.f32, radius_0_sq=ti.f32
+)
+_F_PARAMS: Any
+
+"""
+contains the key of the random streams of the cats (see tools.rng_stream()):
+    - 0-d field of _Clock
+    - a cat draws from the stream (seed, Cat.id, step), so the draws do not
+      depend on the order the cats are processed in
+    - step is advanced by tick() before every move of the cats
+"""
+_Clock = ti.types.struct(seed=ti.u32, step=ti.u32)
+_F_CLOCK: Any
+
+# first draw of the pair streams (cat_stream() draw := _PAIR_DRAW + other cat id),
+# the draws before it are taken by moves and by the placement
+_PAIR_DRAW = 8
+
 
 def init_cat_env(
     move_radius: ti.f32,
@@ -36,61 +68,117 @@ def init_cat_env(
     height: ti.i32,
     move_pattern: ti.i32,
     prob_inter: ti.i32,
+    seed: int = catsim.SEED,
 ):
-    global \
-        _RADIUS_0, \
-        _RADIUS_1, \
-        _PLATE_WIDTH, \
-        _PLATE_HEIGHT, \
-        _MOVE_RADIUS, \
-        _MOVE_PATTERN, \
-        _PROB_INTER
-    _MOVE_RADIUS = move_radius
-    _RADIUS_0 = r0
+    global _RADIUS_1, _PLATE_WIDTH, _PLATE_HEIGHT, _PROB_INTER
     _RADIUS_1 = r1
     _PLATE_WIDTH = width
     _PLATE_HEIGHT = height
-    _MOVE_PATTERN = move_pattern
     _PROB_INTER = prob_inter
 
+    global _F_PARAMS, _F_CLOCK
+    _F_PARAMS = _Params.field(shape=())
+    set_params(move_radius, move_pattern, r0)
+    _F_CLOCK = _Clock.field(shape=())
+    set_clock(seed)
 
-@ti.dataclass
-class Cat:
-    radius: ti.f32
 
-    status: ti.i32
-    move_pattern: ti.i32
+def set_params(move_radius: ti.f32, move_pattern: ti.i32, r0: ti.f32):
+    """changes runtime settings of init_cat_env(), compiled kernels are reused"""
+    _F_PARAMS[None] = _Params(
+        move_radius=move_radius,
+        move_pattern=move_pattern,
+        radius_0=r0,
+        radius_0_sq=r0 * r0,
+    )
 
-    point: tm.vec2
-    norm_point: tm.vec2
-    prev_point: tm.vec2
+
+def set_clock(seed: int, step: int = 0):
+    """restarts the random streams of the cats, see get_clock()"""
+    _F_CLOCK[None] = _Clock(seed=seed, step=step)
+
+
+def get_clock() -> tuple:
+    """(seed, step), a run continues with the same draws after set_clock(seed, step)"""
+    clock = _F_CLOCK[None]
+    return int(clock.seed), int(clock.step)
+
+
+@ti.func
+def tick():
+    """next step of the random streams (at the kernel top level, before moves)"""
+    _F_CLOCK[None].step += ti.u32(1)
+
+
+@ti.func
+def cat_stream(cat_id: ti.i32) -> ti.u32:
+    """random stream of the cat at the current step"""
+    return rng_stream(_F_CLOCK[None].seed, cat_id, _F_CLOCK[None].step)
+
+
+class _CatBehaviour:
+    """
+    Methods shared by Cat and CompactCat.
+    Members missing in CompactCat (radius, norm_point) are skipped at compile time.
+    """
 
     @ti.func
     def _set_point(self, point: tm.vec2):
         self.point = point
-        self.norm_point = tm.vec2([point[0] / _PLATE_WIDTH, point[1] / _PLATE_HEIGHT])
+        if ti.static(hasattr(self, "norm_point")):
+            self.norm_point = tm.vec2(
+                [point[0] / _PLATE_WIDTH, point[1] / _PLATE_HEIGHT]
+            )
 
     @ti.func
     def init_cat(self, cat_r: ti.f32):
-        point = tm.vec2([ti.random() * _PLATE_WIDTH, ti.random() * _PLATE_HEIGHT])
-        self.radius = cat_r
-        self._set_point(point)
-        self.prev_point = move_pattern_random(
-            self.point, _MOVE_RADIUS, _PLATE_WIDTH, _PLATE_HEIGHT
+        self.init_cat_in(cat_r, tm.vec2(0, 0), tm.vec2(_PLATE_WIDTH, _PLATE_HEIGHT))
+
+    @ti.func
+    def init_cat_in(self, cat_r: ti.f32, lo: tm.vec2, size: tm.vec2):
+        """
+        places the cat at a random point of the rectangle [lo; lo + size]
+        (Cat.id must be set, it keys the draws)
+        """
+        stream = cat_stream(self.id)
+        point = lo + size * tm.vec2([rng_f32(stream, 4), rng_f32(stream, 5)])
+        self.place(
+            cat_r,
+            point,
+            move_pattern_random(
+                point,
+                _F_PARAMS[None].move_radius,
+                _PLATE_WIDTH,
+                _PLATE_HEIGHT,
+                stream,
+            ),
+            _F_PARAMS[None].move_pattern,
         )
-        self.move_pattern = _MOVE_PATTERN
+
+    @ti.func
+    def place(
+        self, cat_r: ti.f32, point: tm.vec2, prev_point: tm.vec2, move_pattern: ti.i32
+    ):
+        """the cat is at `point` and was at `prev_point` a step ago"""
+        if ti.static(hasattr(self, "radius")):
+            self.radius = cat_r
+        self._set_point(point)
+        self.prev_point = prev_point
+        self.move_pattern = ti.cast(move_pattern, ti.i8)
 
     @ti.func
     def move(self):
-        self.status = INTERACTION_NO
+        self.status = ti.cast(INTERACTION_NO, ti.i8)
 
         prev_point = self.prev_point
         self.prev_point = self.point
+        move_radius = _F_PARAMS[None].move_radius
+        stream = cat_stream(self.id)
 
         if self.move_pattern == MOVE_PATTERN_RANDOM_ID:
             self._set_point(
                 move_pattern_random(
-                    self.point, _MOVE_RADIUS, _PLATE_WIDTH, _PLATE_HEIGHT
+                    self.point, move_radius, _PLATE_WIDTH, _PLATE_HEIGHT, stream
                 )
             )
 
@@ -99,9 +187,10 @@ class Cat:
                 move_pattern_line(
                     self.point,
                     prev_point,
-                    _MOVE_RADIUS,
+                    move_radius,
                     _PLATE_WIDTH,
                     _PLATE_HEIGHT,
+                    stream,
                 )
             )
 
@@ -114,16 +203,82 @@ class Cat:
             assert False
 
     @ti.func
-    def fight_with(self, other_cat: ti.template(), distance_type: ti.i32):
-        dist = get_distance(self.point, other_cat.point, distance_type)
+    def fight_with(self, other_cat: ti.template(), distance_type: ti.template()):
+        key = get_distance_key(self.point, other_cat.point, distance_type)
+        self.fight_at(other_cat, key, distance_type)
+
+    @ti.func
+    def fight_at(
+        self, other_cat: ti.template(), key: ti.f32, distance_type: ti.template()
+    ) -> ti.i32:
+        """fight_with() at a known get_distance_key() `key`, returns the level"""
+        # status and move_pattern are written as i8 (fits both Cat and CompactCat),
+        # max is taken in i32 (not supported for i8)
+        level = interaction_level(key, distance_type, self.id, other_cat.id)
+        self.status = ti.cast(ti.max(self.status, level), ti.i8)
+        return level
+
+
+@ti.dataclass
+class Cat(_CatBehaviour):
+    # stable external id: the record keeps it when cats are permuted in memory
+    id: ti.i32
+    radius: ti.f32
+
+    status: ti.i32
+    move_pattern: ti.i32
+
+    point: tm.vec2
+    norm_point: tm.vec2
+    prev_point: tm.vec2
 
-        if dist <= _RADIUS_0:
-            self.status = INTERACTION_LEVEL_0
 
-        elif dist <= _RADIUS_1 and (
-            _PROB_INTER == DISABLE_PROB_INTER or ti.random() < 1.0 / (dist * dist)
-        ):
-            self.status = ti.max(self.status, INTERACTION_LEVEL_1)
+@ti.dataclass
+class CompactCat(_CatBehaviour):
+    """
+    Cat without per-cat copies of shared or derived data:
+        - radius is the same for all cats (CAT_RADIUS)
+        - norm_point is computed from point only for rendering
+        - status and move_pattern are i8 (not usable with atomics)
+    """
+
+    id: ti.i32
 
+    status: ti.i8
+    move_pattern: ti.i8
+
+    point: tm.vec2
+    prev_point: tm.vec2
+
+
+@ti.func
+def interaction_level(
+    key: ti.f32, distance_type: ti.template(), cat_id: ti.i32, other_id: ti.i32
+) -> ti.i32:
+    """
+    Status cat `cat_id` gets because of cat `other_id` at get_distance_key() `key`
+    (with PROB_INTER the draw is keyed by the ordered pair, so the two cats of
+    the pair draw independently, but the same in any order of the checks).
+    The metric is a compile time constant: the euclidean one compares squared
+    distances with squared radii, without PROB_INTER the draw is not compiled.
+    """
+    level = INTERACTION_NO
+
+    r0 = _F_PARAMS[None].radius_0
+    dist_sq = key * key
+    if ti.static(is_squared(distance_type)):
+        r0 = _F_PARAMS[None].radius_0_sq
+        dist_sq = key
+
+    if key <= r0:
+        level = INTERACTION_LEVEL_0
+
+    elif key <= ti.static(distance_key_of(_RADIUS_1, distance_type)):
+        if ti.static(_PROB_INTER != DISABLE_PROB_INTER):
+            draw = ti.cast(_PAIR_DRAW + other_id, ti.u32)
+            if rng_f32(cat_stream(cat_id), draw) < 1.0 / dist_sq:
+                level = INTERACTION_LEVEL_1
         else:
-            self.status = ti.max(self.status, INTERACTION_NO)
+            level = INTERACTION_LEVEL_1
+
+    return level
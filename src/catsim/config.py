@@ -13,11 +13,83 @@ RADIUS_1 = RADIUS_0 * 3
 # ----- PATTERNS ----- #
 MOVE_PATTERN_ID = const.MOVE_PATTERN_PHIS_ID
 DISTANCE = const.EUCLIDEAN_DISTANCE
+NEIGHBOUR_STENCIL = const.FULL_STENCIL
+# move cats and bin them into cells in one kernel pass (off - separate kernels)
+FUSED_STEP = False
+
+# ----- SPATIAL INDEX ----- #
+SPATIAL_INDEX = const.UNIFORM_GRID
+# side of a grid cell (RADIUS_1_CELL_SIZE, AUTO_CELL_SIZE or a size in plate units)
+GRID_CELL_SIZE = const.RADIUS_1_CELL_SIZE
+# ADAPTIVE_GRID: cells with more than SPLIT_THRESHOLD cats are split into
+# SPLIT_FACTOR x SPLIT_FACTOR subcells
+SPLIT_FACTOR = 4
+SPLIT_THRESHOLD = 32
+# UNIFORM_GRID: update the cell storage only for cats which changed their cell,
+# rebuild it in full when more than MIGRATION_THRESHOLD of the cats did
+INCREMENTAL_GRID = False
+MIGRATION_THRESHOLD = 0.2
+
+# ----- NEIGHBOUR SEARCH ----- #
+NEIGHBOUR_ENGINE = const.GRID_ENGINE
+# VERLET_ENGINE: lists hold cats closer than RADIUS_1 + VERLET_SKIN
+# and are rebuilt once some cat has moved farther than VERLET_SKIN / 2
+VERLET_SKIN = RADIUS_1 / 4
+
+# ----- ENSEMBLE ----- #
+# number of independent simulations of this config advanced together
+# (CATS_N cats each, only the first one is drawn)
+REPLICA_N = 1
+
+# ----- DOMAIN DECOMPOSITION ----- #
+# the plate is split into TILE_COLS x TILE_ROWS tiles, each one simulated by its
+# own process (headless only, see domain.py); 1 x 1 - one process
+TILE_COLS = 1
+TILE_ROWS = 1
+# cats one tile can hold (own cats and ghosts) per cat of an even split
+TILE_CAPACITY = 2.0
+
+# ----- METRICS ----- #
+# per-step statistics kept on the device between exports (0 - not recorded)
+METRICS_HISTORY = 0
+# bins of the interaction heatmap along each side of the plate (0 - no heatmap)
+HEATMAP_SIZE = 0
+
+# ----- RECORDING ----- #
+# directory to stream point and status of all cats into ("" - no recording)
+RECORD_PATH = ""
+# a frame is taken every RECORD_EVERY steps, at most RECORD_FRAMES frames
+RECORD_EVERY = 10
+RECORD_FRAMES = 1000
+# directory to stream pairs of interacting cats of every step into ("" - none),
+# needs the grid engine without FUSED_STEP and PROFILE
+CONTACTS_PATH = ""
+
+# ----- CHECKPOINTS ----- #
+# file to save the state into every CHECKPOINT_EVERY steps ("" - never)
+CHECKPOINT_PATH = ""
+CHECKPOINT_EVERY = 5000
+
+# ----- PROFILING ----- #
+# time every phase of the step apart (the grid update runs as several kernels)
+PROFILE = False
+
+# ----- MEMORY LAYOUT ----- #
+CAT_LAYOUT = const.AOS_LAYOUT
+CAT_TYPE = const.FULL_CAT
+# permute cats in memory into the grid cell order every N steps (0 - never)
+REORDER_PERIOD = 0
 
 # ----- VISUALISATION ----- #
 COLOR_LEVEL_0 = const.RED_COLOR
 COLOR_LEVEL_1 = const.YELLOW_COLOR
 COLOR_LEVEL_NO = const.GREEN_COLOR
+# GGUI_RENDERER: draw with ti.ui.Window straight from Taichi fields (needs Vulkan)
+RENDERER = const.GUI_RENDERER
+# simulation steps per rendered frame
+STEPS_PER_FRAME = 1
+# GUI_RENDERER: draw in a background thread, the simulation does not wait for it
+RENDER_THREAD = False
 
 # ----- PROBABILISTIC INTERACTION ----- #
 PROB_INTERACTION = const.DISABLE_PROB_INTER
@@ -7,6 +7,38 @@ EUCLIDEAN_DISTANCE = 0
 MANHATTAN_DISTANCE = 1
 CHEBYSHEV_DISTANCE = 2
 
+# all 9 neighbour cells, every ordered pair of cats
+FULL_STENCIL = 0
+# own cell + 4 "forward" cells, every unordered pair of cats is checked once
+HALF_STENCIL = 1
+
+# ----- SPATIAL INDEX ----- #
+# cells of one size for the whole plate
+UNIFORM_GRID = 0
+# cells with too many cats are split into subcells every step
+ADAPTIVE_GRID = 1
+
+# cell size is chosen from the number of cats and the plate size
+AUTO_CELL_SIZE = 0
+# cell side is RADIUS_1 (3x3 neighbour cells)
+RADIUS_1_CELL_SIZE = -1
+
+# ----- NEIGHBOUR SEARCH ----- #
+# cats are binned into the grid and neighbour cells are scanned every step
+GRID_ENGINE = 0
+# neighbour lists are built with the grid and reused while cats move little
+VERLET_ENGINE = 1
+
+# ----- MEMORY LAYOUT ----- #
+# array of structures: all members of one cat are stored together
+AOS_LAYOUT = 0
+# structure of arrays: every member is stored in its own array
+SOA_LAYOUT = 1
+
+FULL_CAT = 0
+# no per-cat radius and norm_point, i8 status and move pattern
+COMPACT_CAT = 1
+
 # ----- INTERACTION LEVELS ----- #
 INTERACTION_LEVEL_0 = 2
 INTERACTION_LEVEL_1 = 1
@@ -17,6 +49,10 @@ RED_COLOR = 0xED553B
 YELLOW_COLOR = 0xFFFF00
 GREEN_COLOR = 0x34C924
 
+# ----- RENDERERS ----- #
+GUI_RENDERER = 0
+GGUI_RENDERER = 1
+
 # ----- PROBABILISTIC INTERACTION ----- #
 ENABLE_PROB_INTER = 1
 DISABLE_PROB_INTER = 0
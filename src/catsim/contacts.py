@@ -0,0 +1,291 @@
+import contextlib
+import json
+import os
+from typing import Optional
+
+import numpy as np
+import taichi as ti
+import taichi.math as tm
+from taichi.lang import impl
+
+from catsim.constants import INTERACTION_NO
+from catsim.grid import fight_neighbours, init_cell_storage
+from catsim.writer import BackgroundWriter
+
+__all__ = [
+    "EDGE_DTYPE",
+    "STEP_DTYPE",
+    "ContactBuffer",
+    "ContactLog",
+    "ContactWriter",
+    "export_contacts",
+    "get_contact_buffer",
+    "setup_contacts",
+    "update_statuses_contacts",
+]
+
+"""
+Contact graph of the cats (pairs which fought or hissed at each step):
+    - the neighbour loop of the grid engine (grid.fight_neighbours()) appends
+      every interacting pair into a preallocated ContactBuffer: a slot is taken
+      with an atomic counter, the counter keeps counting past the capacity
+    - on overflow the buffer is reallocated (at least twice as large) and only
+      the neighbour loop is run again: statuses are max-ed and the draws are
+      keyed by the pair and the step (see cat.cat_stream()), so the rerun gives
+      the same statuses and pairs
+    - every unordered pair is listed once as (min id, max id) of Cat.id, its
+      level is the maximum of the levels of the two cats because of each other
+      (with PROB_INTER only one of them may hiss)
+    - the full stencil does not stop the scan of a cat at INTERACTION_LEVEL_0
+      when the pairs are listed (every pair must be seen)
+
+ContactWriter streams the lists of the steps to a directory in a background
+thread (see writer.py), the edges of a step are sorted by (a, b):
+    - edges.bin: packed EDGE_DTYPE records (a i4, b i4, level i1) of all steps
+    - steps.bin: packed STEP_DTYPE records (step i4, offset i8), the edges of
+      the k-th written step are edges[offset_k ; offset_k+1)
+    - meta.json: number of written steps and edges, replaced after every
+      flushed step (the steps written before a crash stay readable)
+    - a run resumed from a checkpoint continues the files: the steps up to the
+      step of the checkpoint are kept, the later ones are cut off
+ContactLog opens the files memory-mapped.
+"""
+
+EDGE_DTYPE = np.dtype([("a", "<i4"), ("b", "<i4"), ("level", "i1")])
+STEP_DTYPE = np.dtype([("step", "<i4"), ("offset", "<i8")])
+
+# buffer of the simulation (set up by setup_contacts()) and its Taichi runtime
+_BUFFER: Optional["ContactBuffer"] = None
+_RUNTIME: Optional[object] = None
+
+
+@ti.data_oriented
+class ContactBuffer:
+    """Interacting pairs of one step, filled by grid.fight_neighbours()."""
+
+    # lists pairs (see grid.NO_CONTACTS)
+    enabled = True
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+
+        builder = ti.FieldsBuilder()
+        self.pairs = tm.ivec2.field()
+        self.levels = ti.field(dtype=ti.i8)
+        # number of pairs found, may be > capacity (overflow)
+        self.count = ti.field(dtype=ti.i32)
+        builder.dense(ti.i, capacity).place(self.pairs, self.levels)
+        builder.dense(ti.i, 1).place(self.count)
+        self._tree = builder.finalize()
+
+    def destroy(self):
+        self._tree.destroy()
+
+    @ti.func
+    def add(self, id1: ti.i32, id2: ti.i32, level: ti.i32):
+        """appends the pair of cats id1, id2 if they interact at `level`"""
+        if level != INTERACTION_NO:
+            slot = ti.atomic_add(self.count[0], 1)
+            if slot < self.capacity:
+                self.pairs[slot] = tm.ivec2(ti.min(id1, id2), ti.max(id1, id2))
+                self.levels[slot] = ti.cast(level, ti.i8)
+
+
+def setup_contacts(capacity: int):
+    """
+    capacity: initial number of pairs per step (grows on overflow); a large
+    enough buffer of the same runtime is kept, since freeing a tree makes
+    Taichi compile all kernels again
+    """
+    if (
+        _BUFFER is None
+        or _RUNTIME is not impl.get_runtime()
+        or _BUFFER.capacity < capacity
+    ):
+        _allocate(capacity)
+
+
+def _allocate(capacity: int):
+    global _BUFFER, _RUNTIME
+    if _BUFFER is not None:
+        _BUFFER.destroy()
+    _BUFFER = ContactBuffer(max(1, capacity))
+    _RUNTIME = impl.get_runtime()
+
+
+def get_contact_buffer() -> ContactBuffer:
+    return _BUFFER
+
+
+@ti.kernel
+def _fight_listed(
+    cats: ti.template(),
+    distance_type: ti.template(),
+    stencil: ti.template(),
+    contacts: ti.template(),
+    rebuild: ti.template(),
+):
+    contacts.count[0] = 0
+    if ti.static(rebuild):
+        init_cell_storage(cats)
+    fight_neighbours(cats, distance_type, stencil, contacts)
+
+
+def update_statuses_contacts(
+    cats: ti.template(), distance_type: int, stencil: int, rebuild: bool = True
+) -> int:
+    """
+    update_statuses() (or fight_cats() after update_cell_storage() if not
+    `rebuild`) which also lists the interacting pairs, returns their number.
+    A new buffer means new kernels, so it grows at least twice.
+    """
+    _fight_listed(cats, distance_type, stencil, _BUFFER, rebuild)
+
+    count = int(_BUFFER.count[0])
+    if count > _BUFFER.capacity:
+        _allocate(max(count + count // 4, 2 * _BUFFER.capacity))
+        # the storage is already built for the current positions
+        _fight_listed(cats, distance_type, stencil, _BUFFER, False)
+        count = int(_BUFFER.count[0])
+
+    return count
+
+
+@ti.kernel
+def _copy_contacts(
+    contacts: ti.template(),
+    count: ti.i32,
+    pairs: ti.types.ndarray(),
+    levels: ti.types.ndarray(),
+):
+    for slot in range(count):
+        pairs[slot, 0] = contacts.pairs[slot][0]
+        pairs[slot, 1] = contacts.pairs[slot][1]
+        levels[slot] = contacts.levels[slot]
+
+
+def export_contacts() -> tuple:
+    """(pairs (n, 2) i32, levels (n,) i8) of the last step, in no order"""
+    count = min(int(_BUFFER.count[0]), _BUFFER.capacity)
+    pairs = np.zeros((count, 2), dtype=np.int32)
+    levels = np.zeros((count,), dtype=np.int8)
+    if count > 0:
+        _copy_contacts(_BUFFER, count, pairs, levels)
+    return pairs, levels
+
+
+class ContactWriter(BackgroundWriter):
+    """Streams contacts of the steps into `path` (a directory), see the module notes."""
+
+    def __init__(
+        self,
+        path: str,
+        cat_n: int,
+        buffers: int = 3,
+        resume_step: Optional[int] = None,
+    ):
+        """
+        cat_n: size of the cats field (all replicas)
+        buffers: the simulation waits only if `buffers` steps are still queued
+        resume_step: continue the contacts in `path` (if there are any) after
+        their steps up to this one, the later ones are cut off
+        """
+        self.steps = 0
+        self.edges = 0
+        if resume_step is not None and os.path.exists(os.path.join(path, "meta.json")):
+            self.steps, self.edges = _steps_up_to(path, cat_n, resume_step)
+
+        super().__init__(
+            path,
+            "contacts",
+            meta={"cat_n": cat_n},
+            written={"steps": self.steps, "edges": self.edges},
+            maxsize=buffers,
+        )
+
+    def record(self, step_idx: int):
+        """queues the contacts of the last update_statuses_contacts()"""
+        self.check()
+
+        pairs, levels = export_contacts()
+        self.put((step_idx, self.edges, pairs, levels))
+        self.steps += 1
+        self.edges += len(levels)
+
+    @contextlib.contextmanager
+    def _open(self):
+        edges_path = os.path.join(self.path, "edges.bin")
+        steps_path = os.path.join(self.path, "steps.bin")
+        with open(edges_path, "ab") as edges, open(steps_path, "ab") as steps:
+            # only the continued steps are kept (none for a new writer)
+            edges.truncate(self.edges * EDGE_DTYPE.itemsize)
+            steps.truncate(self.steps * STEP_DTYPE.itemsize)
+            yield edges, steps
+
+    def _write(self, files, item):
+        step_idx, offset, pairs, levels = item
+        order = np.argsort(
+            (pairs[:, 0].astype(np.int64) << 32) | pairs[:, 1], kind="stable"
+        )
+        edges = np.empty((len(levels),), dtype=EDGE_DTYPE)
+        edges["a"] = pairs[order, 0]
+        edges["b"] = pairs[order, 1]
+        edges["level"] = levels[order]
+
+        edges_file, steps_file = files
+        edges_file.write(edges.tobytes())
+        steps_file.write(np.array([(step_idx, offset)], dtype=STEP_DTYPE).tobytes())
+        self._written = {
+            "steps": self._written["steps"] + 1,
+            "edges": offset + len(levels),
+        }
+
+    def _flush(self, files):
+        for f in files:
+            f.flush()
+
+
+def _steps_up_to(path: str, cat_n: int, step_idx: int) -> tuple:
+    """(steps, edges) of the contacts in `path` written up to step_idx"""
+    log = ContactLog(path)
+    if log.cat_n != cat_n:
+        raise ValueError(f"Contacts {path} have other cats, can not continue")
+    steps = int(np.searchsorted(log.step_ids, step_idx, side="right"))
+    return steps, int(log.offsets[steps])
+
+
+class ContactLog:
+    """Read-only access to a directory written by ContactWriter."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        self.cat_n = meta["cat_n"]
+        self.steps = meta["steps"]
+        self.edge_n = meta["edges"]
+
+        def load(name, dtype, n):
+            if n == 0:
+                return np.zeros((0,), dtype=dtype)
+            return np.memmap(os.path.join(path, name), dtype, "r", shape=(n,))
+
+        # memory-mapped, slices are read from the disk on access
+        self.edges = load("edges.bin", EDGE_DTYPE, self.edge_n)
+        index = load("steps.bin", STEP_DTYPE, self.steps)
+        self.step_ids = np.array(index["step"])
+        self.offsets = np.append(index["offset"], self.edge_n)
+
+    def __len__(self) -> int:
+        return self.steps
+
+    def index_of_step(self, step_idx: int) -> Optional[int]:
+        """position of the step in the log (None if it was not written)"""
+        idx = int(np.searchsorted(self.step_ids, step_idx))
+        if idx < self.steps and self.step_ids[idx] == step_idx:
+            return idx
+        return None
+
+    def read(self, idx: int) -> np.ndarray:
+        """EDGE_DTYPE edges of the idx-th written step as an in-memory array"""
+        return np.array(self.edges[self.offsets[idx] : self.offsets[idx + 1]])
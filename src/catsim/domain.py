@@ -0,0 +1,604 @@
+import math
+import multiprocessing
+import time
+import traceback
+from multiprocessing.connection import wait
+from typing import Optional
+
+import numpy as np
+import taichi as ti
+import taichi.math as tm
+
+import catsim
+from catsim.cat import init_cat_env, tick
+from catsim.constants import (
+    ADAPTIVE_GRID,
+    GRID_ENGINE,
+    HALF_STENCIL,
+    INTERACTION_LEVEL_0,
+    INTERACTION_LEVEL_1,
+    INTERACTION_NO,
+    SOA_LAYOUT,
+)
+from catsim.grid import (
+    set_cat_n,
+    setup_grid,
+    update_statuses,
+    update_statuses_symmetric,
+)
+from catsim.settings import Config
+from catsim.simulation import cat_type, grid_cell_size, validate_config
+
+__all__ = [
+    "Domain",
+    "run_domain",
+    "tile_size",
+    "validate_domain",
+]
+
+"""
+Domain decomposition (TILE_COLS x TILE_ROWS tiles):
+    - the plate is split into equal tiles, tile (col, row) has the index
+      col * TILE_ROWS + row and is simulated by its own process (with its own
+      Taichi runtime) with the grid algorithm
+    - a tile holds its own cats and "ghosts": copies of the cats of other tiles
+      in its halo (at most RADIUS_1 from the tile along x and y); the grid of
+      the tile covers the tile and the halo (grid._ORIGIN)
+    - a step of a tile: move own cats -> _sort_cats() -> exchange with the
+      8 neighbour tiles -> update statuses of own cats and ghosts
+    - _sort_cats() keeps the cats still in the tile and lists the others
+      (migrants, they are sent to their new tile) and the cats in the halo of
+      another tile (they are sent there as ghosts)
+    - neighbours exchange through pipes pair by pair in the order of the
+      pairs (the smaller index sends first), so no process waits for another
+      one which waits for it
+    - statuses of ghosts are dropped, the owner computes them
+"""
+
+# neighbour k of a tile is at offset (k // 3 - 1, k % 3 - 1), the tile itself is 4
+_SELF = 4
+
+"""
+rows of _sort_cats():
+    - ints: (n, 4) i32 - mask of the tiles whose halo holds the cat (bit k is
+      neighbour k), neighbour owning the cat (-1 if it is not a neighbour),
+      id, move pattern
+    - floats: (n, 4) f32 - point, prev_point
+"""
+_MASK, _OWNER, _ID, _PATTERN = range(4)
+
+
+def tile_size(config: Config) -> tuple:
+    return (
+        config.PLATE_WIDTH / config.TILE_COLS,
+        config.PLATE_HEIGHT / config.TILE_ROWS,
+    )
+
+
+def validate_domain(config: Config):
+    validate_config(config)
+
+    if config.TILE_COLS < 1 or config.TILE_ROWS < 1:
+        raise ValueError("Number of tiles must be >= 1")
+
+    if config.TILE_CAPACITY < 1:
+        raise ValueError("Tile capacity must be >= 1")
+
+    if (
+        config.NEIGHBOUR_ENGINE != GRID_ENGINE
+        or config.REPLICA_N > 1
+        or config.REORDER_PERIOD > 0
+        or config.METRICS_HISTORY > 0
+        or config.RECORD_PATH
+        or config.CONTACTS_PATH
+        or config.CHECKPOINT_PATH
+        or config.PROFILE
+    ):
+        raise ValueError(
+            "Tiles support only the grid engine without replicas, reordering, "
+            "metrics, recording, contacts, checkpoints and profiling"
+        )
+
+    # a cat moves at most MOVE_RADIUS along each axis, so migrants and ghosts
+    # only go to the neighbour tiles
+    if min(tile_size(config)) < 2 * (config.RADIUS_1 + config.MOVE_RADIUS):
+        raise ValueError("Tiles must be at least 2 * (RADIUS_1 + MOVE_RADIUS) wide")
+
+
+@ti.kernel
+def _place_cats(
+    cats: ti.template(),
+    n: ti.i32,
+    first_id: ti.i32,
+    lo: tm.vec2,
+    size: tm.vec2,
+    cat_r: ti.f32,
+):
+    for idx in range(n):
+        cats[idx].id = first_id + idx
+        cats[idx].init_cat_in(cat_r, lo, size)
+
+
+@ti.kernel
+def _add_cats(
+    cats: ti.template(),
+    first: ti.i32,
+    ints: ti.types.ndarray(),
+    floats: ti.types.ndarray(),
+    cat_r: ti.f32,
+):
+    """cats[first + row] := row of ints (id, move pattern) and floats (point, prev_point)"""
+    for row in range(ints.shape[0]):
+        idx = first + row
+        cats[idx].id = ints[row, 0]
+        cats[idx].status = ti.cast(INTERACTION_NO, ti.i8)
+        cats[idx].place(
+            cat_r,
+            tm.vec2(floats[row, 0], floats[row, 1]),
+            tm.vec2(floats[row, 2], floats[row, 3]),
+            ints[row, 1],
+        )
+
+
+@ti.kernel
+def _move_cats(cats: ti.template(), n: ti.i32):
+    tick()
+    for idx in range(n):
+        cats[idx].move()
+
+
+@ti.kernel
+def _sort_cats(
+    cats: ti.template(),
+    kept: ti.template(),
+    n: ti.i32,
+    tile: tm.ivec2,
+    tiles: tm.ivec2,
+    size: tm.vec2,
+    halo: ti.f32,
+    ints: ti.types.ndarray(),
+    floats: ti.types.ndarray(),
+    counts: ti.types.ndarray(),
+):
+    """
+    cats[0 ; n) still in the tile are copied into kept[0 ; counts[0]),
+    rows of the other ones are written into ints and floats[0 ; counts[1])
+    """
+    for idx in range(n):
+        point = cats[idx].point
+        offset = ti.min(ti.max(ti.floor(point / size, ti.i32), 0), tiles - 1) - tile
+
+        owner = (offset[0] + 1) * 3 + offset[1] + 1
+        if ti.max(ti.abs(offset[0]), ti.abs(offset[1])) > 1:
+            owner = -1
+
+        # the halo is closed on both sides: cats interact at dist <= RADIUS_1
+        mask = 0
+        for k in ti.static(range(9)):
+            t = tile + tm.ivec2(k // 3 - 1, k % 3 - 1)
+            lo = ti.cast(t, ti.f32) * size - halo
+            hi = lo + size + 2 * halo
+            if (
+                0 <= t[0] < tiles[0]
+                and 0 <= t[1] < tiles[1]
+                and lo[0] <= point[0] <= hi[0]
+                and lo[1] <= point[1] <= hi[1]
+            ):
+                mask |= 1 << k
+
+        if owner == _SELF:
+            kept[ti.atomic_add(counts[0], 1)] = cats[idx]
+
+        if owner != _SELF or mask != 1 << _SELF:
+            row = ti.atomic_add(counts[1], 1)
+            ints[row, _MASK] = mask
+            ints[row, _OWNER] = owner
+            ints[row, _ID] = cats[idx].id
+            ints[row, _PATTERN] = ti.cast(cats[idx].move_pattern, ti.i32)
+            floats[row, 0] = point[0]
+            floats[row, 1] = point[1]
+            floats[row, 2] = cats[idx].prev_point[0]
+            floats[row, 3] = cats[idx].prev_point[1]
+
+
+@ti.kernel
+def _get_statuses(
+    cats: ti.template(),
+    n: ti.i32,
+    ids: ti.types.ndarray(),
+    statuses: ti.types.ndarray(),
+):
+    for idx in range(n):
+        ids[idx] = cats[idx].id
+        statuses[idx] = ti.cast(cats[idx].status, ti.i8)
+
+
+def _ghost_rows(ids: np.ndarray, points: np.ndarray) -> tuple:
+    """
+    rows of _add_cats() for ghosts: they are not moved, but keep the ids of
+    their cats (the draws of the pairs are keyed by the ids)
+    """
+    ints = np.zeros((len(points), 2), dtype=np.int32)
+    ints[:, 0] = ids
+    return ints, np.ascontiguousarray(np.hstack([points, points]))
+
+
+class _Tile:
+    """One tile in its worker process, see the module notes."""
+
+    def __init__(self, config: Config, idx: int, links: dict, rows: Optional[tuple]):
+        """
+        links: {neighbour tile index: (k, connection)}
+        rows: (ints, floats) of _add_cats() for the initial cats (random if None)
+        """
+        self.config = config
+        self.idx = idx
+        self.links = sorted(links.items())
+
+        width, height = tile_size(config)
+        self.tile = (idx // config.TILE_ROWS, idx % config.TILE_ROWS)
+        self.tiles = (config.TILE_COLS, config.TILE_ROWS)
+        self.size = (width, height)
+        self.halo = config.RADIUS_1
+
+        tile_n = config.TILE_COLS * config.TILE_ROWS
+        self.capacity = math.ceil(config.CATS_N / tile_n * config.TILE_CAPACITY)
+
+        init_cat_env(
+            move_radius=config.MOVE_RADIUS,
+            r0=config.RADIUS_0,
+            r1=config.RADIUS_1,
+            width=config.PLATE_WIDTH,
+            height=config.PLATE_HEIGHT,
+            move_pattern=config.MOVE_PATTERN_ID,
+            prob_inter=config.PROB_INTERACTION,
+        )
+        setup_grid(
+            cat_n=self.capacity,
+            r1=config.RADIUS_1,
+            width=width + 2 * self.halo,
+            height=height + 2 * self.halo,
+            cell_sz=grid_cell_size(config),
+            split_factor=(
+                config.SPLIT_FACTOR if config.SPATIAL_INDEX == ADAPTIVE_GRID else 1
+            ),
+            split_threshold=config.SPLIT_THRESHOLD,
+            origin=(
+                self.tile[0] * width - self.halo,
+                self.tile[1] * height - self.halo,
+            ),
+            variable_n=True,
+        )
+
+        layout = ti.Layout.SOA if config.CAT_LAYOUT == SOA_LAYOUT else ti.Layout.AOS
+        self.cats, self.spare = (
+            cat_type(config).field(shape=(self.capacity,), layout=layout)
+            for _ in range(2)
+        )
+
+        self._ints = np.zeros((self.capacity, 4), dtype=np.int32)
+        self._floats = np.zeros((self.capacity, 4), dtype=np.float32)
+        self._counts = np.zeros((2,), dtype=np.int32)
+
+        if rows is None:
+            # cats are spread over tiles evenly, ids go tile by tile
+            self.own_n = config.CATS_N // tile_n + (idx < config.CATS_N % tile_n)
+            first_id = idx * (config.CATS_N // tile_n) + min(
+                idx, config.CATS_N % tile_n
+            )
+            self._check_capacity(self.own_n)
+            _place_cats(
+                self.cats,
+                self.own_n,
+                first_id,
+                tm.vec2(self.tile[0] * width, self.tile[1] * height),
+                tm.vec2(width, height),
+                config.CAT_RADIUS,
+            )
+        else:
+            self.own_n = len(rows[0])
+            self._check_capacity(self.own_n)
+            if self.own_n > 0:
+                _add_cats(self.cats, 0, *rows, config.CAT_RADIUS)
+
+    def _check_capacity(self, cat_n: int):
+        if cat_n > self.capacity:
+            raise RuntimeError(
+                f"Tile {self.idx}: {cat_n} cats do not fit into {self.capacity}, "
+                "increase TILE_CAPACITY"
+            )
+
+    def _exchange(self, ints: np.ndarray, floats: np.ndarray) -> list:
+        """sends migrants and ghosts to the neighbours, returns their messages"""
+        messages = []
+        for neighbour, (k, conn) in self.links:
+            own = ints[:, _OWNER] == k
+            ghost = ((ints[:, _MASK] >> k) & 1).astype(bool) & ~own
+            message = (
+                np.ascontiguousarray(ints[own][:, [_ID, _PATTERN]]),
+                floats[own],
+                ints[ghost][:, _ID],
+                np.ascontiguousarray(floats[ghost][:, :2]),
+            )
+
+            if neighbour < self.idx:
+                messages.append(conn.recv())
+                conn.send(message)
+            else:
+                conn.send(message)
+                messages.append(conn.recv())
+        return messages
+
+    def step(self, stats: dict):
+        config = self.config
+
+        t0 = time.perf_counter()
+        _move_cats(self.cats, self.own_n)
+
+        self._counts[:] = 0
+        _sort_cats(
+            self.cats,
+            self.spare,
+            self.own_n,
+            tm.ivec2(*self.tile),
+            tm.ivec2(*self.tiles),
+            tm.vec2(*self.size),
+            self.halo,
+            self._ints,
+            self._floats,
+            self._counts,
+        )
+        kept, out_n = int(self._counts[0]), int(self._counts[1])
+        ints, floats = self._ints[:out_n], self._floats[:out_n]
+        if np.any(ints[:, _OWNER] < 0):
+            raise RuntimeError(f"Tile {self.idx}: a cat jumped over a neighbour tile")
+
+        t1 = time.perf_counter()
+        messages = self._exchange(ints, floats)
+
+        # migrants of this tile are still ghosts here while they are in the halo
+        local = (ints[:, _OWNER] != _SELF) & ((ints[:, _MASK] >> _SELF) & 1).astype(
+            bool
+        )
+        ghost_ids = np.concatenate(
+            [ints[local][:, _ID]] + [ids for _, _, ids, _ in messages]
+        )
+        ghosts = np.concatenate(
+            [floats[local][:, :2]] + [ghost for _, _, _, ghost in messages]
+        )
+        new_ints = np.concatenate(
+            [np.zeros((0, 2), np.int32)] + [rows for rows, _, _, _ in messages]
+        )
+        new_floats = np.concatenate(
+            [np.zeros((0, 4), np.float32)] + [rows for _, rows, _, _ in messages]
+        )
+
+        t2 = time.perf_counter()
+        self.own_n = kept + len(new_ints)
+        cat_n = self.own_n + len(ghosts)
+        self._check_capacity(cat_n)
+
+        if len(new_ints) > 0:
+            _add_cats(self.spare, kept, new_ints, new_floats, config.CAT_RADIUS)
+        if len(ghosts) > 0:
+            _add_cats(
+                self.spare,
+                self.own_n,
+                *_ghost_rows(ghost_ids, ghosts),
+                config.CAT_RADIUS,
+            )
+
+        set_cat_n(cat_n)
+        if config.NEIGHBOUR_STENCIL == HALF_STENCIL:
+            update_statuses_symmetric(self.spare, config.DISTANCE)
+        else:
+            update_statuses(self.spare, config.DISTANCE)
+        ti.sync()
+        self.cats, self.spare = self.spare, self.cats
+        t3 = time.perf_counter()
+
+        stats["migrants"] += int(np.count_nonzero(ints[:, _OWNER] != _SELF))
+        stats["ghosts"] += len(ghosts)
+        stats["move_ms"] += (t1 - t0) * 1e3
+        stats["exchange_ms"] += (t2 - t1) * 1e3
+        stats["update_ms"] += (t3 - t2) * 1e3
+
+    def run(self, steps: int) -> dict:
+        stats = dict.fromkeys(
+            ("migrants", "ghosts", "move_ms", "exchange_ms", "update_ms"), 0
+        )
+        for _ in range(steps):
+            self.step(stats)
+
+        _, statuses = self.statuses()
+        stats["own_n"] = self.own_n
+        stats["statuses"] = np.bincount(statuses, minlength=INTERACTION_LEVEL_0 + 1)
+        return stats
+
+    def statuses(self) -> tuple:
+        """(ids, statuses) of own cats"""
+        ids = np.zeros((self.own_n,), dtype=np.int32)
+        statuses = np.zeros((self.own_n,), dtype=np.int8)
+        if self.own_n > 0:
+            _get_statuses(self.cats, self.own_n, ids, statuses)
+        return ids, statuses
+
+
+def _worker(config: Config, idx: int, links: dict, rows: Optional[tuple], commands):
+    """runs commands of Domain until the "close" command"""
+    try:
+        catsim.init()
+        tile = _Tile(config, idx, links, rows)
+        commands.send(("ok", None))
+
+        while True:
+            command, arg = commands.recv()
+            if command == "run":
+                commands.send(("ok", tile.run(arg)))
+            elif command == "statuses":
+                commands.send(("ok", tile.statuses()))
+            else:
+                break
+    except Exception:  # noqa: BLE001
+        # any error is sent to Domain._replies(), which stops all tiles and raises it
+        commands.send(("error", traceback.format_exc()))
+
+
+class Domain:
+    """Simulates `config` with one process per tile, see the module notes."""
+
+    def __init__(
+        self,
+        config: Config,
+        points: Optional[np.ndarray] = None,
+        prev_points: Optional[np.ndarray] = None,
+    ):
+        """
+        points, prev_points: (CATS_N, 2) initial positions (random if None),
+        the id of a cat is its row
+        """
+        validate_domain(config)
+        self.config = config
+
+        tile_n = config.TILE_COLS * config.TILE_ROWS
+        rows = [None] * tile_n
+        if points is not None:
+            rows = self._split_rows(points, prev_points)
+
+        links = [{} for _ in range(tile_n)]
+        ctx = multiprocessing.get_context("spawn")
+        for idx in range(tile_n):
+            col, row = divmod(idx, config.TILE_ROWS)
+            for k in range(_SELF + 1, 9):
+                ncol, nrow = col + k // 3 - 1, row + k % 3 - 1
+                if 0 <= ncol < config.TILE_COLS and 0 <= nrow < config.TILE_ROWS:
+                    # this tile is neighbour 8 - k of that one
+                    neighbour = ncol * config.TILE_ROWS + nrow
+                    conn, neighbour_conn = ctx.Pipe()
+                    links[idx][neighbour] = (k, conn)
+                    links[neighbour][idx] = (8 - k, neighbour_conn)
+
+        self._commands = []
+        self._processes = []
+        for idx in range(tile_n):
+            commands, worker_commands = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(config, idx, links[idx], rows[idx], worker_commands),
+                daemon=True,
+            )
+            process.start()
+            self._commands.append(commands)
+            self._processes.append(process)
+
+        self._replies()
+
+    def _split_rows(self, points: np.ndarray, prev_points: np.ndarray) -> list:
+        config = self.config
+        points = np.asarray(points, dtype=np.float32)
+        prev_points = np.asarray(prev_points, dtype=np.float32)
+        if points.shape != (config.CATS_N, 2) or prev_points.shape != points.shape:
+            raise ValueError("Expected points and prev_points of shape (CATS_N, 2)")
+
+        tiles = np.array([config.TILE_COLS, config.TILE_ROWS])
+        cell = np.clip(np.floor(points / tile_size(config)).astype(int), 0, tiles - 1)
+        owner = cell[:, 0] * config.TILE_ROWS + cell[:, 1]
+
+        ints = np.zeros((config.CATS_N, 2), dtype=np.int32)
+        ints[:, 0] = np.arange(config.CATS_N)
+        ints[:, 1] = config.MOVE_PATTERN_ID
+        floats = np.hstack([points, prev_points])
+
+        return [
+            (ints[owner == idx], floats[owner == idx])
+            for idx in range(config.TILE_COLS * config.TILE_ROWS)
+        ]
+
+    def _replies(self) -> list:
+        """replies of all workers, the first error stops all of them"""
+        replies = {}
+        while len(replies) < len(self._commands):
+            for conn in wait([c for c in self._commands if id(c) not in replies]):
+                try:
+                    status, value = conn.recv()
+                except EOFError:
+                    status, value = "error", "the worker process exited"
+                if status == "error":
+                    idx = self._commands.index(conn)
+                    # the neighbours of the tile may wait for it forever
+                    self.close(terminate=True)
+                    raise RuntimeError(f"Tile {idx} failed:\n{value}")
+                replies[id(conn)] = value
+        return [replies[id(conn)] for conn in self._commands]
+
+    def _call(self, command: str, arg=None) -> list:
+        for conn in self._commands:
+            conn.send((command, arg))
+        return self._replies()
+
+    def run(self, steps: int) -> dict:
+        """
+        Advances all tiles `steps` times. Returns the wall time, the number
+        of cats of every tile and of every status (after the last step),
+        the mean number of migrants and ghosts per step (all tiles) and the
+        mean time of the phases of a step (ms, the slowest tile).
+        """
+        t0 = time.perf_counter()
+        stats = self._call("run", steps)
+        total = time.perf_counter() - t0
+
+        statuses = sum(tile["statuses"] for tile in stats)
+        per_step = max(steps, 1)
+        return {
+            "tiles": [self.config.TILE_COLS, self.config.TILE_ROWS],
+            "steps": steps,
+            "total_s": total,
+            "steps_per_sec": steps / total if total > 0 else None,
+            "cats_per_tile": [tile["own_n"] for tile in stats],
+            "migrants_per_step": sum(tile["migrants"] for tile in stats) / per_step,
+            "ghosts_per_step": sum(tile["ghosts"] for tile in stats) / per_step,
+            "phases_ms": {
+                name: max(tile[name] for tile in stats) / per_step
+                for name in ("move_ms", "exchange_ms", "update_ms")
+            },
+            "statuses": {
+                name: int(statuses[level])
+                for name, level in (
+                    ("no", INTERACTION_NO),
+                    ("level_1", INTERACTION_LEVEL_1),
+                    ("level_0", INTERACTION_LEVEL_0),
+                )
+            },
+        }
+
+    def statuses(self) -> np.ndarray:
+        """(CATS_N,) i8 status of every cat by its id"""
+        statuses = np.zeros((self.config.CATS_N,), dtype=np.int8)
+        for ids, tile_statuses in self._call("statuses"):
+            statuses[ids] = tile_statuses
+        return statuses
+
+    def close(self, terminate: bool = False):
+        for conn, process in zip(self._commands, self._processes):
+            if terminate:
+                process.terminate()
+            elif process.is_alive():
+                conn.send(("close", None))
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_domain(config: Config, steps: int, warmup: int = 0) -> dict:
+    """Domain.run() of `steps` after `warmup` unmeasured steps (JIT compilation)"""
+    with Domain(config) as domain:
+        if warmup > 0:
+            domain.run(warmup)
+        return domain.run(steps)
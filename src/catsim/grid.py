@@ -1,29 +1,101 @@
 import math
-from typing import Any
+from typing import Any, Optional, Tuple
 
 import taichi as ti
+import taichi.math as tm
+
+from catsim.cat import interaction_level, tick
+from catsim.constants import HALF_STENCIL, INTERACTION_LEVEL_0, INTERACTION_NO
+from catsim.tools import exclusive_scan, get_distance_key, scan_block_size
 
 __all__ = [
+    "NO_CONTACTS",
+    "auto_cell_size",
+    "cat_cell",
+    "cat_in_cell_order",
+    "cat_replica",
+    "cell_of",
+    "cell_range",
+    "cell_span",
+    "count_cats",
+    "fight_cats",
+    "fight_neighbours",
+    "fight_symmetric",
+    "find_migrants",
+    "get_migration_stats",
+    "get_occupancy_stats",
+    "get_pair_check_stats",
+    "grid_size",
+    "init_cell_storage",
+    "invalidate_cell_storage",
+    "max_cell_occupancy",
+    "move_and_update_statuses",
+    "pair_checks",
+    "patch_cells",
+    "scan_cells",
+    "scatter_cats",
+    "set_cat_n",
     "setup_grid",
+    "span_rect",
+    "update_cell_storage",
     "update_statuses",
+    "update_statuses_symmetric",
 ]
 
+
+@ti.data_oriented
+class _NoContacts:
+    """`contacts` of the fight funcs which lists no pairs (see contacts.py)"""
+
+    enabled = False
+
+
+NO_CONTACTS = _NoContacts()
+
 # global settings
 _CATS_N: ti.i32
-_RADIUS_1: ti.i32
+_RADIUS_1: ti.f32
 _PLATE_WIDTH: ti.i32
 _PLATE_HEIGHT: ti.i32
 
 _CELL_N: ti.i32
-_CELL_SZ: ti.i32
+_CELL_SZ: ti.f32
 _GRID_COL_N: ti.i32
 _GRID_ROW_N: ti.i32
 
+# number of cells between a cell and its farthest neighbour: ceil(RADIUS_1 / CELL_SZ)
+_REACH: ti.i32
+
+# point of the plate where the grid starts (a tile of domain.py), the grid
+# covers [ORIGIN; ORIGIN + (PLATE_WIDTH, PLATE_HEIGHT)]
+_ORIGIN: Tuple[float, float]
+
+"""
+Variable number of cats (setup_grid(variable_n=True), see domain.py):
+    - CATS_N is the capacity, only cats[0 ; F_CAT_N) are binned and checked
+    - set_cat_n() changes the number without recompiling kernels (0 at first)
+"""
+_VARIABLE_N: bool
+_F_CAT_N: Any
+
+"""
+Ensemble (REPLICA_N independent simulations in one field):
+    - cats of replica r are cats[r * REPLICA_CATS_N ; (r + 1) * REPLICA_CATS_N)
+    - every replica has its own plate of PLANE_CELL_N cells:
+      cell_lin_idx := r * PLANE_CELL_N + col * GRID_ROW_N + row,
+      so cats of different replicas are never neighbours
+    - CATS_N := REPLICA_N * REPLICA_CATS_N, CELL_N := REPLICA_N * PLANE_CELL_N
+"""
+_REPLICA_N: ti.i32
+_REPLICA_CATS_N: ti.i32
+_PLANE_CELL_N: ti.i32
+
 """
 contains Cats ids:
     - size := cats_n
     - each range contains cat_ids only from one Cell
         - Head_i and Tail_i of the range from F_CELL_HEADS
+    - cats of a split cell are sorted by their subcell (see F_SUB_HEADS)
 """
 _F_CELL_STORAGE: Any
 
@@ -38,100 +110,923 @@ contains Head for each cell:
 """
 _F_CELL_HEADS: Any
 
+"""
+pair check counters of the last update:
+    - checked: number of `fight_with` calls
+    - skipped: pairs not checked because the cat already had INTERACTION_LEVEL_0
+"""
+_F_PAIR_CHECKS: Any
+_F_PAIR_CHECKS_SKIPPED: Any
+
+"""
+occupancy of the last update:
+    - max_cell: maximum number of cats in one cell
+    - max_leaf: the same, but split cells are counted by their subcells
+    - split_cells: number of split cells
+"""
+_F_MAX_OCCUPANCY: Any
+_F_MAX_LEAF_OCCUPANCY: Any
+_F_SPLIT_N: Any
+
+"""
+neighbour cells (see _neighbour_offset() and _forward_offset()):
+    - all cells of the (2 * REACH + 1) x (2 * REACH + 1) square, own cell first
+    - forward: own cell and half of the others, if B is forward for A, A is not for B
+"""
+_NEIGHBOUR_N: ti.i32
+_FORWARD_N: ti.i32
+# the neighbour loop is unrolled only for 3x3 cells without splitting (compile time)
+_UNROLL_STENCIL: bool
+
+"""
+contains linearized cell index of each cat:
+    - size := cats_n
+    - cell_lin_idx := col * GRID_ROW_N + row
+    - computed once per step, when cats are counted
+"""
+_F_CAT_CELL: Any
+
+"""
+Dense cells (ADAPTIVE_GRID):
+    - a cell with more than SPLIT_THRESHOLD cats is split into
+      SPLIT_FACTOR x SPLIT_FACTOR subcells for the step
+    - a cat scans only the subcells of a split cell which intersect
+      the square [point - RADIUS_1; point + RADIUS_1]
+    - SPLIT_FACTOR == 1: no splitting (uniform grid)
+"""
+_SPLIT_FACTOR: ti.i32
+_SPLIT_THRESHOLD: ti.i32
+_SUB_CELL_SZ: ti.f32
+
+"""
+contains split slot of each cell:
+    - size := cell_n
+    - -1 if the cell is not split
+    - F_SPLIT_CELLS[slot] is the cell of the slot
+"""
+_F_CELL_SPLIT: Any
+_F_SPLIT_CELLS: Any
+
+"""
+contains Head for each subcell of each split cell:
+    - shape := (max split cells, split_factor^2 + 1)
+    - sub_lin_idx := sub_col * SPLIT_FACTOR + sub_row
+    - same meaning as F_CELL_HEADS, subcells of one column are adjacent
+"""
+_F_SUB_HEADS: Any
+
+# (internal) subcell of each cat inside its cell (only when cells are split)
+_F_CAT_SUB: Any
+_F_SUB_CUR: Any
+
+"""
+Incremental maintenance (setup_grid(incremental=True), update_cell_storage()):
+    - F_CAT_CELL keeps the cell of every cat of the last update and
+      F_CAT_PER_CELL the number of cats in every cell
+    - find_migrants() lists cats whose cell has changed (F_MIGRANTS[0 ; F_MIGRANT_N))
+      and moves them between the counts of their cells
+    - patch_cells() rebuilds the heads from the counts and F_CELL_STORAGE from
+      its previous copy: cats which stayed keep their order, migrants are
+      appended to their new cells; no atomics for the cats which stayed
+    - this is a rebuild without atomics, not a patch of the changed cells
+      (the heads of all cells after a changed one move): a step still passes
+      over all cats, copies the heads and the storage, scans all cells,
+      rewrites the whole storage and reads F_MIGRANT_N on the host, so it
+      stays O(cats + cells); it only saves the atomics of the cats which
+      stayed (measured in doc.md)
+    - the storage is rebuilt in full when more than `threshold` of the cats
+      are migrants or after invalidate_cell_storage() (e.g. cats were permuted)
+"""
+_INCREMENTAL: bool
+_STORAGE_VALID: bool = False
+_F_MIGRANTS: Any
+_F_MIGRANT_N: Any
+_F_PREV_HEADS: Any
+_F_PREV_STORAGE: Any
+# migrants of the last update_cell_storage() and whether it rebuilt the storage
+_MIGRATION_STATS: dict = {"migrants": 0, "rebuilt": False}
 
 # (internal) used to fill _F_CELL_STORAGE
+#   - _F_CELL_HEADS is the exclusive prefix sum of _F_CAT_PER_CELL
+_SCAN_BLOCK_SZ: ti.i32
 _F_CELL_CUR: Any
-_F_COLUMN_SUM: Any
-_F_PREFIX_SUM: Any
 _F_CAT_PER_CELL: Any
+_F_BLOCK_SUM: Any
+
+
+def auto_cell_size(cat_n: int, r1: float, width: float, height: float) -> float:
+    """
+    Cell size for the expected (uniform) density of cats:
+        - sparse plate: cells grow up to about one cat per cell,
+          so empty cells are not scanned and allocated
+        - dense plate: cells shrink to RADIUS_1 / reach, so fewer
+          far cats are checked at the cost of more visited cells
+    """
+    per_cell = cat_n * r1 * r1 / (width * height)
+    if per_cell < 1:
+        return max(r1, math.sqrt(width * height / cat_n))
+
+    # per cat: candidates ~ (2 + 1/k)^2 * per_cell, visited cells ~ (2k + 1)^2
+    reach = min(
+        range(1, 5), key=lambda k: (2 + 1 / k) ** 2 * per_cell + (2 * k + 1) ** 2
+    )
+    return r1 / reach
 
 
-def setup_grid(cat_n: ti.i32, r1: ti.i32, width: ti.i32, height: ti.i32):
-    global _CATS_N, _RADIUS_1, _PLATE_WIDTH, _PLATE_HEIGHT
-    _CATS_N = cat_n
+def setup_grid(
+    cat_n: ti.i32,
+    r1: ti.f32,
+    width: ti.i32,
+    height: ti.i32,
+    cell_sz: Optional[ti.f32] = None,
+    split_factor: ti.i32 = 1,
+    split_threshold: ti.i32 = 32,
+    replica_n: ti.i32 = 1,
+    origin: Tuple[float, float] = (0.0, 0.0),
+    variable_n: bool = False,
+    incremental: bool = False,
+):
+    """
+    cat_n: number of cats in one replica
+    width, height: size of the area covered by the grid, see _ORIGIN
+    cell_sz: side of a cell (RADIUS_1 by default), see auto_cell_size()
+    split_factor, split_threshold: see _SPLIT_FACTOR
+    replica_n: number of replicas, see _REPLICA_N
+    variable_n: cat_n is the capacity, see _VARIABLE_N
+    incremental: allocate buffers of update_cell_storage(), see _INCREMENTAL
+    """
+    global _CATS_N, _REPLICA_N, _REPLICA_CATS_N, _RADIUS_1, _PLATE_WIDTH, _PLATE_HEIGHT
+    _REPLICA_N = replica_n
+    _REPLICA_CATS_N = cat_n
+    _CATS_N = cat_n * replica_n
     _RADIUS_1 = r1
     _PLATE_WIDTH = width
     _PLATE_HEIGHT = height
 
-    global _CELL_N, _GRID_COL_N, _GRID_ROW_N, _CELL_SZ
-    _CELL_SZ = _RADIUS_1
+    global _CELL_N, _PLANE_CELL_N, _GRID_COL_N, _GRID_ROW_N, _CELL_SZ, _REACH
+    _CELL_SZ = _RADIUS_1 if cell_sz is None else cell_sz
+    _REACH = math.ceil(_RADIUS_1 / _CELL_SZ)
     _GRID_COL_N = math.ceil(_PLATE_WIDTH / _CELL_SZ)
     _GRID_ROW_N = math.ceil(_PLATE_HEIGHT / _CELL_SZ)
-    _CELL_N = _GRID_COL_N * _GRID_ROW_N
+    _PLANE_CELL_N = _GRID_COL_N * _GRID_ROW_N
+    _CELL_N = _PLANE_CELL_N * _REPLICA_N
+
+    global _ORIGIN, _VARIABLE_N, _F_CAT_N
+    _ORIGIN = (float(origin[0]), float(origin[1]))
+    _VARIABLE_N = variable_n
+    if _VARIABLE_N:
+        _F_CAT_N = ti.field(dtype=ti.i32, shape=())
+
+    global _NEIGHBOUR_N, _FORWARD_N, _UNROLL_STENCIL
+    _NEIGHBOUR_N = (2 * _REACH + 1) ** 2
+    _FORWARD_N = (_NEIGHBOUR_N - 1) // 2 + 1
+    _UNROLL_STENCIL = _REACH == 1 and split_factor == 1
 
     global _F_CELL_HEADS, _F_CELL_STORAGE
     _F_CELL_STORAGE = ti.field(dtype=ti.i32, shape=(_CATS_N,))
     _F_CELL_HEADS = ti.field(dtype=ti.i32, shape=(_CELL_N + 1,))
 
-    global _F_CELL_CUR, _F_CAT_PER_CELL, _F_COLUMN_SUM, _F_PREFIX_SUM
-    _F_CAT_PER_CELL = ti.field(dtype=ti.i32, shape=(_GRID_COL_N, _GRID_ROW_N))
-    _F_COLUMN_SUM = ti.field(dtype=ti.i32, shape=(_GRID_COL_N,))
-    _F_PREFIX_SUM = ti.field(dtype=ti.i32, shape=(_GRID_COL_N, _GRID_ROW_N))
+    global _F_CAT_CELL
+    _F_CAT_CELL = ti.field(dtype=ti.i32, shape=(_CATS_N,))
+
+    global _F_PAIR_CHECKS, _F_PAIR_CHECKS_SKIPPED
+    _F_PAIR_CHECKS = ti.field(dtype=ti.i64, shape=())
+    _F_PAIR_CHECKS_SKIPPED = ti.field(dtype=ti.i64, shape=())
+
+    global _F_MAX_OCCUPANCY, _F_MAX_LEAF_OCCUPANCY, _F_SPLIT_N
+    _F_MAX_OCCUPANCY = ti.field(dtype=ti.i32, shape=())
+    _F_MAX_LEAF_OCCUPANCY = ti.field(dtype=ti.i32, shape=())
+    _F_SPLIT_N = ti.field(dtype=ti.i32, shape=())
+
+    global _SPLIT_FACTOR, _SPLIT_THRESHOLD, _SUB_CELL_SZ
+    _SPLIT_FACTOR = split_factor
+    _SPLIT_THRESHOLD = split_threshold
+    _SUB_CELL_SZ = _CELL_SZ / _SPLIT_FACTOR
+
+    if _SPLIT_FACTOR > 1:
+        global _F_CELL_SPLIT, _F_SPLIT_CELLS, _F_SUB_HEADS, _F_SUB_CUR, _F_CAT_SUB
+        # a split cell holds more than split_threshold cats
+        split_n = min(_CELL_N, _CATS_N // (_SPLIT_THRESHOLD + 1) + 1)
+        sub_n = _SPLIT_FACTOR * _SPLIT_FACTOR
+        _F_CELL_SPLIT = ti.field(dtype=ti.i32, shape=(_CELL_N,))
+        _F_SPLIT_CELLS = ti.field(dtype=ti.i32, shape=(split_n,))
+        _F_SUB_HEADS = ti.field(dtype=ti.i32, shape=(split_n, sub_n + 1))
+        _F_SUB_CUR = ti.field(dtype=ti.i32, shape=(split_n, sub_n))
+        _F_CAT_SUB = ti.field(dtype=ti.i32, shape=(_CATS_N,))
+
+    if incremental and split_factor > 1:
+        raise ValueError("Incremental cell storage needs cells without splitting")
+
+    global _INCREMENTAL, _STORAGE_VALID, _MIGRATION_STATS
+    _INCREMENTAL = incremental
+    _STORAGE_VALID = False
+    _MIGRATION_STATS = {"migrants": 0, "rebuilt": False}
+
+    if _INCREMENTAL:
+        global _F_MIGRANTS, _F_MIGRANT_N, _F_PREV_HEADS, _F_PREV_STORAGE
+        _F_MIGRANTS = ti.field(dtype=ti.i32, shape=(_CATS_N,))
+        _F_MIGRANT_N = ti.field(dtype=ti.i32, shape=())
+        _F_PREV_HEADS = ti.field(dtype=ti.i32, shape=(_CELL_N + 1,))
+        _F_PREV_STORAGE = ti.field(dtype=ti.i32, shape=(_CATS_N,))
+
+    global _SCAN_BLOCK_SZ, _F_CELL_CUR, _F_CAT_PER_CELL, _F_BLOCK_SUM
+    _SCAN_BLOCK_SZ = scan_block_size(_CELL_N)
+    _F_CAT_PER_CELL = ti.field(dtype=ti.i32, shape=(_CELL_N,))
     _F_CELL_CUR = ti.field(dtype=ti.i32, shape=(_CELL_N,))
+    _F_BLOCK_SUM = ti.field(dtype=ti.i32, shape=(math.ceil(_CELL_N / _SCAN_BLOCK_SZ),))
+
+
+def set_cat_n(cat_n: int):
+    """number of cats of the next updates (only with setup_grid(variable_n=True))"""
+    if not _VARIABLE_N:
+        raise ValueError("The number of cats is fixed, see setup_grid(variable_n)")
+    if not 0 <= cat_n <= _CATS_N:
+        raise ValueError(f"{cat_n} cats do not fit into {_CATS_N}")
+    _F_CAT_N[None] = cat_n
 
 
 @ti.func
-def init_cell_storage(cats: ti.template()):
+def _cat_n() -> ti.i32:
+    n = _CATS_N
+    if ti.static(_VARIABLE_N):
+        n = _F_CAT_N[None]
+    return n
+
+
+@ti.func
+def _grid_point(point: tm.vec2) -> tm.vec2:
+    """`point` relative to _ORIGIN"""
+    local = point
+    if ti.static(_ORIGIN != (0.0, 0.0)):
+        local = point - tm.vec2(_ORIGIN[0], _ORIGIN[1])
+    return local
+
+
+@ti.func
+def cell_of(point: tm.vec2) -> ti.i32:
+    """
+    linearized index of the cell containing `point` in the first replica
+    (points on the border are clamped)
+    """
+    cell_idx = ti.floor(_grid_point(point) / _CELL_SZ, ti.i32)
+    col = ti.min(ti.max(cell_idx[0], 0), _GRID_COL_N - 1)
+    row = ti.min(ti.max(cell_idx[1], 0), _GRID_ROW_N - 1)
+    return col * _GRID_ROW_N + row
+
+
+@ti.func
+def cat_replica(idx: ti.i32) -> ti.i32:
+    replica = 0
+    if ti.static(_REPLICA_N > 1):
+        replica = idx // _REPLICA_CATS_N
+    return replica
+
+
+@ti.func
+def _plane_cell(cell_lin_idx: ti.i32) -> tm.ivec2:
+    """(col, row) of the cell"""
+    plane_idx = cell_lin_idx
+    if ti.static(_REPLICA_N > 1):
+        plane_idx = cell_lin_idx % _PLANE_CELL_N
+    return tm.ivec2(plane_idx // _GRID_ROW_N, plane_idx % _GRID_ROW_N)
+
+
+@ti.func
+def _cell_origin(cell_lin_idx: ti.i32) -> tm.vec2:
+    """corner of the cell relative to _ORIGIN"""
+    return ti.cast(_plane_cell(cell_lin_idx), ti.f32) * _CELL_SZ
+
+
+@ti.func
+def _sub_cell_of(point: tm.vec2, cell_lin_idx: ti.i32) -> ti.i32:
+    sub_idx = ti.floor(
+        (_grid_point(point) - _cell_origin(cell_lin_idx)) / _SUB_CELL_SZ, ti.i32
+    )
+    sub_col = ti.min(ti.max(sub_idx[0], 0), _SPLIT_FACTOR - 1)
+    sub_row = ti.min(ti.max(sub_idx[1], 0), _SPLIT_FACTOR - 1)
+    return sub_col * _SPLIT_FACTOR + sub_row
+
+
+@ti.func
+def _sub_span(point: tm.vec2, cell_lin_idx: ti.i32) -> tm.ivec4:
+    """(first col, last col, first row, last row) of the subcells near `point`"""
+    local = _grid_point(point) - _cell_origin(cell_lin_idx)
+    lo = ti.floor((local - _RADIUS_1) / _SUB_CELL_SZ, ti.i32)
+    hi = ti.floor((local + _RADIUS_1) / _SUB_CELL_SZ, ti.i32)
+    lo = ti.min(ti.max(lo, 0), _SPLIT_FACTOR - 1)
+    hi = ti.min(ti.max(hi, 0), _SPLIT_FACTOR - 1)
+    return tm.ivec4(lo[0], hi[0], lo[1], hi[1])
+
+
+@ti.func
+def _cat_cell_lin_idx(cats: ti.template(), idx: ti.i32) -> ti.i32:
+    return cell_of(cats[idx].point) + cat_replica(idx) * _PLANE_CELL_N
+
+
+@ti.func
+def _bin_cat(cats: ti.template(), idx: ti.i32):
+    cell_lin_idx = _cat_cell_lin_idx(cats, idx)
+    _F_CAT_CELL[idx] = cell_lin_idx
+    ti.atomic_add(_F_CAT_PER_CELL[cell_lin_idx], 1)
+
+    if ti.static(_SPLIT_FACTOR > 1):
+        _F_CAT_SUB[idx] = _sub_cell_of(cats[idx].point, cell_lin_idx)
+
+
+@ti.func
+def _split_dense_cells():
+    """builds F_SUB_HEADS for cells with more than SPLIT_THRESHOLD cats"""
+    _F_SPLIT_N[None] = 0
+
+    for cell_lin_idx in range(_CELL_N):
+        slot = -1
+        if _F_CAT_PER_CELL[cell_lin_idx] > _SPLIT_THRESHOLD:
+            slot = ti.atomic_add(_F_SPLIT_N[None], 1)
+            _F_SPLIT_CELLS[slot] = cell_lin_idx
+        _F_CELL_SPLIT[cell_lin_idx] = slot
+
+    for slot, sub_lin_idx in ti.ndrange(_F_SPLIT_N[None], _SPLIT_FACTOR**2):
+        _F_SUB_CUR[slot, sub_lin_idx] = 0
+
+    for idx in range(_cat_n()):
+        slot = _F_CELL_SPLIT[_F_CAT_CELL[idx]]
+        if slot >= 0:
+            ti.atomic_add(_F_SUB_CUR[slot, _F_CAT_SUB[idx]], 1)
+
+    for slot in range(_F_SPLIT_N[None]):
+        head = _F_CELL_HEADS[_F_SPLIT_CELLS[slot]]
+        for sub_lin_idx in range(_SPLIT_FACTOR**2):
+            count = _F_SUB_CUR[slot, sub_lin_idx]
+            ti.atomic_max(_F_MAX_LEAF_OCCUPANCY[None], count)
+            _F_SUB_HEADS[slot, sub_lin_idx] = head
+            _F_SUB_CUR[slot, sub_lin_idx] = head
+            head += count
+        _F_SUB_HEADS[slot, _SPLIT_FACTOR**2] = head
+
+
+@ti.func
+def _count_cats(cats: ti.template()):
     _F_CAT_PER_CELL.fill(0)
 
-    for idx in range(_CATS_N):
-        cell_idx = ti.floor(cats[idx].point / _CELL_SZ, ti.i32)
-        ti.atomic_add(_F_CAT_PER_CELL[cell_idx], 1)
-
-    for col in range(_GRID_COL_N):
-        _sum = 0
-        for row in range(_GRID_ROW_N):
-            _sum += _F_CAT_PER_CELL[col, row]
-        _F_COLUMN_SUM[col] = _sum
-
-    # Compute NOT in parallel
-    _F_PREFIX_SUM[0, 0] = 0
-    ti.loop_config(serialize=True)
-    for col in range(1, _GRID_COL_N):
-        _F_PREFIX_SUM[col, 0] = _F_PREFIX_SUM[col - 1, 0] + _F_COLUMN_SUM[col - 1]
-
-    for col in range(_GRID_COL_N):
-        for row in range(_GRID_ROW_N):
-            if row == 0:
-                _F_PREFIX_SUM[col, row] += _F_CAT_PER_CELL[col, row]
-            else:
-                _F_PREFIX_SUM[col, row] = (
-                    _F_PREFIX_SUM[col, row - 1] + _F_CAT_PER_CELL[col, row]
-                )
+    for idx in range(_cat_n()):
+        _bin_cat(cats, idx)
 
-            cell_lin_idx = col * _GRID_ROW_N + row
-            head = _F_PREFIX_SUM[col, row] - _F_CAT_PER_CELL[col, row]
-            _F_CELL_HEADS[cell_lin_idx] = head
-            _F_CELL_CUR[cell_lin_idx] = head
-    _F_CELL_HEADS[_CELL_N] = _F_PREFIX_SUM[_GRID_COL_N - 1, _GRID_ROW_N - 1]
 
-    for idx in range(_CATS_N):
-        cell_idx = ti.floor(cats[idx].point / _CELL_SZ, ti.i32)
-        cell_lin_idx = cell_idx[0] * _GRID_ROW_N + cell_idx[1]
-        cat_cell_location = ti.atomic_add(_F_CELL_CUR[cell_lin_idx], 1)
+@ti.func
+def _scan_cells():
+    """cats must be binned (see _bin_cat) before the call"""
+    exclusive_scan(
+        _F_CAT_PER_CELL, _F_CELL_HEADS, _F_BLOCK_SUM, _CELL_N, _SCAN_BLOCK_SZ
+    )
+
+    _F_MAX_OCCUPANCY[None] = 0
+    _F_MAX_LEAF_OCCUPANCY[None] = 0
+
+    if ti.static(_SPLIT_FACTOR > 1):
+        _split_dense_cells()
+
+    for cell_lin_idx in range(_CELL_N):
+        _F_CELL_CUR[cell_lin_idx] = _F_CELL_HEADS[cell_lin_idx]
+
+        count = _F_CAT_PER_CELL[cell_lin_idx]
+        ti.atomic_max(_F_MAX_OCCUPANCY[None], count)
+        if ti.static(_SPLIT_FACTOR > 1):
+            if _F_CELL_SPLIT[cell_lin_idx] < 0:
+                ti.atomic_max(_F_MAX_LEAF_OCCUPANCY[None], count)
+        else:
+            ti.atomic_max(_F_MAX_LEAF_OCCUPANCY[None], count)
+
+
+@ti.func
+def _scatter_cats():
+    for idx in range(_cat_n()):
+        cell_lin_idx = _F_CAT_CELL[idx]
+        cat_cell_location = 0
+        if ti.static(_SPLIT_FACTOR > 1):
+            slot = _F_CELL_SPLIT[cell_lin_idx]
+            if slot >= 0:
+                cat_cell_location = ti.atomic_add(_F_SUB_CUR[slot, _F_CAT_SUB[idx]], 1)
+            else:
+                cat_cell_location = ti.atomic_add(_F_CELL_CUR[cell_lin_idx], 1)
+        else:
+            cat_cell_location = ti.atomic_add(_F_CELL_CUR[cell_lin_idx], 1)
         _F_CELL_STORAGE[cat_cell_location] = idx
 
 
+@ti.func
+def _fill_cell_storage():
+    """cats must be binned (see _bin_cat) before the call"""
+    _scan_cells()
+    _scatter_cats()
+
+
+@ti.func
+def init_cell_storage(cats: ti.template()):
+    _count_cats(cats)
+    _fill_cell_storage()
+
+
+@ti.func
+def cat_in_cell_order(j: ti.i32) -> ti.i32:
+    """index of the j-th cat when cats are sorted by cell (valid after update_statuses)"""
+    return _F_CELL_STORAGE[j]
+
+
+@ti.func
+def cat_cell(idx: ti.i32) -> tm.ivec2:
+    """(col, row) of the cell of the cat (valid after update_statuses)"""
+    return _plane_cell(_F_CAT_CELL[idx])
+
+
+@ti.func
+def cell_range(cell: tm.ivec2, replica: ti.i32) -> tm.ivec2:
+    """
+    [begin; end) of the (col, row) cell of the replica in cat_in_cell_order(),
+    empty outside the grid
+    """
+    head_tail = tm.ivec2(0, 0)
+    if 0 <= cell[0] < _GRID_COL_N and 0 <= cell[1] < _GRID_ROW_N:
+        cell_lin_idx = replica * _PLANE_CELL_N + cell[0] * _GRID_ROW_N + cell[1]
+        head_tail = tm.ivec2(
+            _F_CELL_HEADS[cell_lin_idx], _F_CELL_HEADS[cell_lin_idx + 1]
+        )
+    return head_tail
+
+
+@ti.func
+def grid_size() -> tm.ivec2:
+    """(columns, rows) of the cells of one replica"""
+    return tm.ivec2(_GRID_COL_N, _GRID_ROW_N)
+
+
+@ti.func
+def cell_span(lo: tm.vec2, hi: tm.vec2) -> tm.ivec4:
+    """
+    (first col, last col, first row, last row) of the cells intersecting the
+    rectangle [lo; hi] (clamped to the grid, so never empty)
+    """
+    lo_idx = ti.floor(_grid_point(lo) / _CELL_SZ, ti.i32)
+    hi_idx = ti.floor(_grid_point(hi) / _CELL_SZ, ti.i32)
+    lo_idx = ti.min(ti.max(lo_idx, 0), grid_size() - 1)
+    hi_idx = ti.min(ti.max(hi_idx, 0), grid_size() - 1)
+    return tm.ivec4(lo_idx[0], hi_idx[0], lo_idx[1], hi_idx[1])
+
+
+@ti.func
+def span_rect(span: tm.ivec4) -> tm.vec4:
+    """(lo x, lo y, hi x, hi y) of the area covered by the cells of cell_span()"""
+    origin = tm.vec2(_ORIGIN[0], _ORIGIN[1])
+    lo = origin + tm.vec2(span[0], span[2]) * _CELL_SZ
+    hi = origin + tm.vec2(span[1] + 1, span[3] + 1) * _CELL_SZ
+    return tm.vec4(lo[0], lo[1], hi[0], hi[1])
+
+
+@ti.func
+def pair_checks() -> ti.i64:
+    """number of `fight_with` calls of the last update"""
+    return _F_PAIR_CHECKS[None]
+
+
+@ti.func
+def max_cell_occupancy() -> ti.i32:
+    """maximum number of cats in one cell at the last update"""
+    return _F_MAX_OCCUPANCY[None]
+
+
+def get_pair_check_stats() -> dict:
+    return {
+        "checked": int(_F_PAIR_CHECKS[None]),
+        "skipped": int(_F_PAIR_CHECKS_SKIPPED[None]),
+    }
+
+
+def get_occupancy_stats() -> dict:
+    return {
+        "max_cell": int(_F_MAX_OCCUPANCY[None]),
+        "max_leaf": int(_F_MAX_LEAF_OCCUPANCY[None]),
+        "split_cells": int(_F_SPLIT_N[None]) if _SPLIT_FACTOR > 1 else 0,
+    }
+
+
 @ti.kernel
-def update_statuses(cats: ti.template(), distance_type: ti.i32):
+def update_statuses(cats: ti.template(), distance_type: ti.template()):
+    """
+    Checks cats of neighbour cells, own cell first.
+    The scan of a cat stops once it gets INTERACTION_LEVEL_0 (maximum status).
+    """
     init_cell_storage(cats)
+    _fight_full_stencil(cats, distance_type, NO_CONTACTS)
+
+
+@ti.kernel
+def update_statuses_symmetric(cats: ti.template(), distance_type: ti.template()):
+    """
+    Same result as update_statuses(), but every unordered pair of cats is
+    checked once (half stencil): a cat is paired with the cats stored after it
+    in its own cell and with all cats of "forward" neighbour cells.
+    Both cats of the pair are updated with atomic max; with PROB_INTER each
+    of them makes its own random draw, as in update_statuses().
+    """
+    init_cell_storage(cats)
+    _fight_half_stencil(cats, distance_type, NO_CONTACTS)
+
+
+@ti.kernel
+def move_and_update_statuses(
+    cats: ti.template(), distance_type: ti.template(), stencil: ti.template()
+):
+    """
+    move_cats() + update_statuses() (or update_statuses_symmetric()) in one
+    kernel: every cat is binned into its cell in the same pass it is moved.
+    """
+    _F_CAT_PER_CELL.fill(0)
+
+    tick()
+    for idx in range(_cat_n()):
+        cats[idx].move()
+        _bin_cat(cats, idx)
+
+    _fill_cell_storage()
+    fight_neighbours(cats, distance_type, stencil, NO_CONTACTS)
+
+
+"""
+Phases of update_statuses() as separate kernels (for profiling, see profiler.py):
+    count_cats -> scan_cells -> scatter_cats -> fight_cats
+    - the result is the same as of one update_statuses() call
+    - cats is passed to all of them, so they are compiled again for new fields
+"""
+
+
+@ti.kernel
+def count_cats(cats: ti.template()):
+    """bins every cat into its cell and counts cats per cell"""
+    _count_cats(cats)
+
+
+@ti.kernel
+def scan_cells(cats: ti.template()):
+    """heads of the cells (prefix sum of the counts), splits dense cells"""
+    _scan_cells()
+
+
+@ti.kernel
+def scatter_cats(cats: ti.template()):
+    """writes cats into F_CELL_STORAGE in cell order"""
+    _scatter_cats()
+
+
+@ti.kernel
+def fight_cats(
+    cats: ti.template(), distance_type: ti.template(), stencil: ti.template()
+):
+    """the neighbour loop of update_statuses() (or update_statuses_symmetric())"""
+    fight_neighbours(cats, distance_type, stencil, NO_CONTACTS)
+
+
+@ti.kernel
+def find_migrants(cats: ti.template()):
+    """lists cats which changed their cell since the last update, see _INCREMENTAL"""
+    _F_MIGRANT_N[None] = 0
+
+    for idx in range(_cat_n()):
+        cell_lin_idx = _cat_cell_lin_idx(cats, idx)
+        prev_cell_lin_idx = _F_CAT_CELL[idx]
+
+        if cell_lin_idx != prev_cell_lin_idx:
+            _F_MIGRANTS[ti.atomic_add(_F_MIGRANT_N[None], 1)] = idx
+            ti.atomic_sub(_F_CAT_PER_CELL[prev_cell_lin_idx], 1)
+            ti.atomic_add(_F_CAT_PER_CELL[cell_lin_idx], 1)
+            _F_CAT_CELL[idx] = cell_lin_idx
+
+
+@ti.kernel
+def patch_cells(cats: ti.template()):
+    """
+    F_CELL_STORAGE after find_migrants(), see _INCREMENTAL: a full rewrite of
+    the storage (and a scan of all heads), without atomics for the cats which
+    stayed in their cells
+    """
+    for cell_lin_idx in range(_CELL_N + 1):
+        _F_PREV_HEADS[cell_lin_idx] = _F_CELL_HEADS[cell_lin_idx]
+
+    for j in range(_cat_n()):
+        _F_PREV_STORAGE[j] = _F_CELL_STORAGE[j]
+
+    _scan_cells()
+
+    for cell_lin_idx in range(_CELL_N):
+        cur = _F_CELL_HEADS[cell_lin_idx]
+        for j in range(_F_PREV_HEADS[cell_lin_idx], _F_PREV_HEADS[cell_lin_idx + 1]):
+            idx = _F_PREV_STORAGE[j]
+            if _F_CAT_CELL[idx] == cell_lin_idx:
+                _F_CELL_STORAGE[cur] = idx
+                cur += 1
+        _F_CELL_CUR[cell_lin_idx] = cur
 
-    for idx1 in range(_CATS_N):
-        cell_idx = ti.floor(cats[idx1].point / _CELL_SZ, ti.i32)
-
-        x_begin = max(cell_idx[0] - 1, 0)
-        x_end = min(cell_idx[0] + 2, _GRID_COL_N)
-        y_begin = max(cell_idx[1] - 1, 0)
-        y_end = min(cell_idx[1] + 2, _GRID_ROW_N)
-
-        for cell_col in range(x_begin, x_end):
-            for cell_row in range(y_begin, y_end):
-                neighbour_lin_idx = cell_col * _GRID_ROW_N + cell_row
-                for _idx2 in range(
-                    _F_CELL_HEADS[neighbour_lin_idx],
-                    _F_CELL_HEADS[neighbour_lin_idx + 1],
-                ):
-                    idx2 = _F_CELL_STORAGE[_idx2]
-
-                    if idx1 != idx2:
-                        cats[idx1].fight_with(cats[idx2], distance_type)
+    for m in range(_F_MIGRANT_N[None]):
+        idx = _F_MIGRANTS[m]
+        _F_CELL_STORAGE[ti.atomic_add(_F_CELL_CUR[_F_CAT_CELL[idx]], 1)] = idx
+
+
+def update_cell_storage(cats: ti.template(), threshold: float):
+    """
+    init_cell_storage() of update_statuses() done incrementally, see _INCREMENTAL
+    (fight_cats() does the rest of the update)
+    """
+    global _STORAGE_VALID, _MIGRATION_STATS
+
+    migrant_n = 0
+    if _STORAGE_VALID:
+        find_migrants(cats)
+        migrant_n = int(_F_MIGRANT_N[None])
+
+    rebuild = not _STORAGE_VALID or migrant_n > threshold * _CATS_N
+    if rebuild:
+        count_cats(cats)
+        scan_cells(cats)
+        scatter_cats(cats)
+        _STORAGE_VALID = True
+    elif migrant_n > 0:
+        patch_cells(cats)
+
+    _MIGRATION_STATS = {"migrants": migrant_n, "rebuilt": rebuild}
+
+
+def invalidate_cell_storage():
+    """the next update_cell_storage() rebuilds the storage (cats were changed)"""
+    global _STORAGE_VALID
+    _STORAGE_VALID = False
+
+
+def get_migration_stats() -> dict:
+    """
+    migrants: cats which changed their cell at the last update_cell_storage()
+    (0 if the storage was invalidated), rebuilt: it rebuilt the storage in full
+    """
+    return dict(_MIGRATION_STATS)
+
+
+@ti.func
+def _neighbour_offset(k: ti.i32) -> tm.ivec2:
+    """k-th of _NEIGHBOUR_N offsets: (0, 0), then the others by columns"""
+    side = 2 * _REACH + 1
+    j = k - 1
+    if j >= _NEIGHBOUR_N // 2:
+        j += 1  # skip own cell
+    if k == 0:
+        j = _NEIGHBOUR_N // 2
+    return tm.ivec2(j // side - _REACH, j % side - _REACH)
+
+
+@ti.func
+def _forward_offset(k: ti.i32) -> tm.ivec2:
+    """k-th of _FORWARD_N offsets: (0, 0), then the offsets after it by columns"""
+    j = _NEIGHBOUR_N // 2 + k
+    side = 2 * _REACH + 1
+    return tm.ivec2(j // side - _REACH, j % side - _REACH)
+
+
+@ti.func
+def _fight_full_stencil(
+    cats: ti.template(), distance_type: ti.template(), contacts: ti.template()
+):
+    _F_PAIR_CHECKS[None] = 0
+    _F_PAIR_CHECKS_SKIPPED[None] = 0
+
+    for idx1 in range(_cat_n()):
+        cell = cat_cell(idx1)
+
+        # (candidates, checked), the cat itself is not a candidate
+        counts = tm.ivec2(-1, 0)
+
+        if ti.static(_UNROLL_STENCIL):
+            for k in ti.static(range(_NEIGHBOUR_N)):
+                counts += _fight_with_neighbour(
+                    cats,
+                    idx1,
+                    cell + _neighbour_offset(k),
+                    0,
+                    distance_type,
+                    False,
+                    contacts,
+                )
+        else:
+            for k in range(_NEIGHBOUR_N):
+                counts += _fight_with_neighbour(
+                    cats,
+                    idx1,
+                    cell + _neighbour_offset(k),
+                    0,
+                    distance_type,
+                    False,
+                    contacts,
+                )
+
+        _F_PAIR_CHECKS[None] += counts[1]
+        _F_PAIR_CHECKS_SKIPPED[None] += counts[0] - counts[1]
+
+
+@ti.func
+def _fight_half_stencil(
+    cats: ti.template(), distance_type: ti.template(), contacts: ti.template()
+):
+    _F_PAIR_CHECKS[None] = 0
+    _F_PAIR_CHECKS_SKIPPED[None] = 0
+
+    for _idx1 in range(_cat_n()):
+        idx1 = _F_CELL_STORAGE[_idx1]
+        cell = cat_cell(idx1)
+
+        # own cell: only the cats stored after this one
+        checked = _fight_with_neighbour(
+            cats, idx1, cell, _idx1 + 1, distance_type, True, contacts
+        )[1]
+
+        if ti.static(_UNROLL_STENCIL):
+            for k in ti.static(range(1, _FORWARD_N)):
+                checked += _fight_with_neighbour(
+                    cats,
+                    idx1,
+                    cell + _forward_offset(k),
+                    0,
+                    distance_type,
+                    True,
+                    contacts,
+                )[1]
+        else:
+            for k in range(1, _FORWARD_N):
+                checked += _fight_with_neighbour(
+                    cats,
+                    idx1,
+                    cell + _forward_offset(k),
+                    0,
+                    distance_type,
+                    True,
+                    contacts,
+                )[1]
+
+        _F_PAIR_CHECKS[None] += checked
+
+
+@ti.func
+def _fight_with_neighbour(
+    cats: ti.template(),
+    idx1: ti.i32,
+    cell: tm.ivec2,
+    first: ti.i32,
+    distance_type: ti.template(),
+    symmetric: ti.template(),
+    contacts: ti.template(),
+) -> tm.ivec2:
+    """
+    _fight_with_cell() for the (col, row) cell of the replica of idx1,
+    nothing if it is out of the grid
+    """
+    counts = tm.ivec2(0, 0)
+    if 0 <= cell[0] < _GRID_COL_N and 0 <= cell[1] < _GRID_ROW_N:
+        counts = _fight_with_cell(
+            cats,
+            idx1,
+            cat_replica(idx1) * _PLANE_CELL_N + cell[0] * _GRID_ROW_N + cell[1],
+            first,
+            distance_type,
+            symmetric,
+            contacts,
+        )
+    return counts
+
+
+@ti.func
+def _fight_with_cell(
+    cats: ti.template(),
+    idx1: ti.i32,
+    cell_lin_idx: ti.i32,
+    first: ti.i32,
+    distance_type: ti.template(),
+    symmetric: ti.template(),
+    contacts: ti.template(),
+) -> tm.ivec2:
+    """
+    Pairs cat idx1 with the cats of the cell stored at positions >= first
+    (only with the nearby subcells if the cell is split).
+    Returns (candidates, checked).
+    """
+    counts = tm.ivec2(0, 0)
+
+    # a split cell is scanned by columns of subcells, the other one at once
+    slot = -1
+    span = tm.ivec4(0, 0, 0, 0)
+    if ti.static(_SPLIT_FACTOR > 1):
+        slot = _F_CELL_SPLIT[cell_lin_idx]
+        if slot >= 0:
+            span = _sub_span(cats[idx1].point, cell_lin_idx)
+
+    for sub_col in range(span[0], span[1] + 1):
+        begin = _F_CELL_HEADS[cell_lin_idx]
+        end = _F_CELL_HEADS[cell_lin_idx + 1]
+        # compile time check, then the run time one
+        if ti.static(_SPLIT_FACTOR > 1):  # noqa: SIM102
+            if slot >= 0:
+                sub_lin_idx = sub_col * _SPLIT_FACTOR
+                begin = _F_SUB_HEADS[slot, sub_lin_idx + span[2]]
+                end = _F_SUB_HEADS[slot, sub_lin_idx + span[3] + 1]
+
+        counts += _fight_with_range(
+            cats, idx1, ti.max(first, begin), end, distance_type, symmetric, contacts
+        )
+
+    return counts
+
+
+@ti.func
+def _fight_with_range(
+    cats: ti.template(),
+    idx1: ti.i32,
+    begin: ti.i32,
+    end: ti.i32,
+    distance_type: ti.template(),
+    symmetric: ti.template(),
+    contacts: ti.template(),
+) -> tm.ivec2:
+    """
+    returns (candidates, checked) of F_CELL_STORAGE[begin; end);
+    contacts: NO_CONTACTS or a buffer of interacting pairs (see contacts.py)
+    """
+    checked = 0
+
+    for _idx2 in range(begin, end):
+        idx2 = _F_CELL_STORAGE[_idx2]
+
+        if ti.static(symmetric):
+            level = fight_symmetric(cats, idx1, idx2, distance_type)
+            if ti.static(contacts.enabled):
+                contacts.add(cats[idx1].id, cats[idx2].id, level)
+            checked += 1
+        elif ti.static(contacts.enabled):
+            # every pair is listed, so the scan does not stop at INTERACTION_LEVEL_0
+            if idx1 != idx2:
+                _fight_and_list(cats, idx1, idx2, distance_type, contacts)
+                checked += 1
+        else:
+            if cats[idx1].status == INTERACTION_LEVEL_0:
+                break
+
+            if idx1 != idx2:
+                cats[idx1].fight_with(cats[idx2], distance_type)
+                checked += 1
+
+    return tm.ivec2(ti.max(end - begin, 0), checked)
+
+
+@ti.func
+def fight_neighbours(
+    cats: ti.template(),
+    distance_type: ti.template(),
+    stencil: ti.template(),
+    contacts: ti.template(),
+):
+    """
+    the neighbour loop of fight_cats() which also lists interacting pairs
+    into `contacts` (see contacts.py), the cell storage must be valid
+    """
+    if ti.static(stencil == HALF_STENCIL):
+        _fight_half_stencil(cats, distance_type, contacts)
+    else:
+        _fight_full_stencil(cats, distance_type, contacts)
+
+
+@ti.func
+def _fight_and_list(
+    cats: ti.template(),
+    idx1: ti.i32,
+    idx2: ti.i32,
+    distance_type: ti.template(),
+    contacts: ti.template(),
+):
+    """fight_with() of the full stencil which also lists the pair"""
+    key = get_distance_key(cats[idx1].point, cats[idx2].point, distance_type)
+    level = cats[idx1].fight_at(cats[idx2], key, distance_type)
+
+    # the pair is checked from both cats, listed from the one with the lower id;
+    # the level is the same both ways except a hiss with PROB_INTER, so the other
+    # cat draws only if this one did not interact (no draw beyond RADIUS_1)
+    id1, id2 = cats[idx1].id, cats[idx2].id
+    if id1 < id2:
+        if level == INTERACTION_NO:
+            level = interaction_level(key, distance_type, id2, id1)
+        contacts.add(id1, id2, level)
+
+
+@ti.func
+def fight_symmetric(
+    cats: ti.template(), idx1: ti.i32, idx2: ti.i32, distance_type: ti.template()
+) -> ti.i32:
+    """updates both cats of the pair with atomic max, returns the higher level"""
+    key = get_distance_key(cats[idx1].point, cats[idx2].point, distance_type)
+    id1, id2 = cats[idx1].id, cats[idx2].id
+    level1 = interaction_level(key, distance_type, id1, id2)
+    level2 = interaction_level(key, distance_type, id2, id1)
+    ti.atomic_max(cats[idx1].status, level1)
+    ti.atomic_max(cats[idx2].status, level2)
+    return ti.max(level1, level2)
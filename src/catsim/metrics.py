@@ -0,0 +1,219 @@
+from typing import Any
+
+import numpy as np
+import taichi as ti
+import taichi.math as tm
+
+from catsim.constants import INTERACTION_LEVEL_0
+from catsim.grid import max_cell_occupancy, pair_checks
+from catsim.verlet import verlet_pair_checks
+
+__all__ = [
+    "export_metrics",
+    "get_heatmap",
+    "record_metrics",
+    "reset_metrics",
+    "setup_metrics",
+]
+
+"""
+Per-step statistics reduced on the device:
+    - record_metrics() counts cats of every INTERACTION_* level (per replica),
+      takes the pair checks and the maximum cell occupancy of the last update
+      and writes them into the next slot of a ring buffer of HISTORY steps
+    - export_metrics() copies only the records added since the previous export
+      (a few bytes per step instead of the whole status field)
+"""
+
+# global settings
+_CATS_N: ti.i32
+_REPLICA_N: ti.i32
+_HISTORY: ti.i32
+_HEATMAP_SIZE: ti.i32
+_PLATE_SIZE: tm.vec2
+
+# cats counted serially by one thread before its counts are added atomically
+_COUNT_BLOCK_SZ = 4096
+
+"""
+ring buffer of the recorded steps:
+    - size := history
+    - record k is stored in slot k % history
+    - F_RING_STATUSES[slot, replica, level] is the number of cats with status level
+    - F_RING_PAIR_CHECKS: pair checks of the step per cat
+    - F_RING_MAX_CELL: maximum number of cats in one cell
+      (VERLET_ENGINE: at the last build of the lists)
+"""
+_F_RING_STEP: Any
+_F_RING_STATUSES: Any
+_F_RING_PAIR_CHECKS: Any
+_F_RING_MAX_CELL: Any
+
+"""
+contains number of cats of every level in every bin at the last record:
+    - shape := (heatmap_size, heatmap_size, INTERACTION_LEVEL_0 + 1)
+    - bins split the plate evenly, all replicas are summed
+    - only if heatmap_size > 0
+"""
+_F_HEATMAP: Any
+
+# number of records written and already exported
+_RECORDED: int = 0
+_EXPORTED: int = 0
+
+
+def setup_metrics(
+    cat_n: ti.i32,
+    width: ti.i32,
+    height: ti.i32,
+    history: ti.i32 = 1024,
+    replica_n: ti.i32 = 1,
+    heatmap_size: ti.i32 = 0,
+):
+    """
+    cat_n: number of cats in one replica
+    history: number of steps kept between two exports
+    heatmap_size: number of heatmap bins along each side (0 - no heatmap)
+    """
+    global _CATS_N, _REPLICA_N, _HISTORY, _HEATMAP_SIZE, _PLATE_SIZE
+    _CATS_N = cat_n
+    _REPLICA_N = replica_n
+    _HISTORY = history
+    _HEATMAP_SIZE = heatmap_size
+    _PLATE_SIZE = tm.vec2(width, height)
+
+    global _F_RING_STEP, _F_RING_STATUSES, _F_RING_PAIR_CHECKS, _F_RING_MAX_CELL
+    _F_RING_STEP = ti.field(dtype=ti.i32, shape=(_HISTORY,))
+    _F_RING_STATUSES = ti.field(
+        dtype=ti.i32, shape=(_HISTORY, _REPLICA_N, INTERACTION_LEVEL_0 + 1)
+    )
+    _F_RING_PAIR_CHECKS = ti.field(dtype=ti.f32, shape=(_HISTORY,))
+    _F_RING_MAX_CELL = ti.field(dtype=ti.i32, shape=(_HISTORY,))
+
+    if _HEATMAP_SIZE > 0:
+        global _F_HEATMAP
+        _F_HEATMAP = ti.field(
+            dtype=ti.i32,
+            shape=(_HEATMAP_SIZE, _HEATMAP_SIZE, INTERACTION_LEVEL_0 + 1),
+        )
+
+    reset_metrics()
+
+
+def reset_metrics():
+    """forgets all records (the fields are kept)"""
+    global _RECORDED, _EXPORTED
+    _RECORDED = 0
+    _EXPORTED = 0
+
+
+@ti.kernel
+def _record(
+    cats: ti.template(),
+    ring_statuses: ti.template(),
+    slot: ti.i32,
+    step_idx: ti.i32,
+    verlet: ti.template(),
+):
+    """
+    ring_statuses is F_RING_STATUSES: kernels are compiled again (and read the
+    other fields and settings again) after setup_metrics()
+    """
+    for level in range(INTERACTION_LEVEL_0 + 1):
+        for replica in range(_REPLICA_N):
+            ring_statuses[slot, replica, level] = 0
+
+    # every thread counts a block of one replica in registers,
+    # so there are only (levels) atomics per block
+    block_n = (_CATS_N + _COUNT_BLOCK_SZ - 1) // _COUNT_BLOCK_SZ
+    for replica, block in ti.ndrange(_REPLICA_N, block_n):
+        begin = replica * _CATS_N + block * _COUNT_BLOCK_SZ
+        end = ti.min(begin + _COUNT_BLOCK_SZ, (replica + 1) * _CATS_N)
+
+        counts = ti.Vector([0] * (INTERACTION_LEVEL_0 + 1))
+        for idx in range(begin, end):
+            counts[ti.cast(cats[idx].status, ti.i32)] += 1
+
+        for level in ti.static(range(INTERACTION_LEVEL_0 + 1)):
+            ti.atomic_add(ring_statuses[slot, replica, level], counts[level])
+
+    checked = ti.i64(0)
+    if ti.static(verlet):
+        checked = verlet_pair_checks()
+    else:
+        checked = pair_checks()
+
+    _F_RING_STEP[slot] = step_idx
+    _F_RING_PAIR_CHECKS[slot] = ti.cast(checked, ti.f32) / (_CATS_N * _REPLICA_N)
+    _F_RING_MAX_CELL[slot] = max_cell_occupancy()
+
+    if ti.static(_HEATMAP_SIZE > 0):
+        _F_HEATMAP.fill(0)
+        for idx in range(_CATS_N * _REPLICA_N):
+            bin_idx = ti.floor(cats[idx].point / _PLATE_SIZE * _HEATMAP_SIZE, ti.i32)
+            bin_idx = ti.min(ti.max(bin_idx, 0), _HEATMAP_SIZE - 1)
+            level = ti.cast(cats[idx].status, ti.i32)
+            ti.atomic_add(_F_HEATMAP[bin_idx[0], bin_idx[1], level], 1)
+
+
+def record_metrics(cats: ti.template(), step_idx: int, verlet: bool = False):
+    """
+    Records statistics of the step (must be called after update_statuses).
+    verlet: pair checks are taken from update_statuses_verlet()
+    """
+    global _RECORDED
+    _record(cats, _F_RING_STATUSES, _RECORDED % _HISTORY, step_idx, verlet)
+    _RECORDED += 1
+
+
+@ti.kernel
+def _gather(
+    ring_statuses: ti.template(),
+    first: ti.i32,
+    steps: ti.types.ndarray(),
+    statuses: ti.types.ndarray(),
+    pair_checks_per_cat: ti.types.ndarray(),
+    max_cell: ti.types.ndarray(),
+):
+    """
+    copies records first, first + 1, ... (as many as fit into `steps`),
+    ring_statuses: see _record()
+    """
+    for k in range(steps.shape[0]):
+        slot = (first + k) % _HISTORY
+        steps[k] = _F_RING_STEP[slot]
+        pair_checks_per_cat[k] = _F_RING_PAIR_CHECKS[slot]
+        max_cell[k] = _F_RING_MAX_CELL[slot]
+        for replica, level in ti.ndrange(_REPLICA_N, INTERACTION_LEVEL_0 + 1):
+            statuses[k, replica, level] = ring_statuses[slot, replica, level]
+
+
+def export_metrics() -> dict:
+    """
+    Records added since the previous export, oldest first:
+        - step: (k,), statuses: (k, replica_n, INTERACTION_LEVEL_0 + 1),
+          pair_checks_per_cat: (k,), max_cell: (k,)
+        - dropped: number of records overwritten before they were exported
+    """
+    global _EXPORTED
+    dropped = max(0, _RECORDED - _EXPORTED - _HISTORY)
+    first = _EXPORTED + dropped
+    k = _RECORDED - first
+    _EXPORTED = _RECORDED
+
+    records = {
+        "step": np.zeros((k,), dtype=np.int32),
+        "statuses": np.zeros((k, _REPLICA_N, INTERACTION_LEVEL_0 + 1), dtype=np.int32),
+        "pair_checks_per_cat": np.zeros((k,), dtype=np.float32),
+        "max_cell": np.zeros((k,), dtype=np.int32),
+    }
+    if k > 0:
+        _gather(_F_RING_STATUSES, first, *records.values())
+
+    records["dropped"] = dropped
+    return records
+
+
+def get_heatmap() -> np.ndarray:
+    """heatmap of the last record, (size, size, INTERACTION_LEVEL_0 + 1)"""
+    return _F_HEATMAP.to_numpy()
@@ -0,0 +1,97 @@
+import threading
+from typing import Optional
+
+import numpy as np
+import taichi as ti
+
+__all__ = [
+    "RenderThread",
+    "SnapshotBuffer",
+]
+
+"""
+Background rendering:
+    - the simulation thread writes a snapshot of the cats (render.snapshot)
+      into the back buffer of SnapshotBuffer and publishes it
+    - RenderThread draws the front buffer with ti.GUI at its own pace
+    - the simulation never waits for drawing: a snapshot is taken only when
+      the previous one has been drawn, and publish() gives up (the snapshot
+      is dropped) while the front buffer is being drawn
+"""
+
+
+class SnapshotBuffer:
+    """Two host copies of positions (cats_n x 2, f32) and colors (cats_n, u32)."""
+
+    def __init__(self, cat_n: int):
+        self._positions = [np.zeros((cat_n, 2), dtype=np.float32) for _ in range(2)]
+        self._colors = [np.zeros((cat_n,), dtype=np.uint32) for _ in range(2)]
+        self._front = 0
+        self._version = 0
+        self._drawn_version = 0
+        self._lock = threading.Lock()
+        self._published = threading.Condition(self._lock)
+
+    def back(self) -> tuple:
+        """(positions, colors) to write the next snapshot into"""
+        back = 1 - self._front
+        return self._positions[back], self._colors[back]
+
+    def wants_snapshot(self) -> bool:
+        """True if the last published snapshot has been drawn"""
+        return self._drawn_version == self._version
+
+    def publish(self) -> bool:
+        """makes the back buffer the front one, False if it is being drawn now"""
+        if not self._lock.acquire(blocking=False):
+            return False
+
+        try:
+            self._front = 1 - self._front
+            self._version += 1
+            self._published.notify_all()
+        finally:
+            self._lock.release()
+        return True
+
+    def draw(self, draw_fn, timeout: Optional[float] = None) -> bool:
+        """
+        Calls draw_fn(positions, colors) with the front buffer once a new
+        snapshot is published. Returns False on timeout.
+        """
+        with self._published:
+            if not self._published.wait_for(
+                lambda: self._version != self._drawn_version, timeout
+            ):
+                return False
+
+            draw_fn(self._positions[self._front], self._colors[self._front])
+            self._drawn_version = self._version
+        return True
+
+
+class RenderThread(threading.Thread):
+    """Owns the ti.GUI window and draws published snapshots until it is closed."""
+
+    def __init__(self, buffer: SnapshotBuffer, res: tuple, radius: float, **gui_args):
+        super().__init__(name="catsim-render", daemon=True)
+        self._buffer = buffer
+        self._res = res
+        self._radius = radius
+        self._gui_args = gui_args
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _draw(self, positions, colors):
+        self._gui.circles(pos=positions, radius=self._radius, color=colors)
+        self._gui.show()
+
+    def run(self):
+        self._gui = ti.GUI("cat simulation", res=self._res, **self._gui_args)
+
+        while self._gui.running and not self._stop_event.is_set():
+            self._buffer.draw(self._draw, timeout=0.1)
+
+        self._gui.close()
@@ -0,0 +1,121 @@
+import contextlib
+import re
+import time
+from typing import Optional
+
+import taichi as ti
+from taichi.lang import impl
+
+import catsim
+
+__all__ = [
+    "enable_kernel_profiler",
+    "format_profile",
+    "kernel_profiler_enabled",
+    "kernel_times",
+    "summarize",
+    "timed",
+]
+
+"""
+Profiling mode (PROFILE = True):
+    - step() runs the grid update as separate kernels, one per phase:
+      move_cats -> count_cats -> scan_cells -> scatter_cats -> fight_cats
+      (see grid.py), so the phases of init_cell_storage() are timed apart
+    - timed() adds the host wall time of a block to a dict of phases,
+      __main__ also times the phases of the main loop (snapshot, draw, show)
+    - with the Taichi kernel profiler (enable_kernel_profiler() before
+      init_simulation()) kernel_times() gives the device time of every kernel
+"""
+
+# name of an offloaded task: <kernel>_c<id>_<n>_kernel_<task>_<type>
+_TASK_SUFFIX = re.compile(r"(_c\d+_\d+)?_kernel_(\d+)_\w+$")
+
+
+@contextlib.contextmanager
+def timed(timings: Optional[dict], name: str):
+    """adds wall time of the block to timings[name] (if timings is not None)"""
+    if timings is None:
+        yield
+        return
+
+    t0 = time.perf_counter()
+    yield
+    ti.sync()
+    timings.setdefault(name, []).append(time.perf_counter() - t0)
+
+
+def summarize(timings: dict) -> dict:
+    """{name: [seconds]} -> {name: {total, mean, calls}} in ms"""
+    return {
+        name: {
+            "total": sum(times) * 1e3,
+            "mean": sum(times) / len(times) * 1e3,
+            "calls": len(times),
+        }
+        for name, times in timings.items()
+    }
+
+
+def enable_kernel_profiler():
+    """re-initializes Taichi with the kernel profiler (existing fields are lost)"""
+    catsim.init(kernel_profiler=True)
+
+
+def kernel_profiler_enabled() -> bool:
+    return bool(impl.current_cfg().kernel_profiler)
+
+
+def kernel_times() -> dict:
+    """
+    Device time of every kernel launched since the previous call,
+    {name: {total, mean, calls}} in ms (all offloaded tasks summed).
+    """
+    # the public query matches kernels by prefix (move_cats_tracked for
+    # move_cats), so the traced records are grouped here
+    profiler = ti.profiler.kernel_profiler.get_default_kernel_profiler()
+    profiler._update_records()
+
+    times = {}
+    for record in profiler._traced_records:
+        match = _TASK_SUFFIX.search(record.name)
+        name = record.name[: match.start()] if match else record.name
+        total, calls = times.get(name, (0.0, 0))
+        first_task = match is None or match.group(2) == "0"
+        times[name] = (total + record.kernel_time, calls + first_task)
+    ti.profiler.clear_kernel_profiler_info()
+
+    return {
+        name: {"total": total, "mean": total / max(calls, 1), "calls": calls}
+        for name, (total, calls) in sorted(times.items(), key=lambda x: -x[1][0])
+    }
+
+
+def _table(title: str, times: dict) -> list:
+    total = sum(t["total"] for t in times.values())
+    lines = [
+        title,
+        f"  {'phase':<28}{'calls':>8}{'mean ms':>12}{'total ms':>12}{'share':>8}",
+    ]
+    for name, t in times.items():
+        share = t["total"] / total * 100 if total > 0 else 0.0
+        lines.append(
+            f"  {name:<28}{t['calls']:>8}{t['mean']:>12.3f}"
+            f"{t['total']:>12.1f}{share:>7.1f}%"
+        )
+    return lines
+
+
+def format_profile(
+    phases: dict, kernels: Optional[dict] = None, counters: Optional[dict] = None
+) -> str:
+    """
+    Per-phase breakdown as text:
+    phases and kernels are {name: {total, mean, calls}} (summarize(), kernel_times())
+    """
+    lines = _table("host phases:", phases)
+    if kernels:
+        lines += _table("device time of kernels:", kernels)
+    for name, value in (counters or {}).items():
+        lines.append(f"{name}: {value:.2f}")
+    return "\n".join(lines)
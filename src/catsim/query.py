@@ -0,0 +1,413 @@
+import math
+from typing import Optional
+
+import numpy as np
+import taichi as ti
+import taichi.math as tm
+
+from catsim.constants import EUCLIDEAN_DISTANCE
+from catsim.grid import (
+    cat_in_cell_order,
+    cell_range,
+    cell_span,
+    grid_size,
+    init_cell_storage,
+    span_rect,
+)
+from catsim.tools import exclusive_scan, get_distance_key, is_squared, scan_block_size
+
+__all__ = [
+    "build_index",
+    "query_knn",
+    "query_radius",
+    "query_rect",
+]
+
+"""
+Batched spatial queries over the cell grid of grid.py:
+    - every batch is answered by one kernel launch, only the answers are copied
+      to the host (cat positions are not)
+    - answers are in CSR form: (offsets, ids), the answer of query q is
+      ids[offsets[q] ; offsets[q + 1]), ids are Cat.id of the cats
+    - the grid must be built for the current positions of the cats, e.g. by
+      update_statuses() of the grid engine or by build_index()
+    - queries see the cats of one replica (see grid._REPLICA_N)
+"""
+
+# kinds of queries of _query()
+_RADIUS = 0
+_RECT = 1
+
+# answers per query of the last batch: the capacity of the next batch is
+# guessed from it, so the answers usually fit at the first launch
+_ANSWERS_PER_QUERY: float = 0.0
+
+
+@ti.kernel
+def build_index(cats: ti.template()):
+    """bins the cats into the grid (if no update_statuses() since they moved)"""
+    init_cell_storage(cats)
+
+
+@ti.func
+def _key_of(dist: ti.f32, distance_type: ti.template()) -> ti.f32:
+    """get_distance_key() value of the distance (see tools.distance_key_of())"""
+    key = dist
+    if ti.static(is_squared(distance_type)):
+        key = dist * dist
+    return key
+
+
+@ti.func
+def _bounds(query: tm.vec4, kind: ti.template()) -> tm.vec4:
+    """(lo x, lo y, hi x, hi y) of the area where the answer is"""
+    bounds = query
+    if ti.static(kind == _RADIUS):
+        bounds = tm.vec4(
+            query[0] - query[2],
+            query[1] - query[2],
+            query[0] + query[2],
+            query[1] + query[2],
+        )
+    return bounds
+
+
+@ti.func
+def _matches(
+    point: tm.vec2, query: tm.vec4, kind: ti.template(), distance_type: ti.template()
+) -> ti.i32:
+    matches = False
+    if ti.static(kind == _RADIUS):
+        center = tm.vec2(query[0], query[1])
+        matches = get_distance_key(point, center, distance_type) <= _key_of(
+            query[2], distance_type
+        )
+    else:
+        matches = query[0] <= point[0] <= query[2] and query[1] <= point[1] <= query[3]
+    return matches
+
+
+@ti.func
+def _collect(
+    cats: ti.template(),
+    query: tm.vec4,
+    replica: ti.i32,
+    kind: ti.template(),
+    distance_type: ti.template(),
+    ids: ti.template(),
+    head: ti.i32,
+    fill: ti.template(),
+) -> ti.i32:
+    """counts (and writes to `ids` from `head` if `fill`) the answer of the query"""
+    count = 0
+    bounds = _bounds(query, kind)
+    span = cell_span(tm.vec2(bounds[0], bounds[1]), tm.vec2(bounds[2], bounds[3]))
+
+    # cells of one column are stored one after another
+    for col in range(span[0], span[1] + 1):
+        begin = cell_range(tm.ivec2(col, span[2]), replica)[0]
+        end = cell_range(tm.ivec2(col, span[3]), replica)[1]
+        for j in range(begin, end):
+            idx = cat_in_cell_order(j)
+            if _matches(cats[idx].point, query, kind, distance_type):
+                if ti.static(fill):
+                    ids[head + count] = cats[idx].id
+                count += 1
+
+    return count
+
+
+@ti.kernel
+def _query(
+    cats: ti.template(),
+    queries: ti.types.ndarray(),
+    replica: ti.i32,
+    kind: ti.template(),
+    distance_type: ti.template(),
+    counts: ti.types.ndarray(),
+    offsets: ti.types.ndarray(),
+    block_sums: ti.types.ndarray(),
+    block_sz: ti.i32,
+    ids: ti.types.ndarray(),
+):
+    """
+    Counts the answers, reserves ranges for them and writes them. Answers
+    beyond the capacity of `ids` are not written, the host grows it and runs
+    the batch again.
+    """
+    n = queries.shape[0]
+
+    for q in range(n):
+        query = tm.vec4(queries[q, 0], queries[q, 1], queries[q, 2], queries[q, 3])
+        counts[q] = _collect(cats, query, replica, kind, distance_type, ids, 0, False)
+
+    exclusive_scan(counts, offsets, block_sums, n, block_sz)
+
+    for q in range(n):
+        if offsets[n] <= ids.shape[0]:
+            query = tm.vec4(queries[q, 0], queries[q, 1], queries[q, 2], queries[q, 3])
+            _collect(cats, query, replica, kind, distance_type, ids, offsets[q], True)
+
+
+def _run(cats, queries, replica, kind, distance_type, capacity):
+    global _ANSWERS_PER_QUERY
+    n = queries.shape[0]
+    if capacity is None:
+        capacity = math.ceil(n * _ANSWERS_PER_QUERY * 1.25)
+
+    block_sz = scan_block_size(n)
+    counts = np.zeros(n, dtype=np.int32)
+    offsets = np.zeros(n + 1, dtype=np.int32)
+    block_sums = np.zeros(max(1, math.ceil(n / block_sz)), dtype=np.int32)
+
+    args = (counts, offsets, block_sums, block_sz)
+    ids = np.empty(max(1, capacity), dtype=np.int32)
+    if n > 0:
+        _query(cats, queries, replica, kind, distance_type, *args, ids)
+
+    total = int(offsets[n])
+    if total > ids.shape[0]:
+        ids = np.empty(total, dtype=np.int32)
+        _query(cats, queries, replica, kind, distance_type, *args, ids)
+
+    if n > 0:
+        _ANSWERS_PER_QUERY = total / n
+    return offsets, ids[:total]
+
+
+def _points(points) -> np.ndarray:
+    return np.asarray(points, dtype=np.float32).reshape(-1, 2)
+
+
+def query_radius(
+    cats: ti.template(),
+    points,
+    radius,
+    distance_type: int = EUCLIDEAN_DISTANCE,
+    replica: int = 0,
+    capacity: Optional[int] = None,
+):
+    """
+    cats within `radius` (one for all points or one per point) of every point
+    capacity: expected total size of the answers (by default guessed from the
+    last batch), a batch which does not fit is run again
+    """
+    points = _points(points)
+    radius = np.broadcast_to(np.asarray(radius, dtype=np.float32), points.shape[:1])
+    if (radius < 0).any():
+        raise ValueError("Radius of a query must be non-negative")
+
+    queries = np.column_stack([points, radius, radius]).astype(np.float32)
+    return _run(cats, queries, replica, _RADIUS, distance_type, capacity)
+
+
+def query_rect(
+    cats: ti.template(), rects, replica: int = 0, capacity: Optional[int] = None
+):
+    """
+    cats inside every rectangle (lo x, lo y, hi x, hi y), borders included;
+    the number of cats in rectangle q is offsets[q + 1] - offsets[q],
+    capacity: see query_radius()
+    """
+    queries = np.ascontiguousarray(np.asarray(rects, dtype=np.float32).reshape(-1, 4))
+    if (queries[:, :2] > queries[:, 2:]).any():
+        raise ValueError("Rectangle of a query must have lo <= hi")
+
+    return _run(cats, queries, replica, _RECT, EUCLIDEAN_DISTANCE, capacity)
+
+
+@ti.func
+def _offer(
+    q: ti.i32,
+    key: ti.f32,
+    cat_id: ti.i32,
+    found: ti.i32,
+    keys: ti.template(),
+    ids: ti.template(),
+) -> ti.i32:
+    """inserts the cat into the sorted answer of the query, returns its new size"""
+    k = keys.shape[1]
+    size = found
+    if size < k or key < keys[q, k - 1]:
+        j = ti.min(size, k - 1)
+        while j > 0 and keys[q, j - 1] > key:
+            keys[q, j] = keys[q, j - 1]
+            ids[q, j] = ids[q, j - 1]
+            j -= 1
+        keys[q, j] = key
+        ids[q, j] = cat_id
+        size = ti.min(size + 1, k)
+    return size
+
+
+@ti.func
+def _offer_cells(
+    cats: ti.template(),
+    q: ti.i32,
+    point: tm.vec2,
+    max_key: ti.f32,
+    col: ti.i32,
+    rows: tm.ivec2,
+    replica: ti.i32,
+    distance_type: ti.template(),
+    found: ti.i32,
+    keys: ti.template(),
+    ids: ti.template(),
+) -> ti.i32:
+    """offers the cats of the cells [rows[0]; rows[1]] of the column"""
+    size = found
+    begin = cell_range(tm.ivec2(col, rows[0]), replica)[0]
+    end = cell_range(tm.ivec2(col, rows[1]), replica)[1]
+    for j in range(begin, end):
+        idx = cat_in_cell_order(j)
+        key = get_distance_key(cats[idx].point, point, distance_type)
+        if key <= max_key:
+            size = _offer(q, key, cats[idx].id, size, keys, ids)
+    return size
+
+
+@ti.kernel
+def _query_knn(
+    cats: ti.template(),
+    queries: ti.types.ndarray(),
+    replica: ti.i32,
+    distance_type: ti.template(),
+    keys: ti.types.ndarray(),
+    nearest: ti.types.ndarray(),
+    counts: ti.types.ndarray(),
+    offsets: ti.types.ndarray(),
+    block_sums: ti.types.ndarray(),
+    block_sz: ti.i32,
+    ids: ti.types.ndarray(),
+    dists: ti.types.ndarray(),
+):
+    """
+    Every query scans rings of cells around its cell, nearest first, until
+    the cats outside the scanned square are farther than the k-th found one
+    (or than the maximum distance). keys/nearest: (queries, k) scratch of
+    the sorted answers, they are compacted into CSR at the end.
+    """
+    n = queries.shape[0]
+    size = grid_size()
+
+    for q in range(n):
+        point = tm.vec2(queries[q, 0], queries[q, 1])
+        max_key = _key_of(queries[q, 2], distance_type)
+        k = keys.shape[1]
+        cell = cell_span(point, point)
+        found = 0
+
+        ring = 0
+        done = False
+        while not done:
+            lo = tm.ivec2(cell[0], cell[2]) - ring
+            hi = tm.ivec2(cell[0], cell[2]) + ring
+            rows = tm.ivec2(ti.max(lo[1], 0), ti.min(hi[1], size[1] - 1))
+
+            for col in range(ti.max(lo[0], 0), ti.min(hi[0], size[0] - 1) + 1):
+                # the whole column on the sides of the ring, two cells inside
+                for side in range(2):
+                    col_rows = rows
+                    if col != lo[0] and col != hi[0]:
+                        edge = lo[1] + side * 2 * ring
+                        col_rows = tm.ivec2(edge, edge)
+                    elif side == 1:
+                        continue
+                    if 0 <= col_rows[0] and col_rows[1] < size[1]:
+                        found = _offer_cells(
+                            cats,
+                            q,
+                            point,
+                            max_key,
+                            col,
+                            col_rows,
+                            replica,
+                            distance_type,
+                            found,
+                            keys,
+                            nearest,
+                        )
+
+            # distance from the point to the cells out of the square
+            rect = span_rect(tm.ivec4(lo[0], hi[0], lo[1], hi[1]))
+            gap = tm.inf
+            if lo[0] > 0:
+                gap = ti.min(gap, point[0] - rect[0])
+            if lo[1] > 0:
+                gap = ti.min(gap, point[1] - rect[1])
+            if hi[0] < size[0] - 1:
+                gap = ti.min(gap, rect[2] - point[0])
+            if hi[1] < size[1] - 1:
+                gap = ti.min(gap, rect[3] - point[1])
+
+            gap_key = _key_of(ti.max(gap, 0.0), distance_type)
+            done = (
+                gap == tm.inf
+                or gap_key > max_key
+                or (found == k and keys[q, k - 1] <= gap_key)
+            )
+            ring += 1
+
+        counts[q] = found
+
+    exclusive_scan(counts, offsets, block_sums, n, block_sz)
+
+    for q in range(n):
+        for j in range(counts[q]):
+            ids[offsets[q] + j] = nearest[q, j]
+            dist = keys[q, j]
+            if ti.static(is_squared(distance_type)):
+                dist = ti.sqrt(dist)
+            dists[offsets[q] + j] = dist
+
+
+def query_knn(
+    cats: ti.template(),
+    points,
+    k: int,
+    max_distance: float = math.inf,
+    distance_type: int = EUCLIDEAN_DISTANCE,
+    replica: int = 0,
+):
+    """
+    k nearest cats of every point (fewer if there are fewer cats within
+    max_distance), nearest first: (offsets, ids, distances)
+    """
+    if k < 1:
+        raise ValueError("k must be positive")
+    if max_distance < 0:
+        raise ValueError("Maximum distance of a query must be non-negative")
+
+    points = _points(points)
+    n = points.shape[0]
+    queries = np.column_stack(
+        [points, np.full((n, 2), max_distance, dtype=np.float32)]
+    ).astype(np.float32)
+
+    block_sz = scan_block_size(n)
+    keys = np.zeros((n, k), dtype=np.float32)
+    nearest = np.zeros((n, k), dtype=np.int32)
+    counts = np.zeros(n, dtype=np.int32)
+    offsets = np.zeros(n + 1, dtype=np.int32)
+    block_sums = np.zeros(max(1, math.ceil(n / block_sz)), dtype=np.int32)
+    ids = np.empty(max(1, n * k), dtype=np.int32)
+    dists = np.empty(max(1, n * k), dtype=np.float32)
+
+    if n > 0:
+        _query_knn(
+            cats,
+            queries,
+            replica,
+            distance_type,
+            keys,
+            nearest,
+            counts,
+            offsets,
+            block_sums,
+            block_sz,
+            ids,
+            dists,
+        )
+
+    total = int(offsets[n])
+    return offsets, ids[:total], dists[:total]
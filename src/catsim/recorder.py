@@ -0,0 +1,188 @@
+import contextlib
+import json
+import os
+import queue
+import sys
+from typing import Optional
+
+import numpy as np
+import taichi as ti
+
+from catsim.writer import BackgroundWriter
+
+__all__ = [
+    "Recorder",
+    "Recording",
+]
+
+"""
+Trajectory recording:
+    - every `every` steps Recorder copies `point` and `status` of all cats
+      (in the order of Cat.id, so reorder_cats() does not matter) into one of
+      a few reusable host buffers with one kernel
+    - a background thread (see writer.py) writes the buffers into
+      preallocated memory-mapped .npy files, the simulation waits only if all
+      buffers are still queued
+    - Recording opens the files memory-mapped, so any range of frames is read
+      without loading the whole file
+    - meta.json is replaced after every flushed frame, so the frames written
+      before a crash stay readable
+    - a run resumed from a checkpoint continues the recording: the frames up to
+      the step of the checkpoint are kept, the later ones are overwritten
+
+Files in the recording directory:
+    - points.npy: (frames, cats_n, 2) f32
+    - statuses.npy: (frames, cats_n) i8
+    - steps.npy: (frames,) i32, step index of every frame
+    - meta.json: number of written frames and the settings
+"""
+
+
+@ti.kernel
+def _snapshot(
+    cats: ti.template(), points: ti.types.ndarray(), statuses: ti.types.ndarray()
+):
+    for idx in range(cats.shape[0]):
+        cat_id = cats[idx].id
+        points[cat_id, 0] = cats[idx].point[0]
+        points[cat_id, 1] = cats[idx].point[1]
+        statuses[cat_id] = ti.cast(cats[idx].status, ti.i8)
+
+
+class Recorder(BackgroundWriter):
+    """Streams frames of cats into `path` (a directory), see the module notes."""
+
+    def __init__(
+        self,
+        path: str,
+        cat_n: int,
+        frames: int,
+        every: int = 1,
+        buffers: int = 3,
+        resume_step: Optional[int] = None,
+    ):
+        """
+        cat_n: size of the cats field (all replicas)
+        frames: capacity of the files, later frames are skipped
+        resume_step: continue the recording in `path` (if there is one) after
+        its frames up to this step, the later ones are overwritten; the files
+        keep their capacity
+        """
+        self.every = every
+        self.capacity = frames
+        self.frames = 0
+        self.skipped = 0
+        self._cat_n = cat_n
+
+        self._resume = resume_step is not None and os.path.exists(
+            os.path.join(path, "meta.json")
+        )
+        if self._resume:
+            self.frames = _frames_up_to(path, cat_n, every, resume_step)
+
+        # the simulation waits only if all buffers are still queued
+        self._free = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(
+                (np.zeros((cat_n, 2), np.float32), np.zeros((cat_n,), np.int8))
+            )
+
+        super().__init__(
+            path,
+            "recorder",
+            meta={"cat_n": cat_n, "every": every},
+            written={"frames": self.frames},
+        )
+
+    def record(self, cats: ti.template(), step_idx: int):
+        """takes a frame if step_idx is a multiple of `every`"""
+        if step_idx % self.every != 0:
+            return
+        self.check()
+
+        if self.frames == self.capacity:
+            if self.skipped == 0:
+                print(
+                    f"Recording {self.path} is full ({self.capacity} frames)",
+                    file=sys.stderr,
+                )
+            self.skipped += 1
+            return
+
+        points, statuses = self._free.get()
+        _snapshot(cats, points, statuses)
+        self.put((self.frames, step_idx, points, statuses))
+        self.frames += 1
+
+    @contextlib.contextmanager
+    def _open(self):
+        def open_memmap(name, dtype, shape):
+            path = os.path.join(self.path, name)
+            if self._resume:
+                return np.lib.format.open_memmap(path, "r+")
+            return np.lib.format.open_memmap(path, "w+", dtype, shape)
+
+        files = (
+            open_memmap("points.npy", np.float32, (self.capacity, self._cat_n, 2)),
+            open_memmap("statuses.npy", np.int8, (self.capacity, self._cat_n)),
+            open_memmap("steps.npy", np.int32, (self.capacity,)),
+        )
+        self.capacity = len(files[2])
+        yield files
+
+    def _write(self, files, item):
+        frame, step_idx, points, statuses = item
+        points_file, statuses_file, steps_file = files
+        points_file[frame] = points
+        statuses_file[frame] = statuses
+        steps_file[frame] = step_idx
+        self._written["frames"] = frame + 1
+
+    def _flush(self, files):
+        for array in files:
+            array.flush()
+
+    def _release(self, item):
+        self._free.put(item[2:])
+
+
+def _frames_up_to(path: str, cat_n: int, every: int, step_idx: int) -> int:
+    """number of frames of the recording in `path` taken up to step_idx"""
+    recording = Recording(path)
+    if recording.cat_n != cat_n or recording.every != every:
+        raise ValueError(f"Recording {path} has other cats or period, can not continue")
+    return int(np.searchsorted(recording.steps, step_idx, side="right"))
+
+
+class Recording:
+    """Read-only access to a directory written by Recorder."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        self.cat_n = meta["cat_n"]
+        self.every = meta["every"]
+        self.frames = meta["frames"]
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")[: self.frames]
+
+        # memory-mapped, slices are read from the disk on access
+        self.points = load("points.npy")
+        self.statuses = load("statuses.npy")
+        self.steps = load("steps.npy")
+
+    def __len__(self) -> int:
+        return self.frames
+
+    def frame_of_step(self, step_idx: int) -> Optional[int]:
+        """frame taken at the step (None if there is no such frame)"""
+        frame = int(np.searchsorted(self.steps, step_idx))
+        if frame < self.frames and self.steps[frame] == step_idx:
+            return frame
+        return None
+
+    def read(self, begin: int, end: int) -> tuple:
+        """(points, statuses) of frames [begin; end) as in-memory arrays"""
+        return np.array(self.points[begin:end]), np.array(self.statuses[begin:end])
@@ -0,0 +1,153 @@
+from typing import Any, Optional
+
+import taichi as ti
+import taichi.math as tm
+
+from catsim.constants import (
+    GGUI_RENDERER,
+    GUI_RENDERER,
+    INTERACTION_LEVEL_0,
+    INTERACTION_LEVEL_1,
+    INTERACTION_NO,
+)
+
+__all__ = [
+    "get_colors",
+    "get_positions",
+    "get_vertex_colors",
+    "setup_render",
+    "snapshot",
+    "update_colors",
+]
+
+_RENDERER: ti.i32
+# number of drawn cats: the first cat_n of the field (the first replica)
+_CATS_N: ti.i32
+
+"""
+contains color for each interaction level:
+    - size := INTERACTION_LEVEL_0 + 1
+    - element_i is the color of the cat with status i
+    - GUI_RENDERER: 0xRRGGBB (ti.u32)
+    - GGUI_RENDERER: (r, g, b) in [0; 1] (tm.vec3)
+"""
+_F_PALETTE: Any
+
+"""
+contains color of each cat (same type as _F_PALETTE):
+    - size := cats_n
+    - refreshed by update_colors() after update_statuses()
+"""
+_F_COLORS: Any
+
+"""
+contains normalized position of each cat (only for cats without norm_point):
+    - size := cats_n
+    - refreshed by get_positions()
+"""
+_F_POSITIONS: Optional[Any] = None
+_PLATE_SIZE: tm.vec2
+# positions are computed from `point` (plate_size is passed to setup_render)
+_DERIVE_POSITIONS: bool = False
+
+
+def hex_to_rgb(color: int) -> tuple:
+    return (
+        ((color >> 16) & 0xFF) / 255,
+        ((color >> 8) & 0xFF) / 255,
+        (color & 0xFF) / 255,
+    )
+
+
+def setup_render(
+    cat_n: ti.i32,
+    color_no: ti.u32,
+    color_l1: ti.u32,
+    color_l0: ti.u32,
+    renderer: ti.i32 = GUI_RENDERER,
+    plate_size: Optional[tuple] = None,
+):
+    """
+    plate_size: (width, height), pass it to compute normalized positions
+                from `point` (for cats without `norm_point`, e.g. CompactCat)
+    """
+    global _RENDERER, _CATS_N
+    _RENDERER = renderer
+    _CATS_N = cat_n
+
+    global _F_POSITIONS, _PLATE_SIZE, _DERIVE_POSITIONS
+    _F_POSITIONS = None
+    _DERIVE_POSITIONS = plate_size is not None
+    if _DERIVE_POSITIONS:
+        _PLATE_SIZE = tm.vec2(plate_size)
+        _F_POSITIONS = tm.vec2.field(shape=(cat_n,))
+
+    global _F_PALETTE, _F_COLORS
+    if _RENDERER == GGUI_RENDERER:
+        _F_PALETTE = tm.vec3.field(shape=(INTERACTION_LEVEL_0 + 1,))
+        _F_COLORS = tm.vec3.field(shape=(cat_n,))
+        to_color = hex_to_rgb
+    else:
+        _F_PALETTE = ti.field(dtype=ti.u32, shape=(INTERACTION_LEVEL_0 + 1,))
+        _F_COLORS = ti.field(dtype=ti.u32, shape=(cat_n,))
+        to_color = int
+
+    _F_PALETTE[INTERACTION_NO] = to_color(color_no)
+    _F_PALETTE[INTERACTION_LEVEL_1] = to_color(color_l1)
+    _F_PALETTE[INTERACTION_LEVEL_0] = to_color(color_l0)
+
+
+@ti.kernel
+def update_colors(cats: ti.template()):
+    for idx in range(_CATS_N):
+        _F_COLORS[idx] = _F_PALETTE[cats[idx].status]
+
+
+@ti.func
+def _position(cats: ti.template(), idx: ti.i32) -> tm.vec2:
+    position = tm.vec2(0.0, 0.0)
+    if ti.static(_DERIVE_POSITIONS):
+        position = cats[idx].point / _PLATE_SIZE
+    else:
+        position = cats[idx].norm_point
+    return position
+
+
+@ti.kernel
+def _update_positions(cats: ti.template()):
+    for idx in range(_CATS_N):
+        _F_POSITIONS[idx] = _position(cats, idx)
+
+
+@ti.kernel
+def snapshot(
+    cats: ti.template(), positions: ti.types.ndarray(), colors: ti.types.ndarray()
+):
+    """
+    GUI_RENDERER: writes normalized positions (cats_n x 2, f32) and colors
+    (cats_n, u32) of the cats straight into host arrays, in one pass.
+    """
+    for idx in range(_CATS_N):
+        position = _position(cats, idx)
+        positions[idx, 0] = position[0]
+        positions[idx, 1] = position[1]
+        colors[idx] = _F_PALETTE[cats[idx].status]
+
+
+def get_positions(cats: ti.template()):
+    """normalized positions as a field: cats.norm_point or the computed one"""
+    if _F_POSITIONS is None:
+        return cats.norm_point
+
+    _update_positions(cats)
+    return _F_POSITIONS
+
+
+def get_colors():
+    """GUI_RENDERER: colors as one host array (one copy per call)"""
+    return _F_COLORS.to_numpy()
+
+
+def get_vertex_colors():
+    """GGUI_RENDERER: colors as a field, can be passed to `Canvas.circles` as is"""
+    return _F_COLORS
@@ -0,0 +1,73 @@
+from typing import Any
+
+import numpy as np
+import taichi as ti
+
+from catsim.grid import cat_in_cell_order
+
+__all__ = [
+    "get_slots",
+    "reorder_cats",
+    "reset_slots",
+    "set_slots",
+    "setup_reorder",
+    "slot_of",
+]
+
+"""
+Spatial reordering of the cats field:
+    - cats are permuted in memory into the cell order of the grid, so cats
+      of one cell (and of neighbour cells of one column) are stored together
+      and the neighbour scan of update_statuses() reads contiguous memory
+    - Cat.id is the stable external id, it moves together with the record
+"""
+
+"""
+contains current slot of each cat:
+    - size := cats_n
+    - cats[F_SLOTS[cat_id]].id == cat_id
+"""
+_F_SLOTS: Any
+
+# (internal) copy of the cats field used to permute it
+_F_CATS_BUF: Any
+
+
+def setup_reorder(cat_type: Any, cat_n: ti.i32):
+    global _F_SLOTS, _F_CATS_BUF
+    _F_SLOTS = ti.field(dtype=ti.i32, shape=(cat_n,))
+    _F_CATS_BUF = cat_type.field(shape=(cat_n,))
+    reset_slots()
+
+
+def reset_slots():
+    """every cat is in the slot of its id (cats[cat_id].id == cat_id)"""
+    _F_SLOTS.from_numpy(np.arange(_F_SLOTS.shape[0], dtype=np.int32))
+
+
+@ti.kernel
+def reorder_cats(cats: ti.template()):
+    """
+    Permutes cats into the cell order.
+    Must be called right after update_statuses() (before cats are moved).
+    """
+    for j in range(cats.shape[0]):
+        _F_CATS_BUF[j] = cats[cat_in_cell_order(j)]
+
+    for j in range(cats.shape[0]):
+        cats[j] = _F_CATS_BUF[j]
+        _F_SLOTS[cats[j].id] = j
+
+
+@ti.func
+def slot_of(cat_id: ti.i32) -> ti.i32:
+    return _F_SLOTS[cat_id]
+
+
+def get_slots():
+    return _F_SLOTS.to_numpy()
+
+
+def set_slots(slots):
+    """restores slots saved with get_slots() (the cats must be restored too)"""
+    _F_SLOTS.from_numpy(slots)
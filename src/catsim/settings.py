@@ -0,0 +1,213 @@
+import dataclasses
+import json
+import os
+from typing import Optional
+
+import catsim.config as cfg
+import catsim.constants as const
+
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    tomllib = None
+
+__all__ = [
+    "Config",
+    "load_config",
+    "parse_override",
+]
+
+"""
+Config:
+    - one field per constant of `catsim.config` (the same names), the defaults
+      are the values of `catsim.config`
+    - is passed to init_simulation(), so several configs can be run one after
+      another in one process without editing or re-importing `catsim.config`
+    - in files and overrides integer constants can also be given by their
+      names in `catsim.constants` (e.g. DISTANCE = "MANHATTAN_DISTANCE")
+"""
+
+# changing any of them needs new fields, so kernels are compiled again;
+# configs differing only in other parameters reuse the compiled kernels
+LAYOUT_PARAMS = (
+    "PLATE_WIDTH",
+    "PLATE_HEIGHT",
+    "CATS_N",
+    "RADIUS_1",
+    "PROB_INTERACTION",
+    "SPATIAL_INDEX",
+    "GRID_CELL_SIZE",
+    "SPLIT_FACTOR",
+    "SPLIT_THRESHOLD",
+    "INCREMENTAL_GRID",
+    "NEIGHBOUR_ENGINE",
+    "VERLET_SKIN",
+    "REPLICA_N",
+    "METRICS_HISTORY",
+    "HEATMAP_SIZE",
+    "CAT_LAYOUT",
+    "CAT_TYPE",
+    "REORDER_PERIOD",
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class Config:
+    # ----- GENERAL ----- #
+    PLATE_WIDTH: int = cfg.PLATE_WIDTH
+    PLATE_HEIGHT: int = cfg.PLATE_HEIGHT
+    CATS_N: int = cfg.CATS_N
+
+    # ----- CAT ----- #
+    CAT_RADIUS: float = cfg.CAT_RADIUS
+    MOVE_RADIUS: float = cfg.MOVE_RADIUS
+    RADIUS_0: float = cfg.RADIUS_0
+    RADIUS_1: float = cfg.RADIUS_1
+
+    # ----- PATTERNS ----- #
+    MOVE_PATTERN_ID: int = cfg.MOVE_PATTERN_ID
+    DISTANCE: int = cfg.DISTANCE
+    NEIGHBOUR_STENCIL: int = cfg.NEIGHBOUR_STENCIL
+    FUSED_STEP: bool = cfg.FUSED_STEP
+
+    # ----- SPATIAL INDEX ----- #
+    SPATIAL_INDEX: int = cfg.SPATIAL_INDEX
+    GRID_CELL_SIZE: float = cfg.GRID_CELL_SIZE
+    SPLIT_FACTOR: int = cfg.SPLIT_FACTOR
+    SPLIT_THRESHOLD: int = cfg.SPLIT_THRESHOLD
+    INCREMENTAL_GRID: bool = cfg.INCREMENTAL_GRID
+    MIGRATION_THRESHOLD: float = cfg.MIGRATION_THRESHOLD
+
+    # ----- NEIGHBOUR SEARCH ----- #
+    NEIGHBOUR_ENGINE: int = cfg.NEIGHBOUR_ENGINE
+    VERLET_SKIN: float = cfg.VERLET_SKIN
+
+    # ----- ENSEMBLE ----- #
+    REPLICA_N: int = cfg.REPLICA_N
+
+    # ----- DOMAIN DECOMPOSITION ----- #
+    TILE_COLS: int = cfg.TILE_COLS
+    TILE_ROWS: int = cfg.TILE_ROWS
+    TILE_CAPACITY: float = cfg.TILE_CAPACITY
+
+    # ----- METRICS ----- #
+    METRICS_HISTORY: int = cfg.METRICS_HISTORY
+    HEATMAP_SIZE: int = cfg.HEATMAP_SIZE
+
+    # ----- RECORDING ----- #
+    RECORD_PATH: str = cfg.RECORD_PATH
+    RECORD_EVERY: int = cfg.RECORD_EVERY
+    RECORD_FRAMES: int = cfg.RECORD_FRAMES
+    CONTACTS_PATH: str = cfg.CONTACTS_PATH
+
+    # ----- CHECKPOINTS ----- #
+    CHECKPOINT_PATH: str = cfg.CHECKPOINT_PATH
+    CHECKPOINT_EVERY: int = cfg.CHECKPOINT_EVERY
+
+    # ----- PROFILING ----- #
+    PROFILE: bool = cfg.PROFILE
+
+    # ----- MEMORY LAYOUT ----- #
+    CAT_LAYOUT: int = cfg.CAT_LAYOUT
+    CAT_TYPE: int = cfg.CAT_TYPE
+    REORDER_PERIOD: int = cfg.REORDER_PERIOD
+
+    # ----- VISUALISATION ----- #
+    COLOR_LEVEL_0: int = cfg.COLOR_LEVEL_0
+    COLOR_LEVEL_1: int = cfg.COLOR_LEVEL_1
+    COLOR_LEVEL_NO: int = cfg.COLOR_LEVEL_NO
+    RENDERER: int = cfg.RENDERER
+    STEPS_PER_FRAME: int = cfg.STEPS_PER_FRAME
+    RENDER_THREAD: bool = cfg.RENDER_THREAD
+
+    # ----- PROBABILISTIC INTERACTION ----- #
+    PROB_INTERACTION: int = cfg.PROB_INTERACTION
+
+    @classmethod
+    def from_module(cls, module=cfg) -> "Config":
+        """takes the current values of a config module (`catsim.config` by default)"""
+        return cls(**{f.name: getattr(module, f.name) for f in dataclasses.fields(cls)})
+
+    def replace(self, **params) -> "Config":
+        """copy with `params` replaced, raises ValueError on unknown names or types"""
+        types = {f.name: f.type for f in dataclasses.fields(self)}
+
+        values = {}
+        for name, value in params.items():
+            if name not in types:
+                raise ValueError(f"Unknown config parameter {name}")
+            values[name] = _convert(name, value, types[name])
+
+        return dataclasses.replace(self, **values)
+
+    def layout_key(self) -> tuple:
+        return tuple(getattr(self, name) for name in LAYOUT_PARAMS)
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+
+def _convert(name: str, value, type_name):
+    # annotations are strings if `from __future__ import annotations` is used
+    type_name = getattr(type_name, "__name__", type_name)
+
+    if type_name == "str":
+        if not isinstance(value, str):
+            raise ValueError(f"{name} must be a string, got {value!r}")
+        return value
+
+    if type_name != "bool" and isinstance(value, str):
+        if not value.isupper() or not isinstance(getattr(const, value, None), int):
+            raise ValueError(f"{name}: unknown constant {value}")
+        value = getattr(const, value)
+
+    if type_name == "bool":
+        if not isinstance(value, bool):
+            raise ValueError(f"{name} must be true or false, got {value!r}")
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    elif type_name == "int":
+        if value != int(value):
+            raise ValueError(f"{name} must be an integer, got {value!r}")
+        value = int(value)
+    else:
+        value = float(value)
+
+    return value
+
+
+def load_config(path: str, base: Optional[Config] = None) -> Config:
+    """
+    Reads parameters from a TOML (python >= 3.11) or JSON file,
+    missing ones are taken from `base` (Config() by default).
+    """
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == ".toml":
+        if tomllib is None:
+            raise ValueError("TOML configs need python >= 3.11, use JSON")
+        with open(path, "rb") as f:
+            params = tomllib.load(f)
+    elif ext == ".json":
+        with open(path) as f:
+            params = json.load(f)
+    else:
+        raise ValueError(f"Unknown config format {ext}, expected .toml or .json")
+
+    return (Config() if base is None else base).replace(**params)
+
+
+def parse_override(text: str) -> tuple:
+    """
+    "NAME=VALUE" -> (NAME, VALUE), VALUE is a JSON value
+    (1000, 2.5, true) or a name of a constant (MANHATTAN_DISTANCE)
+    """
+    name, sep, value = text.partition("=")
+    if not sep or not name:
+        raise ValueError(f"Expected NAME=VALUE, got {text!r}")
+
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return name.strip(), value
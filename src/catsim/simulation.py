@@ -0,0 +1,643 @@
+import json
+import os
+import time
+from typing import Any, Optional
+
+import numpy as np
+import taichi as ti
+from taichi.lang import impl
+
+import catsim
+import catsim.config as cfg
+from catsim.cat import (
+    Cat,
+    CompactCat,
+    get_clock,
+    init_cat_env,
+    set_clock,
+    set_params,
+    tick,
+)
+from catsim.constants import (
+    ADAPTIVE_GRID,
+    AUTO_CELL_SIZE,
+    COMPACT_CAT,
+    HALF_STENCIL,
+    INTERACTION_LEVEL_0,
+    INTERACTION_LEVEL_1,
+    INTERACTION_NO,
+    RADIUS_1_CELL_SIZE,
+    SOA_LAYOUT,
+    VERLET_ENGINE,
+)
+from catsim.contacts import ContactWriter, setup_contacts, update_statuses_contacts
+from catsim.grid import (
+    auto_cell_size,
+    count_cats,
+    fight_cats,
+    get_migration_stats,
+    get_occupancy_stats,
+    get_pair_check_stats,
+    invalidate_cell_storage,
+    move_and_update_statuses,
+    scan_cells,
+    scatter_cats,
+    setup_grid,
+    update_cell_storage,
+    update_statuses,
+    update_statuses_symmetric,
+)
+from catsim.metrics import export_metrics, record_metrics, reset_metrics, setup_metrics
+from catsim.profiler import kernel_profiler_enabled, kernel_times, summarize, timed
+from catsim.recorder import Recorder
+from catsim.reorder import (
+    get_slots,
+    reorder_cats,
+    reset_slots,
+    set_slots,
+    setup_reorder,
+)
+from catsim.settings import Config
+from catsim.verlet import (
+    build_neighbour_lists,
+    get_verlet_stats,
+    invalidate_neighbour_lists,
+    move_cats_tracked,
+    needs_rebuild,
+    setup_verlet,
+    update_statuses_verlet,
+)
+
+__all__ = [
+    "cat_type",
+    "close_simulation",
+    "get_config",
+    "grid_cell_size",
+    "init_simulation",
+    "load_checkpoint",
+    "move_cats",
+    "pair_check_stats",
+    "run_headless",
+    "save_checkpoint",
+    "set_cat_init_positions",
+    "status_counts",
+    "step",
+    "validate_config",
+]
+
+# config passed to the last init_simulation()
+_CONFIG: Optional[Config] = None
+# number of steps done since init_simulation()
+_STEP_IDX: int = 0
+
+# cats of the last init_simulation(), reused by the next one with the same
+# layout_key() in the same Taichi runtime (so are the compiled kernels)
+_CATS: Optional[Any] = None
+# streams frames of the cats if RECORD_PATH is set
+_RECORDER: Optional[Recorder] = None
+# streams pairs of interacting cats if CONTACTS_PATH is set
+_CONTACTS: Optional[ContactWriter] = None
+_LAYOUT_KEY: Optional[tuple] = None
+_RUNTIME: Optional[Any] = None
+
+
+@ti.kernel
+def move_cats(cats: ti.template()):
+    tick()
+    for idx in range(cats.shape[0]):
+        cats[idx].move()
+
+
+@ti.kernel
+def set_cat_init_positions(cats: ti.template(), cat_r: ti.f32):
+    for idx in range(cats.shape[0]):
+        cats[idx].id = idx
+        cats[idx].init_cat(cat_r)
+
+
+def validate_config(config: Config):
+    if config.PLATE_HEIGHT <= 0 or config.PLATE_WIDTH <= 0:
+        raise ValueError("Plate height/width must be > 0")
+
+    if config.CATS_N <= 0:
+        raise ValueError("Number of cats must be > 0")
+
+    if (
+        config.CAT_RADIUS <= 0
+        or config.MOVE_RADIUS <= 0
+        or config.RADIUS_0 <= 0
+        or config.RADIUS_1 <= 0
+    ):
+        raise ValueError("Radii must be > 0")
+
+    if config.RADIUS_1 <= config.RADIUS_0:
+        raise ValueError("Radius 1 must be > Radius 0")
+
+    if (
+        config.GRID_CELL_SIZE not in (AUTO_CELL_SIZE, RADIUS_1_CELL_SIZE)
+        and config.GRID_CELL_SIZE <= 0
+    ):
+        raise ValueError("Grid cell size must be > 0")
+
+    if config.SPATIAL_INDEX == ADAPTIVE_GRID and (
+        config.SPLIT_FACTOR < 2 or config.SPLIT_THRESHOLD < 1
+    ):
+        raise ValueError("Split factor must be >= 2 and split threshold >= 1")
+
+    if config.NEIGHBOUR_ENGINE == VERLET_ENGINE and config.VERLET_SKIN <= 0:
+        raise ValueError("Verlet skin must be > 0")
+
+    if config.INCREMENTAL_GRID and (
+        config.SPATIAL_INDEX == ADAPTIVE_GRID
+        or config.NEIGHBOUR_ENGINE == VERLET_ENGINE
+    ):
+        raise ValueError("Incremental grid needs the grid engine and UNIFORM_GRID")
+
+    if not 0 <= config.MIGRATION_THRESHOLD <= 1:
+        raise ValueError("Migration threshold must be in [0, 1]")
+
+    if config.CHECKPOINT_EVERY < 1:
+        raise ValueError("Checkpoint period must be >= 1")
+
+    if config.RECORD_EVERY < 1 or config.RECORD_FRAMES < 1:
+        raise ValueError("Record period and number of frames must be >= 1")
+
+    if config.CONTACTS_PATH and config.NEIGHBOUR_ENGINE == VERLET_ENGINE:
+        raise ValueError("Contacts need the grid engine")
+
+    # contacts are listed by their own kernel, it has no fused or profiled form
+    if config.CONTACTS_PATH and (config.FUSED_STEP or config.PROFILE):
+        raise ValueError("Contacts can not be used with FUSED_STEP or PROFILE")
+
+    if config.REPLICA_N < 1:
+        raise ValueError("Number of replicas must be >= 1")
+
+    if config.METRICS_HISTORY < 0 or config.HEATMAP_SIZE < 0:
+        raise ValueError("Metrics history and heatmap size must be >= 0")
+
+    if config.STEPS_PER_FRAME < 1:
+        raise ValueError("Steps per frame must be >= 1")
+
+    if config.REORDER_PERIOD < 0:
+        raise ValueError("Reorder period must be >= 0")
+
+    if config.CAT_TYPE == COMPACT_CAT and config.NEIGHBOUR_STENCIL == HALF_STENCIL:
+        raise ValueError("Half stencil needs atomics on status, use FULL_CAT")
+
+
+def cat_type(config: Config):
+    return CompactCat if config.CAT_TYPE == COMPACT_CAT else Cat
+
+
+def grid_cell_size(config: Config) -> float:
+    if config.GRID_CELL_SIZE == AUTO_CELL_SIZE:
+        return auto_cell_size(
+            config.CATS_N, config.RADIUS_1, config.PLATE_WIDTH, config.PLATE_HEIGHT
+        )
+    if config.GRID_CELL_SIZE == RADIUS_1_CELL_SIZE:
+        return config.RADIUS_1
+    return config.GRID_CELL_SIZE
+
+
+def get_config() -> Config:
+    """config of the running simulation"""
+    return _CONFIG
+
+
+def init_simulation(
+    config: Optional[Config] = None,
+    place_cats: bool = True,
+    resume_step: Optional[int] = None,
+):
+    """
+    Initializes `cat` and `grid` modules from `config` (the current values
+    of `catsim.config` by default) and returns the field of cats placed at
+    their initial positions (left as is if not `place_cats`).
+    resume_step: the recording and the contacts continue what was written
+    up to this step instead of starting anew (see load_checkpoint())
+
+    If the previous config had the same layout_key(), its fields are reused,
+    so the kernels are not compiled again (the previous cats are overwritten).
+    Taichi is initialized by catsim.init() if it was not done before.
+    """
+    if config is None:
+        config = Config.from_module(cfg)
+    validate_config(config)
+
+    if not catsim.is_initialized():
+        catsim.init()
+
+    global _CONFIG, _STEP_IDX, _CATS, _LAYOUT_KEY, _RUNTIME
+    if (
+        _CATS is None
+        or _LAYOUT_KEY != config.layout_key()
+        or _RUNTIME is not impl.get_runtime()
+    ):
+        _CATS = _allocate(config)
+        _LAYOUT_KEY = config.layout_key()
+        _RUNTIME = impl.get_runtime()
+    else:
+        set_params(config.MOVE_RADIUS, config.MOVE_PATTERN_ID, config.RADIUS_0)
+        if config.METRICS_HISTORY > 0:
+            reset_metrics()
+        # cats are placed in the slots of their ids again
+        if config.REORDER_PERIOD > 0:
+            reset_slots()
+
+    set_clock(catsim.SEED)
+    if place_cats:
+        set_cat_init_positions(_CATS, config.CAT_RADIUS)
+    invalidate_neighbour_lists()
+    invalidate_cell_storage()
+
+    global _RECORDER, _CONTACTS
+    close_simulation()
+    if config.RECORD_PATH:
+        _RECORDER = Recorder(
+            config.RECORD_PATH,
+            cat_n=config.CATS_N * config.REPLICA_N,
+            frames=config.RECORD_FRAMES,
+            every=config.RECORD_EVERY,
+            resume_step=resume_step,
+        )
+    if config.CONTACTS_PATH:
+        # a cat has a few contacts, the buffer grows if they do not fit
+        setup_contacts(config.CATS_N * config.REPLICA_N)
+        _CONTACTS = ContactWriter(
+            config.CONTACTS_PATH,
+            cat_n=config.CATS_N * config.REPLICA_N,
+            resume_step=resume_step,
+        )
+
+    _CONFIG = config
+    _STEP_IDX = 0
+
+    return _CATS
+
+
+def _allocate(config: Config):
+    init_cat_env(
+        move_radius=config.MOVE_RADIUS,
+        r0=config.RADIUS_0,
+        r1=config.RADIUS_1,
+        width=config.PLATE_WIDTH,
+        height=config.PLATE_HEIGHT,
+        move_pattern=config.MOVE_PATTERN_ID,
+        prob_inter=config.PROB_INTERACTION,
+    )
+
+    if config.NEIGHBOUR_ENGINE == VERLET_ENGINE:
+        setup_verlet(
+            cat_n=config.CATS_N,
+            r1=config.RADIUS_1,
+            skin=config.VERLET_SKIN,
+            width=config.PLATE_WIDTH,
+            height=config.PLATE_HEIGHT,
+            replica_n=config.REPLICA_N,
+        )
+    else:
+        setup_grid(
+            cat_n=config.CATS_N,
+            r1=config.RADIUS_1,
+            width=config.PLATE_WIDTH,
+            height=config.PLATE_HEIGHT,
+            cell_sz=grid_cell_size(config),
+            split_factor=(
+                config.SPLIT_FACTOR if config.SPATIAL_INDEX == ADAPTIVE_GRID else 1
+            ),
+            split_threshold=config.SPLIT_THRESHOLD,
+            replica_n=config.REPLICA_N,
+            incremental=config.INCREMENTAL_GRID,
+        )
+
+    if config.METRICS_HISTORY > 0:
+        setup_metrics(
+            cat_n=config.CATS_N,
+            width=config.PLATE_WIDTH,
+            height=config.PLATE_HEIGHT,
+            history=config.METRICS_HISTORY,
+            replica_n=config.REPLICA_N,
+            heatmap_size=config.HEATMAP_SIZE,
+        )
+
+    # replicas are stored one after another (see grid._REPLICA_N)
+    cat_n = config.CATS_N * config.REPLICA_N
+
+    if config.REORDER_PERIOD > 0:
+        setup_reorder(cat_type(config), cat_n)
+
+    layout = ti.Layout.SOA if config.CAT_LAYOUT == SOA_LAYOUT else ti.Layout.AOS
+    return cat_type(config).field(shape=(cat_n,), layout=layout)
+
+
+def step(cats: ti.template(), timings: Optional[dict] = None):
+    global _STEP_IDX
+    _STEP_IDX += 1
+
+    if _CONFIG.NEIGHBOUR_ENGINE == VERLET_ENGINE:
+        with timed(timings, "move_cats"):
+            move_cats_tracked(cats, _CONFIG.DISTANCE)
+
+        if needs_rebuild():
+            with timed(timings, "build_neighbour_lists"):
+                build_neighbour_lists(cats, _CONFIG.DISTANCE, _CONFIG.NEIGHBOUR_STENCIL)
+
+        with timed(timings, "update_statuses"):
+            update_statuses_verlet(cats, _CONFIG.DISTANCE, _CONFIG.NEIGHBOUR_STENCIL)
+    elif _CONFIG.CONTACTS_PATH:
+        with timed(timings, "move_cats"):
+            move_cats(cats)
+
+        if _CONFIG.INCREMENTAL_GRID:
+            with timed(timings, "update_cell_storage"):
+                update_cell_storage(cats, _CONFIG.MIGRATION_THRESHOLD)
+
+        with timed(timings, "update_statuses_contacts"):
+            update_statuses_contacts(
+                cats,
+                _CONFIG.DISTANCE,
+                _CONFIG.NEIGHBOUR_STENCIL,
+                rebuild=not _CONFIG.INCREMENTAL_GRID,
+            )
+    elif _CONFIG.INCREMENTAL_GRID:
+        with timed(timings, "move_cats"):
+            move_cats(cats)
+
+        with timed(timings, "update_cell_storage"):
+            update_cell_storage(cats, _CONFIG.MIGRATION_THRESHOLD)
+
+        with timed(timings, "fight_cats"):
+            fight_cats(cats, _CONFIG.DISTANCE, _CONFIG.NEIGHBOUR_STENCIL)
+    elif _CONFIG.PROFILE:
+        with timed(timings, "move_cats"):
+            move_cats(cats)
+
+        for name, kernel in (
+            ("count_cats", count_cats),
+            ("scan_cells", scan_cells),
+            ("scatter_cats", scatter_cats),
+        ):
+            with timed(timings, name):
+                kernel(cats)
+
+        with timed(timings, "fight_cats"):
+            fight_cats(cats, _CONFIG.DISTANCE, _CONFIG.NEIGHBOUR_STENCIL)
+    elif _CONFIG.FUSED_STEP:
+        with timed(timings, "move_and_update_statuses"):
+            move_and_update_statuses(cats, _CONFIG.DISTANCE, _CONFIG.NEIGHBOUR_STENCIL)
+    else:
+        with timed(timings, "move_cats"):
+            move_cats(cats)
+
+        with timed(timings, "update_statuses"):
+            if _CONFIG.NEIGHBOUR_STENCIL == HALF_STENCIL:
+                update_statuses_symmetric(cats, _CONFIG.DISTANCE)
+            else:
+                update_statuses(cats, _CONFIG.DISTANCE)
+
+    if _CONFIG.METRICS_HISTORY > 0:
+        with timed(timings, "record_metrics"):
+            record_metrics(
+                cats, _STEP_IDX, verlet=_CONFIG.NEIGHBOUR_ENGINE == VERLET_ENGINE
+            )
+
+    if _RECORDER is not None:
+        with timed(timings, "record_frame"):
+            _RECORDER.record(cats, _STEP_IDX)
+
+    if _CONTACTS is not None:
+        with timed(timings, "record_contacts"):
+            _CONTACTS.record(_STEP_IDX)
+
+    if _CONFIG.REORDER_PERIOD > 0 and _STEP_IDX % _CONFIG.REORDER_PERIOD == 0:
+        with timed(timings, "reorder_cats"):
+            reorder_cats(cats)
+        invalidate_neighbour_lists()
+        invalidate_cell_storage()
+
+    if _CONFIG.CHECKPOINT_PATH and _STEP_IDX % _CONFIG.CHECKPOINT_EVERY == 0:
+        with timed(timings, "save_checkpoint"):
+            save_checkpoint(_CONFIG.CHECKPOINT_PATH, cats)
+
+
+def save_checkpoint(path: str, cats: ti.template()):
+    """
+    Saves the state of the simulation into an .npz file: every member of the
+    cats, the config, the step index and the key of the random streams.
+    The file is replaced only when it is completely written.
+    """
+    state = {f"cat_{name}": values for name, values in cats.to_numpy().items()}
+    if _CONFIG.REORDER_PERIOD > 0:
+        state["slots"] = get_slots()
+
+    seed, rng_step = get_clock()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            config=json.dumps(_CONFIG.to_dict()),
+            step=_STEP_IDX,
+            seed=seed,
+            rng_step=rng_step,
+            **state,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str, overrides: Optional[dict] = None):
+    """
+    Initializes the simulation from a file of save_checkpoint() and returns
+    the restored cats, the next step continues the saved run.
+    overrides: parameters to change, e.g. RECORD_PATH (the layout must stay)
+
+    The random streams are restored too, so the run continues bit-for-bit.
+    The recording and the contacts (if any) are continued: what was written
+    after the saved step (e.g. before a crash) is overwritten.
+    """
+    with np.load(path) as data:
+        config = Config().replace(**json.loads(str(data["config"])))
+        config = config.replace(**(overrides or {}))
+
+        step_idx = int(data["step"])
+        cats = init_simulation(config, place_cats=False, resume_step=step_idx)
+        cats.from_numpy(
+            {name[4:]: data[name] for name in data.files if name.startswith("cat_")}
+        )
+        if config.REORDER_PERIOD > 0 and "slots" in data.files:
+            set_slots(data["slots"])
+        if "rng_step" in data.files:
+            set_clock(int(data["seed"]), int(data["rng_step"]))
+
+        global _STEP_IDX
+        _STEP_IDX = step_idx
+
+    return cats
+
+
+def close_simulation():
+    """finishes writing of the recording and of the contacts (if any)"""
+    global _RECORDER, _CONTACTS
+    if _RECORDER is not None:
+        _RECORDER.close()
+        _RECORDER = None
+    if _CONTACTS is not None:
+        _CONTACTS.close()
+        _CONTACTS = None
+
+
+def pair_check_stats() -> dict:
+    """pair checks of the last step of the configured engine"""
+    if _CONFIG.NEIGHBOUR_ENGINE == VERLET_ENGINE:
+        stats = get_verlet_stats()
+        return {"checked": stats["checked"], "skipped": stats["skipped"]}
+    return get_pair_check_stats()
+
+
+@ti.kernel
+def _count_statuses(cats: ti.template(), cat_n: ti.i32, counts: ti.types.ndarray()):
+    for idx in range(cats.shape[0]):
+        ti.atomic_add(counts[idx // cat_n, ti.cast(cats[idx].status, ti.i32)], 1)
+
+
+def status_counts(cats: ti.template()) -> np.ndarray:
+    """
+    Number of cats with each status in each replica:
+    counts[replica, status], shape := (REPLICA_N, INTERACTION_LEVEL_0 + 1)
+    """
+    counts = np.zeros((_CONFIG.REPLICA_N, INTERACTION_LEVEL_0 + 1), dtype=np.int32)
+    _count_statuses(cats, _CONFIG.CATS_N, counts)
+    return counts
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    idx = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def run_headless(cats: ti.template(), steps: int, warmup: int = 0) -> dict:
+    """
+    Advances the simulation `steps` times without any window.
+
+    The first `warmup` steps are not measured (they include JIT compilation
+    or loading of the kernels from the offline cache). Returns a JSON-compatible
+    dict (times in ms unless the key says otherwise):
+        - steps, warmup_s, total_s: measured steps, wall time of the warmup
+          and of the measured steps
+        - steps_per_sec: None if no time was measured
+        - kernels_ms: wall time statistics of every phase of the step
+        - pair_checks_per_step, pair_checks_per_cat: see pair_check_stats()
+        - occupancy: mean and maximum over steps of get_occupancy_stats()
+          (with the Verlet engine over the steps which built the lists)
+        - step_latency_ms: p50, p99 and max of the whole step
+        - contacts_per_step (CONTACTS_PATH): mean number of listed pairs
+        - migration (INCREMENTAL_GRID): mean share of cats changing their
+          cell per step and the number of full rebuilds
+        - statuses_per_step (METRICS_HISTORY): mean number of cats of every
+          interaction level (all replicas)
+        - device_ms (Taichi kernel profiler): device time of every kernel
+    """
+    t0 = time.perf_counter()
+    for _ in range(warmup):
+        step(cats)
+    ti.sync()
+    warmup_s = time.perf_counter() - t0
+
+    if kernel_profiler_enabled():
+        kernel_times()
+
+    if _CONFIG.METRICS_HISTORY > 0:
+        export_metrics()
+    statuses = np.zeros((INTERACTION_LEVEL_0 + 1,), dtype=np.int64)
+
+    kernels = {}
+    latencies = []
+    pair_checks = {"checked": 0, "skipped": 0}
+    migration = {"migrants": 0, "rebuilt": 0}
+    occupancy = {"max_cell": [], "max_leaf": [], "split_cells": []}
+    verlet = _CONFIG.NEIGHBOUR_ENGINE == VERLET_ENGINE
+    builds = get_verlet_stats()["builds"] if verlet else 0
+    contacts_before = _CONTACTS.edges if _CONTACTS is not None else 0
+
+    for _ in range(steps):
+        t0 = time.perf_counter()
+        step(cats, kernels)
+        ti.sync()
+        latencies.append(time.perf_counter() - t0)
+
+        for name, value in pair_check_stats().items():
+            pair_checks[name] += value
+
+        # the grid of the Verlet engine is binned only when the lists are built
+        if not verlet or get_verlet_stats()["builds"] > builds:
+            for name, value in get_occupancy_stats().items():
+                occupancy[name].append(value)
+        if verlet:
+            builds = get_verlet_stats()["builds"]
+
+        if _CONFIG.INCREMENTAL_GRID:
+            for name, value in get_migration_stats().items():
+                migration[name] += value
+
+        if _CONFIG.METRICS_HISTORY > 0:
+            statuses += export_metrics()["statuses"].sum(axis=(0, 1))
+
+    total = sum(latencies)
+    latencies.sort()
+
+    result = {
+        "steps": steps,
+        "warmup_s": warmup_s,
+        "total_s": total,
+        "steps_per_sec": steps / total if total > 0 else None,
+        "kernels_ms": summarize(kernels),
+        "pair_checks_per_step": {
+            name: value / steps if steps else 0.0 for name, value in pair_checks.items()
+        },
+        "pair_checks_per_cat": (
+            pair_checks["checked"] / steps / (_CONFIG.CATS_N * _CONFIG.REPLICA_N)
+            if steps
+            else 0.0
+        ),
+        "occupancy": {
+            name: {
+                "mean": sum(values) / len(values) if values else 0.0,
+                "max": max(values, default=0),
+            }
+            for name, values in occupancy.items()
+        },
+        "step_latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1e3 if latencies else 0.0,
+            "p99": percentile(latencies, 0.99) * 1e3 if latencies else 0.0,
+            "max": latencies[-1] * 1e3 if latencies else 0.0,
+        },
+    }
+
+    if _CONTACTS is not None:
+        result["contacts_per_step"] = (
+            (_CONTACTS.edges - contacts_before) / steps if steps else 0.0
+        )
+
+    if _CONFIG.INCREMENTAL_GRID:
+        result["migration"] = {
+            "rate_per_step": (
+                migration["migrants"] / steps / (_CONFIG.CATS_N * _CONFIG.REPLICA_N)
+                if steps
+                else 0.0
+            ),
+            "rebuilds": migration["rebuilt"],
+        }
+
+    if _CONFIG.METRICS_HISTORY > 0:
+        result["statuses_per_step"] = {
+            name: int(statuses[level]) / steps if steps else 0.0
+            for name, level in (
+                ("no", INTERACTION_NO),
+                ("level_1", INTERACTION_LEVEL_1),
+                ("level_0", INTERACTION_LEVEL_0),
+            )
+        }
+
+    if kernel_profiler_enabled():
+        result["device_ms"] = kernel_times()
+
+    return result
@@ -1,3 +1,5 @@
+import math
+
 import taichi as ti
 import taichi.math as tm
 
@@ -23,12 +25,13 @@ def chebyshev_distance(point1: tm.vec2, point2: tm.vec2) -> ti.f32:
 
 
 @ti.func
-def get_distance(p1: tm.vec2, p2: tm.vec2, distance_type: ti.i32) -> ti.f32:
+def get_distance(p1: tm.vec2, p2: tm.vec2, distance_type: ti.template()) -> ti.f32:
+    """distance_type is a compile time constant: one metric per compiled kernel"""
     ans: ti.f32 = 0
 
-    if distance_type == MANHATTAN_DISTANCE:
+    if ti.static(distance_type == MANHATTAN_DISTANCE):
         ans = manhattan_distance(p1, p2)
-    elif distance_type == CHEBYSHEV_DISTANCE:
+    elif ti.static(distance_type == CHEBYSHEV_DISTANCE):
         ans = chebyshev_distance(p1, p2)
     else:
         ans = euclidean_distance(p1, p2)
@@ -36,19 +39,131 @@ def get_distance(p1: tm.vec2, p2: tm.vec2, distance_type: ti.i32) -> ti.f32:
     return ans
 
 
+def is_squared(distance_type: int) -> bool:
+    """get_distance_key() of the metric is the squared distance"""
+    return distance_type not in (MANHATTAN_DISTANCE, CHEBYSHEV_DISTANCE)
+
+
+def distance_key_of(dist: float, distance_type: int) -> float:
+    """the value get_distance_key() has at distance `dist` (for the thresholds)"""
+    return dist * dist if is_squared(distance_type) else dist
+
+
+@ti.func
+def get_distance_key(p1: tm.vec2, p2: tm.vec2, distance_type: ti.template()) -> ti.f32:
+    """
+    Monotonic in get_distance(), for comparisons with thresholds taken by
+    distance_key_of(): the squared distance for the euclidean metric (no sqrt),
+    the distance itself for the others.
+    """
+    key: ti.f32 = 0
+
+    if ti.static(is_squared(distance_type)):
+        delta = p1 - p2
+        key = delta.dot(delta)
+    else:
+        key = get_distance(p1, p2, distance_type)
+
+    return key
+
+
+@ti.func
+def exclusive_scan(
+    values: ti.template(),
+    out: ti.template(),
+    block_sums: ti.template(),
+    n: ti.i32,
+    block_sz: ti.i32,
+):
+    """
+    Blocked parallel exclusive prefix sum (must be called from the kernel top level):
+        - out[i] := values[0] + ... + values[i - 1], out[n] := total
+        - sizes: values >= n, out >= n + 1, block_sums >= ceil(n / block_sz)
+    Blocks are summed and rescanned in parallel; only ceil(n / block_sz)
+    block sums are scanned serially.
+    """
+    block_n = (n + block_sz - 1) // block_sz
+
+    for block in range(block_n):
+        _sum = 0
+        for idx in range(block * block_sz, ti.min((block + 1) * block_sz, n)):
+            _sum += values[idx]
+        block_sums[block] = _sum
+
+    ti.loop_config(serialize=True)
+    for block in range(1, block_n):
+        block_sums[block] += block_sums[block - 1]
+
+    for block in range(block_n):
+        _sum = 0
+        if block > 0:
+            _sum = block_sums[block - 1]
+        for idx in range(block * block_sz, ti.min((block + 1) * block_sz, n)):
+            out[idx] = _sum
+            _sum += values[idx]
+
+    out[n] = 0
+    if block_n > 0:
+        out[n] = block_sums[block_n - 1]
+
+
+def scan_block_size(n: int) -> int:
+    """block size of exclusive_scan() balancing the serial and the parallel parts"""
+    return max(64, math.isqrt(n))
+
+
+"""
+Counter-based random numbers (SplitMix-style: a draw is a hash of its key):
+    - a stream is keyed by (seed, key, step), e.g. key := cat id, and draw k
+      of it is rng_u32(stream, k); nothing is shared between threads, so the
+      draws do not depend on the number of threads and on the scheduling
+    - rng_hash() is the "lowbias32" integer finalizer (bijective on u32)
+"""
+
+
+@ti.func
+def rng_hash(x: ti.u32) -> ti.u32:
+    h = x
+    h ^= h >> 16
+    h *= ti.u32(0x7FEB352D)
+    h ^= h >> 15
+    h *= ti.u32(0x846CA68B)
+    h ^= h >> 16
+    return h
+
+
+@ti.func
+def rng_stream(seed: ti.u32, key: ti.i32, step: ti.u32) -> ti.u32:
+    """independent stream of every (seed, key, step)"""
+    return rng_hash(rng_hash(rng_hash(seed) ^ ti.cast(key, ti.u32)) ^ step)
+
+
+@ti.func
+def rng_u32(stream: ti.u32, counter: ti.u32) -> ti.u32:
+    """draw number `counter` of the stream"""
+    return rng_hash(stream ^ rng_hash(counter))
+
+
+@ti.func
+def rng_f32(stream: ti.u32, counter: ti.u32) -> ti.f32:
+    """uniform in [0; 1): the upper 24 bits of rng_u32() (the f32 mantissa)"""
+    return ti.cast(rng_u32(stream, counter) >> 8, ti.f32) * ti.static(1.0 / (1 << 24))
+
+
 @ti.func
 def move_pattern_random(
-    point_: tm.vec2, move_r: ti.f32, plate_w: ti.i32, plate_h: ti.i32
+    point_: tm.vec2, move_r: ti.f32, plate_w: ti.i32, plate_h: ti.i32, stream: ti.u32
 ) -> tm.vec2:
+    """takes draws 0-3 of the stream (see rng_stream())"""
     # unsigned values
-    xd_u = ti.random() * move_r
-    yd_u = ti.random() * move_r
+    xd_u = rng_f32(stream, 0) * move_r
+    yd_u = rng_f32(stream, 1) * move_r
 
     # generate sign: sign_f(x) = -2x + 1
     #   if sign_f(1) -> -1
     #   if sign_f(0) -> +1
-    xd_s = -2 * (ti.random(dtype=ti.i32) % 2) + 1
-    yd_s = -2 * (ti.random(dtype=ti.i32) % 2) + 1
+    xd_s = -2 * ti.cast(rng_u32(stream, 2) & 1, ti.i32) + 1
+    yd_s = -2 * ti.cast(rng_u32(stream, 3) & 1, ti.i32) + 1
 
     new_x = point_[0] + xd_u * xd_s
     new_y = point_[1] + yd_u * yd_s
@@ -69,11 +184,12 @@ def move_pattern_line(
     move_r: ti.f32,
     plate_w: ti.i32,
     plate_h: ti.i32,
+    stream: ti.u32,
 ) -> tm.vec2:
     delta = point_ - old_point_
     n_point_ = point_ + delta
 
-    random_point_ = move_pattern_random(point_, move_r, plate_w, plate_h)
+    random_point_ = move_pattern_random(point_, move_r, plate_w, plate_h, stream)
 
     if not (0 <= n_point_[0] <= plate_w):
         n_point_[0] = random_point_[0]
@@ -0,0 +1,290 @@
+from typing import Any
+
+import taichi as ti
+import taichi.math as tm
+
+from catsim.cat import tick
+from catsim.constants import HALF_STENCIL, INTERACTION_LEVEL_0
+from catsim.grid import (
+    cat_cell,
+    cat_in_cell_order,
+    cat_replica,
+    cell_range,
+    fight_symmetric,
+    init_cell_storage,
+    setup_grid,
+)
+from catsim.tools import distance_key_of, get_distance, get_distance_key
+
+__all__ = [
+    "build_neighbour_lists",
+    "get_verlet_stats",
+    "invalidate_neighbour_lists",
+    "move_cats_tracked",
+    "needs_rebuild",
+    "setup_verlet",
+    "update_statuses_verlet",
+    "verlet_pair_checks",
+]
+
+"""
+Verlet neighbour lists:
+    - every cat keeps the list of cats closer than RADIUS_1 + SKIN
+    - lists are rebuilt with the grid only when some cat has moved farther
+      than SKIN / 2 since the last build (in the same distance type), so by
+      the triangle inequality no pair within RADIUS_1 is lost
+    - between rebuilds update_statuses_verlet() checks only listed pairs
+"""
+
+# global settings
+_CATS_N: ti.i32
+_SKIN: ti.f32
+_CUTOFF: ti.f32
+
+"""
+contains neighbours of each cat:
+    - size := capacity >= F_NEIGHBOUR_TOTAL, grows on rebuild
+    - { F_NEIGHBOURS[j] } for j from [Head_i ; Head_i + F_NEIGHBOUR_N[i])
+      are neighbours of cat i, Head_i := F_NEIGHBOUR_HEADS[i]
+    - ranges of cats are reserved with an atomic counter, so they are not
+      ordered by cat index
+    - HALF_STENCIL: only neighbours with a greater index
+"""
+_F_NEIGHBOURS: Any
+_F_NEIGHBOUR_HEADS: Any
+_F_NEIGHBOUR_N: Any
+_F_NEIGHBOUR_TOTAL: Any
+# freed when the buffer grows or setup_verlet() is called again (a tree of
+# a previous Taichi runtime is skipped by destroy())
+_NEIGHBOURS_TREE: Any = None
+
+"""
+contains position of each cat at the last build:
+    - size := cats_n
+    - F_MAX_DISPLACEMENT is the maximum distance from it (updated by move_cats_tracked)
+"""
+_F_REF_POINTS: Any
+_F_MAX_DISPLACEMENT: Any
+
+# pair check counters of the last update (see grid.get_pair_check_stats)
+_F_PAIR_CHECKS: Any
+_F_PAIR_CHECKS_SKIPPED: Any
+
+# lists must be rebuilt regardless of displacement (first step, cats permuted)
+_INVALID: bool = True
+_BUILDS: int = 0
+
+
+def _allocate_neighbours(capacity: int):
+    global _F_NEIGHBOURS, _NEIGHBOURS_TREE
+    if _NEIGHBOURS_TREE is not None:
+        _NEIGHBOURS_TREE.destroy()
+
+    builder = ti.FieldsBuilder()
+    _F_NEIGHBOURS = ti.field(dtype=ti.i32)
+    builder.dense(ti.i, capacity).place(_F_NEIGHBOURS)
+    _NEIGHBOURS_TREE = builder.finalize()
+
+
+def setup_verlet(
+    cat_n: ti.i32,
+    r1: ti.f32,
+    skin: ti.f32,
+    width: ti.i32,
+    height: ti.i32,
+    replica_n: ti.i32 = 1,
+):
+    """
+    (re)initializes `grid` with cells of RADIUS_1 + SKIN, it is used for builds
+    cat_n: number of cats in one replica (see grid._REPLICA_N)
+    """
+    global _CATS_N, _SKIN, _CUTOFF
+    _CATS_N = cat_n * replica_n
+    _SKIN = skin
+    _CUTOFF = r1 + skin
+
+    setup_grid(cat_n=cat_n, r1=_CUTOFF, width=width, height=height, replica_n=replica_n)
+
+    global _F_NEIGHBOUR_HEADS, _F_NEIGHBOUR_N, _F_NEIGHBOUR_TOTAL
+    _F_NEIGHBOUR_HEADS = ti.field(dtype=ti.i32, shape=(_CATS_N,))
+    _F_NEIGHBOUR_N = ti.field(dtype=ti.i32, shape=(_CATS_N,))
+    _F_NEIGHBOUR_TOTAL = ti.field(dtype=ti.i32, shape=())
+
+    global _F_REF_POINTS, _F_MAX_DISPLACEMENT
+    _F_REF_POINTS = tm.vec2.field(shape=(_CATS_N,))
+    _F_MAX_DISPLACEMENT = ti.field(dtype=ti.f32, shape=())
+
+    global _F_PAIR_CHECKS, _F_PAIR_CHECKS_SKIPPED
+    _F_PAIR_CHECKS = ti.field(dtype=ti.i64, shape=())
+    _F_PAIR_CHECKS_SKIPPED = ti.field(dtype=ti.i64, shape=())
+
+    global _INVALID, _BUILDS
+    _allocate_neighbours(_CATS_N)
+    _INVALID = True
+    _BUILDS = 0
+
+
+@ti.func
+def _is_listed(
+    cats: ti.template(),
+    idx1: ti.i32,
+    idx2: ti.i32,
+    distance_type: ti.template(),
+    stencil: ti.template(),
+):
+    listed = idx1 != idx2
+    if ti.static(stencil == HALF_STENCIL):
+        listed = idx1 < idx2
+
+    return listed and (
+        get_distance_key(cats[idx1].point, cats[idx2].point, distance_type)
+        <= ti.static(distance_key_of(_CUTOFF, distance_type))
+    )
+
+
+@ti.func
+def _list_neighbours(
+    cats: ti.template(),
+    idx1: ti.i32,
+    neighbours: ti.template(),
+    head: ti.i32,
+    distance_type: ti.template(),
+    stencil: ti.template(),
+    fill: ti.template(),
+) -> ti.i32:
+    """counts (and writes to `neighbours` from `head` if `fill`) neighbours of the cat"""
+    count = 0
+    cell = cat_cell(idx1)
+    replica = cat_replica(idx1)
+
+    for offset in ti.static(ti.ndrange((-1, 2), (-1, 2))):
+        head_tail = cell_range(cell + tm.ivec2(offset[0], offset[1]), replica)
+        for j in range(head_tail[0], head_tail[1]):
+            idx2 = cat_in_cell_order(j)
+            if _is_listed(cats, idx1, idx2, distance_type, stencil):
+                if ti.static(fill):
+                    neighbours[head + count] = idx2
+                count += 1
+
+    return count
+
+
+@ti.kernel
+def _build(
+    cats: ti.template(),
+    neighbours: ti.template(),
+    distance_type: ti.template(),
+    stencil: ti.template(),
+):
+    """
+    Every cat counts its neighbours, reserves a range for them and lists them
+    while they are still in cache. Ranges beyond the capacity are not written,
+    the host grows the buffer and runs the build again.
+    """
+    init_cell_storage(cats)
+
+    _F_NEIGHBOUR_TOTAL[None] = 0
+    _F_MAX_DISPLACEMENT[None] = 0.0
+
+    for idx1 in range(_CATS_N):
+        count = _list_neighbours(
+            cats, idx1, neighbours, 0, distance_type, stencil, False
+        )
+        head = ti.atomic_add(_F_NEIGHBOUR_TOTAL[None], count)
+        _F_NEIGHBOUR_HEADS[idx1] = head
+        _F_NEIGHBOUR_N[idx1] = count
+
+        if head + count <= neighbours.shape[0]:
+            _list_neighbours(cats, idx1, neighbours, head, distance_type, stencil, True)
+
+        _F_REF_POINTS[idx1] = cats[idx1].point
+
+
+def build_neighbour_lists(cats: ti.template(), distance_type: ti.i32, stencil: ti.i32):
+    """rebuilds lists for the current positions, grows the buffer if needed"""
+    _build(cats, _F_NEIGHBOURS, distance_type, stencil)
+
+    total = int(_F_NEIGHBOUR_TOTAL[None])
+    if total > _F_NEIGHBOURS.shape[0]:
+        # a new buffer recompiles the kernels using it, so it grows at least twice
+        _allocate_neighbours(max(total + total // 4, 2 * _F_NEIGHBOURS.shape[0]))
+        _build(cats, _F_NEIGHBOURS, distance_type, stencil)
+
+    global _INVALID, _BUILDS
+    _INVALID = False
+    _BUILDS += 1
+
+
+@ti.kernel
+def move_cats_tracked(cats: ti.template(), distance_type: ti.template()):
+    """move_cats() which also tracks the maximum displacement since the last build"""
+    tick()
+    for idx in range(_CATS_N):
+        cats[idx].move()
+        ti.atomic_max(
+            _F_MAX_DISPLACEMENT[None],
+            get_distance(cats[idx].point, _F_REF_POINTS[idx], distance_type),
+        )
+
+
+def invalidate_neighbour_lists():
+    """must be called when cats are permuted (e.g. by reorder_cats)"""
+    global _INVALID
+    _INVALID = True
+
+
+def needs_rebuild() -> bool:
+    return _INVALID or _F_MAX_DISPLACEMENT[None] > _SKIN / 2
+
+
+@ti.kernel
+def _update_statuses(
+    cats: ti.template(),
+    neighbours: ti.template(),
+    distance_type: ti.template(),
+    stencil: ti.template(),
+):
+    _F_PAIR_CHECKS[None] = 0
+    _F_PAIR_CHECKS_SKIPPED[None] = 0
+
+    for idx1 in range(_CATS_N):
+        head = _F_NEIGHBOUR_HEADS[idx1]
+        tail = head + _F_NEIGHBOUR_N[idx1]
+        checked = 0
+
+        for j in range(head, tail):
+            if ti.static(stencil == HALF_STENCIL):
+                fight_symmetric(cats, idx1, neighbours[j], distance_type)
+            else:
+                if cats[idx1].status == INTERACTION_LEVEL_0:
+                    break
+                cats[idx1].fight_with(cats[neighbours[j]], distance_type)
+            checked += 1
+
+        _F_PAIR_CHECKS[None] += checked
+        _F_PAIR_CHECKS_SKIPPED[None] += tail - head - checked
+
+
+def update_statuses_verlet(cats: ti.template(), distance_type: ti.i32, stencil: ti.i32):
+    """
+    update_statuses() over the neighbour lists (statuses must be reset by move()).
+    Lists must be valid, see needs_rebuild().
+    """
+    _update_statuses(cats, _F_NEIGHBOURS, distance_type, stencil)
+
+
+@ti.func
+def verlet_pair_checks() -> ti.i64:
+    """number of pairs checked by the last update_statuses_verlet()"""
+    return _F_PAIR_CHECKS[None]
+
+
+def get_verlet_stats() -> dict:
+    """pair checks of the last update, number of builds and size of the lists"""
+    return {
+        "checked": int(_F_PAIR_CHECKS[None]),
+        "skipped": int(_F_PAIR_CHECKS_SKIPPED[None]),
+        "builds": _BUILDS,
+        "neighbours": int(_F_NEIGHBOUR_TOTAL[None]),
+        "capacity": _F_NEIGHBOURS.shape[0],
+    }
@@ -0,0 +1,123 @@
+import json
+import os
+import queue
+import threading
+
+__all__ = [
+    "BackgroundWriter",
+]
+
+"""
+Streaming into a directory (base of recorder.Recorder and contacts.ContactWriter):
+    - the simulation queues items with put(), a background thread writes them
+    - the thread opens the files (see _open()) and closes them when it stops
+    - after every written item the files are flushed and meta.json is replaced
+      (only when it is completely written), so the items written before a
+      crash stay readable
+    - an error of the thread is raised again by the next put() or by close(),
+      the items queued after it are dropped
+"""
+
+
+class BackgroundWriter:
+    """Writes queued items into `path` (a directory) in a background thread."""
+
+    def __init__(self, path: str, name: str, meta: dict, written: dict, maxsize=0):
+        """
+        name: of the writer in the thread name and in the errors
+        meta: constant part of meta.json
+        written: counters of the written items (updated by _write()), they
+        are saved into meta.json too
+        maxsize: put() waits while `maxsize` items are queued (0 - never)
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.name = name
+        self._meta = meta
+        self._written = dict(written)
+        self._write_meta()
+
+        self._queued = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._opened = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"catsim-{name}", daemon=True
+        )
+        self._thread.start()
+
+        # the files are opened by the thread
+        self._opened.wait()
+        if self._error is not None:
+            self._thread.join()
+            raise self._error
+
+    def _open(self):
+        """context manager of the thread, returns the files passed to _write()"""
+        raise NotImplementedError
+
+    def _write(self, files, item):
+        """writes `item` and updates the counters of self._written"""
+        raise NotImplementedError
+
+    def _flush(self, files):
+        raise NotImplementedError
+
+    def _release(self, item):
+        """called for every item taken from the queue (written or not)"""
+
+    def check(self):
+        """raises the error of the thread (if any)"""
+        if self._error is not None:
+            raise RuntimeError(f"Writer of {self.name} failed") from self._error
+
+    def put(self, item):
+        """queues `item` for the thread, waits while the queue is full"""
+        self.check()
+        self._queued.put(item)
+
+    def _run(self):
+        try:
+            with self._open() as files:
+                self._opened.set()
+                self._write_items(files)
+        except (OSError, ValueError) as e:
+            # the files could not be opened or closed
+            self._error = e
+        finally:
+            self._opened.set()
+
+    def _write_items(self, files):
+        while True:
+            item = self._queued.get()
+            if item is None:
+                return
+
+            try:
+                if self._error is None:
+                    self._write(files, item)
+                    self._flush(files)
+                    self._write_meta()
+            except Exception as e:  # noqa: BLE001
+                # raised again by put() or close(); an error leaving the thread
+                # would stop the queue, and put() would wait for it forever
+                self._error = e
+            self._release(item)
+
+    def _write_meta(self):
+        path = os.path.join(self.path, "meta.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(dict(self._meta, **self._written), f)
+        os.replace(f"{path}.tmp", path)
+
+    def close(self):
+        """waits for the queued items and closes the files"""
+        self._queued.put(None)
+        self._thread.join()
+        self._write_meta()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,4 @@
+import catsim
+
+# importing catsim does not initialize Taichi
+catsim.init()
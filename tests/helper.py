@@ -12,6 +12,7 @@ def init_cats_with_custom_points(
     points: ti.template(),
 ):
     for i in range(n):
+        cats[i].id = i
         cats[i].radius = radius
         cats[i]._set_point(points[i])
         cats[i].move_pattern = const.MOVE_PATTERN_RANDOM_ID
@@ -21,6 +22,7 @@ def init_cats_with_custom_points(
 @ti.kernel
 def set_cat_init_positions(n: ti.i32, r: ti.f32, cats: ti.template()):
     for idx in range(n):
+        cats[idx].id = idx
         cats[idx].init_cat(r)
 
 
@@ -29,7 +31,7 @@ def primitive_update_states(
     n: ti.i32,
     cats: ti.template(),
     statuses: ti.types.ndarray(),
-    distance_type: ti.i32,
+    distance_type: ti.template(),
     r0: ti.f32,
     r1: ti.f32,
 ):
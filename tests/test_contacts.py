@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import catsim.constants as const
+from catsim import contacts
+from catsim.contacts import ContactLog, get_contact_buffer
+from catsim.settings import Config
+from catsim.simulation import close_simulation, init_simulation, step
+
+
+def _brute_force(cats, config):
+    points = np.zeros((config.CATS_N, 2), dtype=np.float64)
+    points[cats.id.to_numpy()] = cats.point.to_numpy()
+
+    dist = np.linalg.norm(points[:, None] - points[None, :], axis=-1)
+    a, b = np.nonzero(np.triu(dist <= config.RADIUS_1, k=1))
+    levels = np.where(
+        dist[a, b] <= config.RADIUS_0,
+        const.INTERACTION_LEVEL_0,
+        const.INTERACTION_LEVEL_1,
+    )
+    return {(int(i), int(j)): int(level) for i, j, level in zip(a, b, levels)}
+
+
+class TestContacts:
+    @pytest.mark.parametrize("stencil", [const.FULL_STENCIL, const.HALF_STENCIL])
+    @pytest.mark.parametrize("incremental", [False, True])
+    def test_same_as_brute_force(self, tmp_path, stencil, incremental):
+        STEPS = 3
+        config = Config().replace(
+            CATS_N=500,
+            PLATE_WIDTH=100,
+            PLATE_HEIGHT=100,
+            NEIGHBOUR_STENCIL=stencil,
+            INCREMENTAL_GRID=incremental,
+            CONTACTS_PATH=str(tmp_path),
+        )
+        cats = init_simulation(config)
+
+        expected = []
+        for _ in range(STEPS):
+            step(cats)
+            expected.append(_brute_force(cats, config))
+        close_simulation()
+
+        log = ContactLog(str(tmp_path))
+        assert len(log) == STEPS
+        assert list(log.step_ids) == list(range(1, STEPS + 1))
+
+        for idx in range(STEPS):
+            edges = log.read(idx)
+            keys = (edges["a"].astype(np.int64) << 32) | edges["b"]
+            assert np.all(np.diff(keys) > 0)
+            result = {
+                (int(a), int(b)): int(level)
+                for a, b, level in zip(edges["a"], edges["b"], edges["level"])
+            }
+            assert result == expected[idx]
+
+    def test_overflow(self, tmp_path):
+        config = Config().replace(
+            CATS_N=500,
+            PLATE_WIDTH=50,
+            PLATE_HEIGHT=50,
+            MOVE_PATTERN_ID=const.MOVE_PATTERN_RANDOM_ID,
+            PROB_INTERACTION=const.ENABLE_PROB_INTER,
+        )
+        cats = init_simulation(config)
+        step(cats)
+        expected = cats.status.to_numpy()
+
+        # the same run with a buffer far too small for the pairs
+        cats = init_simulation(config.replace(CONTACTS_PATH=str(tmp_path)))
+        contacts._allocate(1)
+        step(cats)
+        statuses = cats.status.to_numpy()
+        close_simulation()
+
+        log = ContactLog(str(tmp_path))
+        assert get_contact_buffer().capacity >= log.edge_n > 1
+        assert np.array_equal(statuses, expected)
+
+        # every cat with a status is in some pair of its level or higher
+        edges = log.read(0)
+        ids = cats.id.to_numpy()
+        for cat_id, status in zip(ids, statuses):
+            if status == const.INTERACTION_NO:
+                continue
+            mask = (edges["a"] == cat_id) | (edges["b"] == cat_id)
+            assert edges["level"][mask].max() >= status
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {"NEIGHBOUR_ENGINE": const.VERLET_ENGINE},
+            {"FUSED_STEP": True},
+            {"PROFILE": True},
+        ],
+    )
+    def test_invalid(self, params):
+        config = Config().replace(CONTACTS_PATH="contacts", **params)
+        with pytest.raises(ValueError):
+            init_simulation(config)
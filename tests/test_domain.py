@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import catsim.constants as const
+from catsim.domain import Domain, validate_domain
+from catsim.settings import Config
+from catsim.simulation import init_simulation, step
+
+
+class TestDomain:
+    @pytest.mark.parametrize("stencil", [const.FULL_STENCIL, const.HALF_STENCIL])
+    @pytest.mark.parametrize(
+        "move_pattern, prob_inter",
+        [
+            (const.MOVE_PATTERN_PHIS_ID, const.DISABLE_PROB_INTER),
+            (const.MOVE_PATTERN_RANDOM_ID, const.ENABLE_PROB_INTER),
+        ],
+    )
+    def test_same_as_one_process(self, stencil, move_pattern, prob_inter):
+        N, STEPS, MOVE_RADIUS = 2000, 10, 2
+
+        # draws are keyed by the cat ids, so the runs must match
+        config = Config().replace(
+            CATS_N=N,
+            PLATE_WIDTH=100,
+            PLATE_HEIGHT=100,
+            MOVE_RADIUS=MOVE_RADIUS,
+            MOVE_PATTERN_ID=move_pattern,
+            PROB_INTERACTION=prob_inter,
+            NEIGHBOUR_STENCIL=stencil,
+            TILE_COLS=2,
+            TILE_ROWS=2,
+        )
+        rng = np.random.default_rng(0)
+        points = rng.uniform(0, 100, (N, 2)).astype(np.float32)
+        prev_points = np.clip(
+            points + rng.uniform(-MOVE_RADIUS, MOVE_RADIUS, (N, 2)), 0, 100
+        ).astype(np.float32)
+
+        cats = init_simulation(config)
+        cats.point.from_numpy(points)
+        cats.prev_point.from_numpy(prev_points)
+        for _ in range(STEPS):
+            step(cats)
+        expected = cats.status.to_numpy()
+
+        with Domain(config, points, prev_points) as domain:
+            result = domain.run(STEPS)
+            statuses = domain.statuses()
+
+        assert sum(result["cats_per_tile"]) == N
+        assert result["migrants_per_step"] > 0
+        assert result["ghosts_per_step"] > 0
+        assert np.array_equal(statuses, expected)
+
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {"TILE_COLS": 20},
+            {"TILE_CAPACITY": 0.5},
+            {"NEIGHBOUR_ENGINE": const.VERLET_ENGINE},
+            {"CONTACTS_PATH": "contacts"},
+        ],
+    )
+    def test_invalid(self, params):
+        config = Config().replace(
+            PLATE_WIDTH=100, PLATE_HEIGHT=100, TILE_COLS=2, TILE_ROWS=2
+        )
+        with pytest.raises(ValueError):
+            validate_domain(config.replace(**params))
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 import taichi as ti
 import taichi.math as tm
@@ -8,9 +9,17 @@ from helper import (
 )
 
 import catsim.constants as const
-from catsim.cat import Cat, init_cat_env
+from catsim.cat import Cat, CompactCat, init_cat_env
 from catsim.constants import DISABLE_PROB_INTER, MOVE_PATTERN_RANDOM_ID
-from catsim.grid import setup_grid, update_statuses
+from catsim.grid import (
+    auto_cell_size,
+    get_occupancy_stats,
+    get_pair_check_stats,
+    move_and_update_statuses,
+    setup_grid,
+    update_statuses,
+    update_statuses_symmetric,
+)
 
 
 @ti.data_oriented
@@ -57,6 +66,102 @@ class TestUpdateStatus:
         for i in range(N):
             assert cats[i].status == expected_statuses[i]
 
+    def test_early_exit(self):
+        N, R0, R1, WIDTH, HEIGHT = 4, 2, 8, 50, 50
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        # 3 cats fight in one cell, the 4th one hisses from the neighbour cell
+        points = ti.Vector.field(n=2, dtype=float, shape=(N,))
+        points[0] = tm.vec2(1.0, 1.0)
+        points[1] = tm.vec2(1.0, 1.0)
+        points[2] = tm.vec2(1.0, 1.0)
+        points[3] = tm.vec2(1.0, 9.0)
+
+        cats = Cat.field(shape=(N,))
+        init_cats_with_custom_points(n=N, radius=1, cats=cats, points=points)
+
+        setup_grid(N, R1, WIDTH, HEIGHT)
+        update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+
+        assert list(cats.status.to_numpy()) == [
+            const.INTERACTION_LEVEL_0,
+            const.INTERACTION_LEVEL_0,
+            const.INTERACTION_LEVEL_0,
+            const.INTERACTION_LEVEL_1,
+        ]
+        # fighting cats stop after the first check, the 4th one checks all 3
+        assert get_pair_check_stats() == {"checked": 6, "skipped": 6}
+
+    @pytest.mark.parametrize(
+        "distance_type",
+        [const.EUCLIDEAN_DISTANCE, const.MANHATTAN_DISTANCE, const.CHEBYSHEV_DISTANCE],
+    )
+    def test_prob_inter(self, distance_type):
+        N, R0, R1, WIDTH, HEIGHT = 3, 0.5, 8, 50, 50
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=const.ENABLE_PROB_INTER,
+        )
+
+        # 1 / dist^2 == 1 at distance 1, so the draw always succeeds
+        points = ti.Vector.field(n=2, dtype=float, shape=(N,))
+        points[0] = tm.vec2(10.0, 10.0)
+        points[1] = tm.vec2(11.0, 10.0)
+        points[2] = tm.vec2(40.0, 40.0)
+
+        cats = Cat.field(shape=(N,))
+        init_cats_with_custom_points(n=N, radius=R0, cats=cats, points=points)
+
+        setup_grid(N, float(R1), float(WIDTH), float(HEIGHT))
+        update_statuses(cats, distance_type)
+
+        assert [cats[i].status for i in range(N)] == [
+            const.INTERACTION_LEVEL_1,
+            const.INTERACTION_LEVEL_1,
+            const.INTERACTION_NO,
+        ]
+
+    def test_prob_inter_stencils(self):
+        N, R0, R1, WIDTH, HEIGHT = 2000, 2, 8, 100, 100
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=const.ENABLE_PROB_INTER,
+        )
+        setup_grid(cat_n=N, r1=R1, width=WIDTH, height=HEIGHT)
+
+        cats = Cat.field(shape=(N,))
+        set_cat_init_positions(N, 1, cats)
+
+        # draws are keyed by the ordered pair, not by the order of the checks
+        update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+        expected = cats.status.to_numpy()
+        cats.status.fill(const.INTERACTION_NO)
+        update_statuses_symmetric(cats, const.EUCLIDEAN_DISTANCE)
+
+        assert np.array_equal(cats.status.to_numpy(), expected)
+        assert (expected == const.INTERACTION_LEVEL_1).any()
+
     @pytest.mark.parametrize(
         "N, R0, R1, RADIUS, WIDTH, HEIGHT, distance_type",
         [
@@ -66,6 +171,8 @@ class TestUpdateStatus:
             (10000, 2, 8, 1, 1000, 1000, const.EUCLIDEAN_DISTANCE),
             (10000, 2, 8, 1, 1500, 2000, const.EUCLIDEAN_DISTANCE),
             (50000, 2, 8, 1, 1000, 1000, const.EUCLIDEAN_DISTANCE),
+            (10000, 2, 8, 1, 1000, 1000, const.MANHATTAN_DISTANCE),
+            (10000, 2, 8, 1, 1000, 1000, const.CHEBYSHEV_DISTANCE),
         ],
     )
     def test_primitive_func(self, N, R0, R1, RADIUS, WIDTH, HEIGHT, distance_type):
@@ -91,3 +198,244 @@ class TestUpdateStatus:
 
         for i in range(N):
             assert cats[i].status == expected_statuses[i]
+
+    @pytest.mark.parametrize(
+        "N, R0, R1, RADIUS, WIDTH, HEIGHT, distance_type",
+        [
+            (10, 2, 8, 1, 100, 100, const.EUCLIDEAN_DISTANCE),
+            (1000, 2, 8, 1, 500, 500, const.EUCLIDEAN_DISTANCE),
+            (10000, 2, 8, 1, 1000, 1000, const.MANHATTAN_DISTANCE),
+            (10000, 2, 8, 1, 1500, 2000, const.CHEBYSHEV_DISTANCE),
+            (50000, 2, 8, 1, 1000, 1000, const.EUCLIDEAN_DISTANCE),
+        ],
+    )
+    def test_symmetric_primitive_func(
+        self, N, R0, R1, RADIUS, WIDTH, HEIGHT, distance_type
+    ):
+        setup_grid(cat_n=N, r1=R1, width=WIDTH, height=HEIGHT)
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        cats = Cat.field(shape=(N,))
+        set_cat_init_positions(N, RADIUS, cats)
+
+        expected_statuses = ti.ndarray(dtype=ti.i32, shape=(N,))
+        primitive_update_states(N, cats, expected_statuses, distance_type, R0, R1)
+
+        update_statuses_symmetric(cats, distance_type)
+
+        assert np.array_equal(cats.status.to_numpy(), expected_statuses.to_numpy())
+
+    @pytest.mark.parametrize("stencil", [const.FULL_STENCIL, const.HALF_STENCIL])
+    @pytest.mark.parametrize(
+        "move_pattern",
+        [
+            const.MOVE_PATTERN_RANDOM_ID,
+            const.MOVE_PATTERN_LINE_ID,
+            const.MOVE_PATTERN_PHIS_ID,
+        ],
+    )
+    def test_fused_step_primitive_func(self, stencil, move_pattern):
+        N, R0, R1, RADIUS, WIDTH, HEIGHT = 10000, 2, 8, 1, 1000, 1000
+        distance_type = const.EUCLIDEAN_DISTANCE
+
+        setup_grid(cat_n=N, r1=R1, width=WIDTH, height=HEIGHT)
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=move_pattern,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        cats = Cat.field(shape=(N,))
+        set_cat_init_positions(N, RADIUS, cats)
+
+        for _ in range(3):
+            move_and_update_statuses(cats, distance_type, stencil)
+
+        expected_statuses = ti.ndarray(dtype=ti.i32, shape=(N,))
+        primitive_update_states(N, cats, expected_statuses, distance_type, R0, R1)
+
+        assert np.array_equal(cats.status.to_numpy(), expected_statuses.to_numpy())
+
+    @pytest.mark.parametrize(
+        "cat_type, layout",
+        [
+            (Cat, ti.Layout.SOA),
+            (CompactCat, ti.Layout.AOS),
+            (CompactCat, ti.Layout.SOA),
+        ],
+    )
+    def test_layouts_primitive_func(self, cat_type, layout):
+        N, R0, R1, RADIUS, WIDTH, HEIGHT = 10000, 2, 8, 1, 1000, 1000
+        distance_type = const.EUCLIDEAN_DISTANCE
+
+        setup_grid(cat_n=N, r1=R1, width=WIDTH, height=HEIGHT)
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        cats = cat_type.field(shape=(N,), layout=layout)
+        set_cat_init_positions(N, RADIUS, cats)
+
+        expected_statuses = ti.ndarray(dtype=ti.i32, shape=(N,))
+        primitive_update_states(N, cats, expected_statuses, distance_type, R0, R1)
+
+        update_statuses(cats, distance_type)
+
+        assert np.array_equal(cats.status.to_numpy(), expected_statuses.to_numpy())
+
+    @pytest.mark.parametrize("update", [update_statuses, update_statuses_symmetric])
+    def test_probabilistic_pairs(self, update):
+        # isolated pairs of cats at distance 2: each cat hisses with p = 1 / 2^2
+        PAIRS_IN_ROW, R0, R1, WIDTH, HEIGHT = 50, 1, 8, 1000, 1000
+        N = 2 * PAIRS_IN_ROW * PAIRS_IN_ROW
+        P = 0.25
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=const.ENABLE_PROB_INTER,
+        )
+
+        points = ti.Vector.field(n=2, dtype=float, shape=(N,))
+        step = WIDTH / PAIRS_IN_ROW
+        for i in range(PAIRS_IN_ROW):
+            for j in range(PAIRS_IN_ROW):
+                pair = i * PAIRS_IN_ROW + j
+                points[2 * pair] = tm.vec2(i * step + 1, j * step + 1)
+                points[2 * pair + 1] = tm.vec2(i * step + 3, j * step + 1)
+
+        cats = Cat.field(shape=(N,))
+        init_cats_with_custom_points(n=N, radius=1, cats=cats, points=points)
+
+        setup_grid(N, R1, WIDTH, HEIGHT)
+        update(cats, const.EUCLIDEAN_DISTANCE)
+
+        statuses = cats.status.to_numpy().reshape(-1, 2)
+        hiss = statuses == const.INTERACTION_LEVEL_1
+
+        assert np.all((statuses == const.INTERACTION_NO) | hiss)
+        # both cats draw independently
+        assert hiss.mean() == pytest.approx(P, abs=0.03)
+        assert np.all(hiss, axis=1).mean() == pytest.approx(P * P, abs=0.02)
+
+    @pytest.mark.parametrize("update", [update_statuses, update_statuses_symmetric])
+    @pytest.mark.parametrize(
+        "cell_sz, split_factor",
+        [(None, 4), (4.0, 1), (6.0, 2), (6.0, 3), (20.0, 1)],
+    )
+    def test_clustered_primitive_func(self, update, cell_sz, split_factor):
+        # most of the cats are piled into the corner, as with MOVE_PATTERN_PHIS_ID
+        N, R0, R1, WIDTH, HEIGHT = 5000, 2, 8, 500, 500
+        distance_type = const.EUCLIDEAN_DISTANCE
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        rng = np.random.default_rng(0)
+        points_np = rng.uniform(0, WIDTH, (N, 2)).astype(np.float32)
+        points_np[: N * 4 // 5] = rng.uniform(0, 60, (N * 4 // 5, 2))
+
+        points = ti.Vector.field(n=2, dtype=float, shape=(N,))
+        points.from_numpy(points_np)
+
+        cats = Cat.field(shape=(N,))
+        init_cats_with_custom_points(n=N, radius=1, cats=cats, points=points)
+
+        setup_grid(N, R1, WIDTH, HEIGHT, cell_sz=cell_sz, split_factor=split_factor)
+        update(cats, distance_type)
+
+        expected_statuses = ti.ndarray(dtype=ti.i32, shape=(N,))
+        primitive_update_states(N, cats, expected_statuses, distance_type, R0, R1)
+
+        assert np.array_equal(cats.status.to_numpy(), expected_statuses.to_numpy())
+
+        occupancy = get_occupancy_stats()
+        if split_factor > 1:
+            assert occupancy["split_cells"] > 0
+            assert occupancy["max_leaf"] < occupancy["max_cell"]
+        else:
+            assert occupancy["max_leaf"] == occupancy["max_cell"]
+
+    @pytest.mark.parametrize("update", [update_statuses, update_statuses_symmetric])
+    @pytest.mark.parametrize("split_factor", [1, 4])
+    def test_ensemble_primitive_func(self, update, split_factor):
+        # replicas hold the same points: a cat must not see other replicas
+        REPLICA_N, N, R0, R1, WIDTH, HEIGHT = 3, 2000, 2, 8, 300, 300
+        distance_type = const.EUCLIDEAN_DISTANCE
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        rng = np.random.default_rng(0)
+        points_np = rng.uniform(0, WIDTH, (N, 2)).astype(np.float32)
+        points_np[: N // 2] = rng.uniform(0, 40, (N // 2, 2))
+
+        points = ti.Vector.field(n=2, dtype=float, shape=(N,))
+        points.from_numpy(points_np)
+        cats = Cat.field(shape=(N,))
+        init_cats_with_custom_points(n=N, radius=1, cats=cats, points=points)
+
+        expected_statuses = ti.ndarray(dtype=ti.i32, shape=(N,))
+        primitive_update_states(N, cats, expected_statuses, distance_type, R0, R1)
+
+        replica_points = ti.Vector.field(n=2, dtype=float, shape=(REPLICA_N * N,))
+        replica_points.from_numpy(np.tile(points_np, (REPLICA_N, 1)))
+        replicas = Cat.field(shape=(REPLICA_N * N,))
+        init_cats_with_custom_points(
+            n=REPLICA_N * N, radius=1, cats=replicas, points=replica_points
+        )
+
+        setup_grid(N, R1, WIDTH, HEIGHT, split_factor=split_factor, replica_n=REPLICA_N)
+        update(replicas, distance_type)
+
+        assert np.array_equal(
+            replicas.status.to_numpy().reshape(REPLICA_N, N),
+            np.tile(expected_statuses.to_numpy(), (REPLICA_N, 1)),
+        )
+
+    def test_auto_cell_size(self):
+        # sparse plate: about one cat per cell
+        assert auto_cell_size(100, 2, 1000, 1000) == pytest.approx(100)
+        # default config density: cell of RADIUS_1
+        assert auto_cell_size(500_000, 6, 2000, 2000) == 6
+        # dense plate: smaller cells, wider stencil
+        assert auto_cell_size(500_000, 24, 2000, 2000) < 24
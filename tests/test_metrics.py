@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from helper import set_cat_init_positions
+
+import catsim.constants as const
+from catsim.cat import Cat, init_cat_env
+from catsim.constants import DISABLE_PROB_INTER, MOVE_PATTERN_RANDOM_ID
+from catsim.grid import get_pair_check_stats, setup_grid, update_statuses
+from catsim.metrics import export_metrics, get_heatmap, record_metrics, setup_metrics
+
+
+class TestMetrics:
+    def _init(self, n, replica_n, history, heatmap_size):
+        R0, R1, WIDTH, HEIGHT = 2, 8, 300, 300
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+        setup_grid(n, R1, WIDTH, HEIGHT, replica_n=replica_n)
+        setup_metrics(
+            cat_n=n,
+            width=WIDTH,
+            height=HEIGHT,
+            history=history,
+            replica_n=replica_n,
+            heatmap_size=heatmap_size,
+        )
+
+        cats = Cat.field(shape=(n * replica_n,))
+        set_cat_init_positions(n * replica_n, 1, cats)
+        return cats
+
+    @pytest.mark.parametrize("replica_n", [1, 3])
+    def test_counts(self, replica_n):
+        N, HEATMAP_SIZE = 5000, 8
+        cats = self._init(N, replica_n, 16, HEATMAP_SIZE)
+
+        update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+        record_metrics(cats, 7)
+        records = export_metrics()
+
+        statuses = cats.status.to_numpy().reshape(replica_n, N)
+        expected = np.stack(
+            [
+                np.bincount(row, minlength=const.INTERACTION_LEVEL_0 + 1)
+                for row in statuses
+            ]
+        )
+
+        assert records["dropped"] == 0
+        assert np.array_equal(records["step"], [7])
+        assert np.array_equal(records["statuses"][0], expected)
+        assert records["pair_checks_per_cat"][0] == pytest.approx(
+            get_pair_check_stats()["checked"] / (N * replica_n)
+        )
+
+        heatmap = get_heatmap()
+        assert heatmap.shape == (
+            HEATMAP_SIZE,
+            HEATMAP_SIZE,
+            const.INTERACTION_LEVEL_0 + 1,
+        )
+        assert np.array_equal(heatmap.sum(axis=(0, 1)), expected.sum(axis=0))
+
+    def test_ring_buffer(self):
+        HISTORY = 4
+        cats = self._init(100, 1, HISTORY, 0)
+
+        for step_idx in range(3):
+            update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+            record_metrics(cats, step_idx)
+        assert np.array_equal(export_metrics()["step"], [0, 1, 2])
+
+        for step_idx in range(3, 10):
+            update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+            record_metrics(cats, step_idx)
+        records = export_metrics()
+
+        # only the last HISTORY records are kept
+        assert records["dropped"] == 3
+        assert np.array_equal(records["step"], [6, 7, 8, 9])
+        assert np.all(records["statuses"].sum(axis=(1, 2)) == 100)
+
+        assert len(export_metrics()["step"]) == 0
@@ -2,7 +2,7 @@ import pytest
 import taichi as ti
 import taichi.math as tm
 
-from catsim.tools import move_pattern_line, move_pattern_random
+from catsim.tools import move_pattern_line, move_pattern_random, rng_stream
 
 
 @ti.data_oriented
@@ -11,7 +11,7 @@ class TestMovePattern:
     def move_random(
         self, point: tm.vec2, move_r: ti.f32, plate_w: ti.i32, plate_h: ti.i32
     ) -> tm.vec2:
-        return move_pattern_random(point, move_r, plate_w, plate_h)
+        return move_pattern_random(point, move_r, plate_w, plate_h, rng_stream(0, 0, 0))
 
     @ti.kernel
     def move_line(
@@ -22,7 +22,9 @@ class TestMovePattern:
         plate_w: ti.i32,
         plate_h: ti.i32,
     ) -> tm.vec2:
-        return move_pattern_line(point, old_point, move_r, plate_w, plate_h)
+        return move_pattern_line(
+            point, old_point, move_r, plate_w, plate_h, rng_stream(0, 0, 0)
+        )
 
     @pytest.mark.parametrize(
         "x, y, move_radius",
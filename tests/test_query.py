@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from helper import set_cat_init_positions
+
+import catsim.constants as const
+from catsim.cat import Cat, init_cat_env
+from catsim.constants import DISABLE_PROB_INTER, MOVE_PATTERN_RANDOM_ID
+from catsim.grid import setup_grid
+from catsim.query import build_index, query_knn, query_radius, query_rect
+
+_METRICS = {
+    const.EUCLIDEAN_DISTANCE: lambda d: np.sqrt((d**2).sum(-1)),
+    const.MANHATTAN_DISTANCE: lambda d: np.abs(d).sum(-1),
+    const.CHEBYSHEV_DISTANCE: lambda d: np.abs(d).max(-1),
+}
+
+
+def _csr_to_sets(offsets, ids):
+    return [set(ids[offsets[q] : offsets[q + 1]]) for q in range(len(offsets) - 1)]
+
+
+class TestQuery:
+    N, R1, WIDTH, HEIGHT = 5000, 4, 100, 80
+
+    def setup_cats(self, split_factor=1):
+        init_cat_env(
+            move_radius=2,
+            r0=2,
+            r1=self.R1,
+            width=self.WIDTH,
+            height=self.HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+        setup_grid(
+            cat_n=self.N,
+            r1=self.R1,
+            width=self.WIDTH,
+            height=self.HEIGHT,
+            split_factor=split_factor,
+            split_threshold=4,
+        )
+
+        cats = Cat.field(shape=(self.N,))
+        set_cat_init_positions(self.N, 1, cats)
+        build_index(cats)
+
+        probes = np.random.default_rng(0).uniform(-5, 105, (300, 2)).astype(np.float32)
+        return cats, cats.point.to_numpy(), cats.id.to_numpy(), probes
+
+    @pytest.mark.parametrize("distance_type", list(_METRICS))
+    @pytest.mark.parametrize("split_factor", [1, 2])
+    def test_radius(self, distance_type, split_factor):
+        cats, points, ids, probes = self.setup_cats(split_factor)
+        radius = np.linspace(0, 12, len(probes), dtype=np.float32)
+
+        offsets, result = query_radius(cats, probes, radius, distance_type)
+
+        dist = _METRICS[distance_type](points[None, :, :] - probes[:, None, :])
+        expected = [set(ids[d <= r]) for d, r in zip(dist, radius)]
+        assert offsets[-1] == len(result)
+        assert _csr_to_sets(offsets, result) == expected
+
+    def test_rect(self):
+        cats, points, ids, probes = self.setup_cats()
+        rects = np.column_stack([probes, probes + [[7.5, 3.0]]])
+
+        offsets, result = query_rect(cats, rects)
+
+        lo, hi = rects[:, None, :2], rects[:, None, 2:]
+        inside = ((points[None] >= lo) & (points[None] <= hi)).all(-1)
+        assert _csr_to_sets(offsets, result) == [set(ids[m]) for m in inside]
+        assert np.array_equal(np.diff(offsets), inside.sum(-1))
+
+    @pytest.mark.parametrize("distance_type", list(_METRICS))
+    @pytest.mark.parametrize("k, max_distance", [(1, np.inf), (10, np.inf), (10, 3.0)])
+    def test_knn(self, distance_type, k, max_distance):
+        cats, points, _, probes = self.setup_cats()
+
+        offsets, result, dists = query_knn(cats, probes, k, max_distance, distance_type)
+
+        dist = _METRICS[distance_type](points[None, :, :] - probes[:, None, :])
+        for q in range(len(probes)):
+            expected = np.sort(dist[q][dist[q] <= max_distance])[:k]
+            answer = slice(offsets[q], offsets[q + 1])
+            assert np.allclose(dists[answer], expected, atol=1e-4)
+            # ids are the indices of the cats, ties may be listed in any order
+            assert np.allclose(dist[q][result[answer]], dists[answer], atol=1e-4)
+
+    def test_invalid(self):
+        cats = self.setup_cats()[0]
+        with pytest.raises(ValueError):
+            query_radius(cats, [[1.0, 1.0]], -1.0)
+        with pytest.raises(ValueError):
+            query_rect(cats, [[2.0, 2.0, 1.0, 3.0]])
+        with pytest.raises(ValueError):
+            query_knn(cats, [[1.0, 1.0]], 0)
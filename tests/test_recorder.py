@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+import pytest
+from helper import set_cat_init_positions
+
+import catsim.constants as const
+from catsim.cat import Cat, CompactCat, init_cat_env
+from catsim.constants import DISABLE_PROB_INTER, MOVE_PATTERN_RANDOM_ID
+from catsim.grid import move_and_update_statuses, setup_grid
+from catsim.recorder import Recorder, Recording
+from catsim.reorder import get_slots, reorder_cats, setup_reorder
+
+
+class TestRecorder:
+    @pytest.mark.parametrize("cat_type", [Cat, CompactCat])
+    def test_record_and_read(self, tmp_path, cat_type):
+        N, R0, R1, WIDTH, HEIGHT = 1000, 2, 8, 100, 100
+        STEPS, EVERY, FRAMES = 12, 3, 3
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+        setup_grid(cat_n=N, r1=R1, width=WIDTH, height=HEIGHT)
+        setup_reorder(cat_type, N)
+
+        cats = cat_type.field(shape=(N,))
+        set_cat_init_positions(N, 1, cats)
+
+        expected = {}
+        with Recorder(str(tmp_path), cat_n=N, frames=FRAMES, every=EVERY) as recorder:
+            for step_idx in range(1, STEPS + 1):
+                move_and_update_statuses(
+                    cats, const.EUCLIDEAN_DISTANCE, const.FULL_STENCIL
+                )
+                recorder.record(cats, step_idx)
+
+                # frames are in id order, the field is not
+                slots = get_slots()
+                expected[step_idx] = (
+                    cats.point.to_numpy()[slots],
+                    cats.status.to_numpy()[slots],
+                )
+                reorder_cats(cats)
+
+        # the last frame does not fit
+        assert recorder.skipped == 1
+
+        recording = Recording(str(tmp_path))
+        assert len(recording) == FRAMES
+        assert np.array_equal(recording.steps, [3, 6, 9])
+        assert recording.frame_of_step(6) == 1
+        assert recording.frame_of_step(7) is None
+
+        points, statuses = recording.read(1, 3)
+        for k, step_idx in enumerate([6, 9]):
+            assert np.array_equal(points[k], expected[step_idx][0])
+            assert np.array_equal(statuses[k], expected[step_idx][1])
+
+    def test_readable_while_recording(self, tmp_path):
+        N, R1 = 100, 8
+
+        init_cat_env(
+            move_radius=2,
+            r0=2,
+            r1=R1,
+            width=100,
+            height=100,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+        cats = Cat.field(shape=(N,))
+        set_cat_init_positions(N, 1, cats)
+
+        with Recorder(str(tmp_path), cat_n=N, frames=10) as recorder:
+            for step_idx in range(3):
+                recorder.record(cats, step_idx)
+
+            # meta.json follows the flushed frames (e.g. after a crash)
+            deadline = time.monotonic() + 10
+            while len(Recording(str(tmp_path))) < 3:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+
+            recording = Recording(str(tmp_path))
+            assert np.array_equal(recording.steps, [0, 1, 2])
+            assert np.array_equal(recording.points[2], cats.point.to_numpy())
@@ -0,0 +1,202 @@
+import threading
+
+import numpy as np
+import pytest
+import taichi as ti
+import taichi.math as tm
+from helper import init_cats_with_custom_points, set_cat_init_positions
+
+import catsim.constants as const
+from catsim.cat import Cat, CompactCat, init_cat_env
+from catsim.constants import DISABLE_PROB_INTER, MOVE_PATTERN_RANDOM_ID
+from catsim.grid import setup_grid, update_statuses
+from catsim.pipeline import RenderThread, SnapshotBuffer
+from catsim.render import (
+    get_colors,
+    get_positions,
+    get_vertex_colors,
+    hex_to_rgb,
+    setup_render,
+    snapshot,
+    update_colors,
+)
+
+
+class TestColors:
+    @pytest.mark.parametrize("renderer", [const.GUI_RENDERER, const.GGUI_RENDERER])
+    def test_colors_follow_statuses(self, renderer):
+        N, RADIUS, R0, R1, WIDTH, HEIGHT = 4, 1, 2, 8, 50, 50
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        points = ti.Vector.field(n=2, dtype=float, shape=(N,))
+        points[0] = tm.vec2(0.0, 0.0)
+        points[1] = tm.vec2(2.0, 0.0)
+        points[2] = tm.vec2(8.0, 0.0)
+        points[3] = tm.vec2(40.0, 40.0)
+
+        cats = Cat.field(shape=(N,))
+        init_cats_with_custom_points(n=N, radius=RADIUS, cats=cats, points=points)
+
+        setup_grid(N, R1, WIDTH, HEIGHT)
+        update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+
+        setup_render(
+            cat_n=N,
+            color_no=const.GREEN_COLOR,
+            color_l1=const.YELLOW_COLOR,
+            color_l0=const.RED_COLOR,
+            renderer=renderer,
+        )
+        update_colors(cats)
+
+        expected = [
+            const.RED_COLOR,
+            const.RED_COLOR,
+            const.YELLOW_COLOR,
+            const.GREEN_COLOR,
+        ]
+
+        if renderer == const.GUI_RENDERER:
+            assert list(get_colors()) == expected
+        else:
+            colors = get_vertex_colors()
+            for i in range(N):
+                assert list(colors[i]) == pytest.approx(hex_to_rgb(expected[i]))
+
+    def test_compact_cat_positions(self):
+        N, WIDTH, HEIGHT = 100, 500, 250
+
+        init_cat_env(
+            move_radius=1,
+            r0=2,
+            r1=8,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        cats = CompactCat.field(shape=(N,))
+        set_cat_init_positions(N, 1, cats)
+
+        setup_render(
+            cat_n=N,
+            color_no=const.GREEN_COLOR,
+            color_l1=const.YELLOW_COLOR,
+            color_l0=const.RED_COLOR,
+            plate_size=(WIDTH, HEIGHT),
+        )
+
+        expected = cats.point.to_numpy() / np.array([WIDTH, HEIGHT])
+        assert np.allclose(get_positions(cats).to_numpy(), expected)
+
+
+class TestSnapshot:
+    @pytest.mark.parametrize("cat_type", [Cat, CompactCat])
+    def test_snapshot(self, cat_type):
+        N, R0, R1, WIDTH, HEIGHT = 1000, 2, 8, 500, 250
+
+        init_cat_env(
+            move_radius=1,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+
+        cats = cat_type.field(shape=(N,))
+        set_cat_init_positions(N, 1, cats)
+
+        setup_grid(N, R1, WIDTH, HEIGHT)
+        update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+
+        setup_render(
+            cat_n=N,
+            color_no=const.GREEN_COLOR,
+            color_l1=const.YELLOW_COLOR,
+            color_l0=const.RED_COLOR,
+            plate_size=(WIDTH, HEIGHT) if cat_type is CompactCat else None,
+        )
+        update_colors(cats)
+
+        buffer = SnapshotBuffer(N)
+        positions, colors = buffer.back()
+        snapshot(cats, positions, colors)
+
+        assert np.allclose(positions, get_positions(cats).to_numpy())
+        assert np.array_equal(colors, get_colors())
+
+    def test_double_buffer(self):
+        buffer = SnapshotBuffer(2)
+        assert buffer.wants_snapshot()
+
+        positions, colors = buffer.back()
+        positions[:] = 1.0
+        colors[:] = 7
+        assert buffer.publish()
+        # the published buffer is not written by the simulation any more
+        assert buffer.back()[0] is not positions
+        assert buffer.back()[1] is not colors
+        assert not buffer.wants_snapshot()
+
+        drawn = []
+        assert buffer.draw(
+            lambda pos, col: drawn.append((pos.copy(), col.copy())), timeout=1
+        )
+        assert np.all(drawn[0][0] == 1.0)
+        assert np.all(drawn[0][1] == 7)
+        assert buffer.wants_snapshot()
+
+        # nothing new is published
+        assert not buffer.draw(lambda pos, col: None, timeout=0.01)
+
+    def test_publish_does_not_wait_for_drawing(self):
+        buffer = SnapshotBuffer(2)
+        buffer.publish()
+
+        drawing = threading.Event()
+        release = threading.Event()
+
+        def slow_draw(positions, colors):
+            drawing.set()
+            release.wait()
+
+        renderer = threading.Thread(target=buffer.draw, args=(slow_draw,))
+        renderer.start()
+        drawing.wait()
+
+        # the snapshot is dropped instead of blocking the simulation
+        assert not buffer.publish()
+
+        release.set()
+        renderer.join()
+        assert buffer.publish()
+
+    def test_render_thread(self):
+        N = 100
+        buffer = SnapshotBuffer(N)
+        renderer = RenderThread(buffer, res=(64, 64), radius=1, show_gui=False)
+        renderer.start()
+
+        for _ in range(3):
+            positions, colors = buffer.back()
+            positions[:] = np.random.default_rng(0).uniform(0, 1, (N, 2))
+            colors[:] = const.GREEN_COLOR
+            buffer.publish()
+            while not buffer.wants_snapshot():
+                assert renderer.is_alive()
+
+        renderer.stop()
+        renderer.join(timeout=5)
+        assert not renderer.is_alive()
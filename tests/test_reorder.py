@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import taichi as ti
+from helper import primitive_update_states, set_cat_init_positions
+
+import catsim.constants as const
+from catsim.cat import Cat, init_cat_env
+from catsim.constants import DISABLE_PROB_INTER, MOVE_PATTERN_RANDOM_ID
+from catsim.grid import setup_grid, update_statuses
+from catsim.reorder import get_slots, reorder_cats, setup_reorder
+
+
+class TestReorder:
+    @pytest.mark.parametrize(
+        "N, R0, R1, RADIUS, WIDTH, HEIGHT",
+        [
+            (100, 2, 8, 1, 100, 100),
+            (10000, 2, 8, 1, 1000, 1000),
+        ],
+    )
+    def test_reorder_keeps_cats(self, N, R0, R1, RADIUS, WIDTH, HEIGHT):
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+        setup_grid(cat_n=N, r1=R1, width=WIDTH, height=HEIGHT)
+        setup_reorder(Cat, N)
+
+        cats = Cat.field(shape=(N,))
+        set_cat_init_positions(N, RADIUS, cats)
+        update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+
+        points = cats.point.to_numpy()
+        statuses = cats.status.to_numpy()
+
+        reorder_cats(cats)
+
+        ids = cats.id.to_numpy()
+        slots = get_slots()
+
+        # every cat keeps its id, position and status
+        assert np.array_equal(np.sort(ids), np.arange(N))
+        assert np.array_equal(ids[slots], np.arange(N))
+        assert np.array_equal(cats.point.to_numpy()[slots], points)
+        assert np.array_equal(cats.status.to_numpy()[slots], statuses)
+
+        # cats are sorted by cell
+        cells = np.floor(cats.point.to_numpy() / R1).astype(np.int64)
+        cell_lin_idx = cells[:, 0] * int(np.ceil(HEIGHT / R1)) + cells[:, 1]
+        assert np.all(np.diff(cell_lin_idx) >= 0)
+
+        # the algorithm gives the same result on the permuted field
+        expected_statuses = ti.ndarray(dtype=ti.i32, shape=(N,))
+        primitive_update_states(
+            N, cats, expected_statuses, const.EUCLIDEAN_DISTANCE, R0, R1
+        )
+        update_statuses(cats, const.EUCLIDEAN_DISTANCE)
+        assert np.array_equal(cats.status.to_numpy(), expected_statuses.to_numpy())
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import taichi as ti
+
+from catsim.tools import rng_f32, rng_stream, rng_u32
+
+
+def _hash(x):
+    x = x.astype(np.uint64)
+    mask = np.uint64(0xFFFFFFFF)
+    x ^= x >> np.uint64(16)
+    x = (x * np.uint64(0x7FEB352D)) & mask
+    x ^= x >> np.uint64(15)
+    x = (x * np.uint64(0x846CA68B)) & mask
+    x ^= x >> np.uint64(16)
+    return x
+
+
+@ti.data_oriented
+class TestCounterRng:
+    @ti.kernel
+    def draw(
+        self,
+        seed: ti.u32,
+        step: ti.u32,
+        ints: ti.types.ndarray(),
+        floats: ti.types.ndarray(),
+    ):
+        for key, counter in ti.ndrange(ints.shape[0], ints.shape[1]):
+            stream = rng_stream(seed, key, step)
+            ints[key, counter] = rng_u32(stream, counter)
+            floats[key, counter] = rng_f32(stream, counter)
+
+    def run(self, seed, step, keys=64, counters=64):
+        ints = np.zeros((keys, counters), dtype=np.uint32)
+        floats = np.zeros((keys, counters), dtype=np.float32)
+        self.draw(seed, step, ints, floats)
+        return ints, floats
+
+    @pytest.mark.parametrize("seed, step", [(0, 0), (231827438, 7)])
+    def test_matches_reference(self, seed, step):
+        ints, floats = self.run(seed, step)
+
+        keys = np.arange(ints.shape[0], dtype=np.uint64)[:, None]
+        counters = np.arange(ints.shape[1], dtype=np.uint64)[None, :]
+        stream = _hash(_hash(_hash(np.array(seed)) ^ keys) ^ np.uint64(step))
+        expected = _hash(stream ^ _hash(counters))
+
+        assert np.array_equal(ints, expected.astype(np.uint32))
+        assert np.array_equal(floats, (expected >> np.uint64(8)) / 2.0**24)
+
+    def test_streams(self):
+        ints, floats = self.run(1, 1)
+
+        # the same key gives the same draws, other keys give other ones
+        assert np.array_equal(ints, self.run(1, 1)[0])
+        assert not np.array_equal(ints, self.run(2, 1)[0])
+        assert not np.array_equal(ints, self.run(1, 2)[0])
+
+        assert 0 <= floats.min() and floats.max() < 1
+        assert abs(floats.mean() - 0.5) < 0.02
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import taichi as ti
+
+from catsim.tools import exclusive_scan, scan_block_size
+
+
+@ti.data_oriented
+class TestExclusiveScan:
+    @ti.kernel
+    def scan(
+        self,
+        values: ti.template(),
+        out: ti.template(),
+        block_sums: ti.template(),
+        n: ti.i32,
+        block_sz: ti.i32,
+    ):
+        exclusive_scan(values, out, block_sums, n, block_sz)
+
+    @pytest.mark.parametrize(
+        "n, block_sz",
+        [
+            (1, 64),
+            (63, 64),
+            (64, 64),
+            (1000, 64),
+            (100_000, scan_block_size(100_000)),
+        ],
+    )
+    def test_matches_cumsum(self, n: int, block_sz: int):
+        data = np.random.default_rng(n).integers(0, 10, n, dtype=np.int32)
+
+        values = ti.field(dtype=ti.i32, shape=(n,))
+        out = ti.field(dtype=ti.i32, shape=(n + 1,))
+        block_sums = ti.field(dtype=ti.i32, shape=(-(-n // block_sz),))
+        values.from_numpy(data)
+
+        self.scan(values, out, block_sums, n, block_sz)
+
+        expected = np.concatenate([[0], np.cumsum(data)])
+        assert np.array_equal(out.to_numpy(), expected)
@@ -0,0 +1,99 @@
+import json
+
+import numpy as np
+import pytest
+
+import catsim.constants as const
+from catsim.reorder import get_slots
+from catsim.settings import Config, load_config, parse_override, tomllib
+from catsim.simulation import grid_cell_size, init_simulation, step
+
+
+class TestConfig:
+    @pytest.mark.parametrize("ext", [".json", ".toml"])
+    def test_load_config(self, tmp_path, ext):
+        if ext == ".toml" and tomllib is None:
+            pytest.skip("tomllib needs python >= 3.11")
+
+        path = tmp_path / f"config{ext}"
+        if ext == ".json":
+            path.write_text(
+                json.dumps({"CATS_N": 1000, "DISTANCE": "MANHATTAN_DISTANCE"})
+            )
+        else:
+            path.write_text('CATS_N = 1000\nDISTANCE = "MANHATTAN_DISTANCE"\n')
+
+        config = load_config(str(path))
+
+        assert config.CATS_N == 1000
+        assert config.DISTANCE == const.MANHATTAN_DISTANCE
+        assert config.RADIUS_1 == Config().RADIUS_1
+
+    @pytest.mark.parametrize(
+        "override, name, value",
+        [
+            ("CATS_N=1000", "CATS_N", 1000),
+            ("RADIUS_1=12", "RADIUS_1", 12.0),
+            ("FUSED_STEP=false", "FUSED_STEP", False),
+            ("NEIGHBOUR_STENCIL=HALF_STENCIL", "NEIGHBOUR_STENCIL", const.HALF_STENCIL),
+        ],
+    )
+    def test_override(self, override, name, value):
+        config = Config().replace(**dict([parse_override(override)]))
+
+        assert getattr(config, name) == value
+        assert type(getattr(config, name)) is type(value)
+
+    @pytest.mark.parametrize(
+        "params",
+        [{"CAT_N": 10}, {"CATS_N": 2.5}, {"CATS_N": "LOTS"}, {"FUSED_STEP": 1}],
+    )
+    def test_invalid(self, params):
+        with pytest.raises(ValueError):
+            Config().replace(**params)
+
+    def test_grid_cell_size(self):
+        config = Config().replace(RADIUS_1=12)
+        assert grid_cell_size(config) == 12
+
+        config = config.replace(GRID_CELL_SIZE="AUTO_CELL_SIZE", CATS_N=100)
+        assert grid_cell_size(config) > 12
+
+        assert grid_cell_size(config.replace(GRID_CELL_SIZE=5)) == 5
+
+    def test_kernels_are_reused(self):
+        N, MOVE_RADIUS = 1000, 0.25
+
+        config = Config().replace(
+            CATS_N=N, MOVE_PATTERN_ID="MOVE_PATTERN_RANDOM_ID", REORDER_PERIOD=0
+        )
+        cats = init_simulation(config)
+        step(cats)
+
+        # the same layout: fields (and kernels compiled for them) are reused
+        slow = config.replace(
+            MOVE_RADIUS=MOVE_RADIUS,
+            RADIUS_0=config.RADIUS_0 / 2,
+            DISTANCE="CHEBYSHEV_DISTANCE",
+        )
+        assert init_simulation(slow) is cats
+
+        points = cats.point.to_numpy()
+        step(cats)
+        shift = np.abs(cats.point.to_numpy() - points)
+        assert shift.max() <= MOVE_RADIUS + 1e-4
+
+        assert init_simulation(config.replace(CATS_N=N + 1)) is not cats
+
+    def test_slots_are_reset(self):
+        N = 1000
+
+        config = Config().replace(CATS_N=N, REORDER_PERIOD=1)
+        cats = init_simulation(config)
+        step(cats)
+        assert not np.array_equal(get_slots(), np.arange(N))
+
+        # the reused field gets new cats, their slots are their ids again
+        assert init_simulation(config) is cats
+        assert np.array_equal(get_slots(), np.arange(N))
+        assert np.array_equal(cats.id.to_numpy(), np.arange(N))
@@ -0,0 +1,234 @@
+import json
+
+import numpy as np
+import pytest
+
+import catsim.constants as const
+from catsim.contacts import ContactLog
+from catsim.profiler import format_profile
+from catsim.recorder import Recording
+from catsim.settings import Config
+from catsim.simulation import (
+    close_simulation,
+    get_config,
+    init_simulation,
+    load_checkpoint,
+    run_headless,
+    save_checkpoint,
+    status_counts,
+    step,
+)
+
+
+class TestEnsemble:
+    @pytest.mark.parametrize("engine", [const.GRID_ENGINE, const.VERLET_ENGINE])
+    def test_status_counts(self, engine):
+        REPLICA_N, N = 4, 500
+
+        config = Config().replace(
+            CATS_N=N,
+            REPLICA_N=REPLICA_N,
+            PLATE_WIDTH=100,
+            PLATE_HEIGHT=100,
+            NEIGHBOUR_ENGINE=engine,
+        )
+        cats = init_simulation(config)
+        assert cats.shape == (REPLICA_N * N,)
+
+        for _ in range(3):
+            step(cats)
+
+        counts = status_counts(cats)
+        assert counts.shape == (REPLICA_N, const.INTERACTION_LEVEL_0 + 1)
+        assert np.all(counts.sum(axis=1) == N)
+        # replicas start from different random positions
+        assert len({tuple(row) for row in counts}) > 1
+
+
+class TestHeadless:
+    def test_report_is_strict_json(self):
+        cats = init_simulation(Config().replace(CATS_N=100))
+        result = run_headless(cats, steps=0)
+
+        # no Infinity / NaN tokens, which strict JSON parsers reject
+        assert json.loads(json.dumps(result, allow_nan=False)) == result
+        assert result["steps_per_sec"] is None
+
+
+class TestCheckpoint:
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {},
+            {"NEIGHBOUR_ENGINE": const.VERLET_ENGINE, "REORDER_PERIOD": 3},
+            {"CAT_TYPE": const.COMPACT_CAT, "REPLICA_N": 2},
+        ],
+    )
+    def test_resume(self, tmp_path, params):
+        STEPS, path = 5, str(tmp_path / "state.npz")
+
+        # the random streams are saved too, so resuming is exact
+        config = Config().replace(
+            CATS_N=1000,
+            PLATE_WIDTH=100,
+            PLATE_HEIGHT=100,
+            MOVE_PATTERN_ID=const.MOVE_PATTERN_RANDOM_ID,
+            PROB_INTERACTION=const.ENABLE_PROB_INTER,
+            **params,
+        )
+        cats = init_simulation(config)
+        for _ in range(STEPS):
+            step(cats)
+        save_checkpoint(path, cats)
+
+        for _ in range(STEPS):
+            step(cats)
+        expected = cats.to_numpy()
+
+        init_simulation(config)
+        cats = load_checkpoint(path)
+        assert get_config() == config
+        for _ in range(STEPS):
+            step(cats)
+
+        for name, values in cats.to_numpy().items():
+            assert np.array_equal(values, expected[name]), name
+
+    def test_resume_recording(self, tmp_path):
+        STEPS, CRASH, EVERY = 10, 7, 5
+
+        config = Config().replace(
+            CATS_N=500,
+            PLATE_WIDTH=100,
+            PLATE_HEIGHT=100,
+            MOVE_PATTERN_ID=const.MOVE_PATTERN_RANDOM_ID,
+            RECORD_EVERY=2,
+            RECORD_FRAMES=20,
+        )
+
+        def paths(name):
+            return {
+                "RECORD_PATH": str(tmp_path / name / "record"),
+                "CONTACTS_PATH": str(tmp_path / name / "contacts"),
+            }
+
+        cats = init_simulation(config.replace(**paths("expected")))
+        for _ in range(STEPS):
+            step(cats)
+        close_simulation()
+
+        # the run "crashes" after CRASH steps, its last checkpoint is older
+        checkpoint = str(tmp_path / "state.npz")
+        cats = init_simulation(
+            config.replace(
+                CHECKPOINT_PATH=checkpoint, CHECKPOINT_EVERY=EVERY, **paths("run")
+            )
+        )
+        for _ in range(CRASH):
+            step(cats)
+        close_simulation()
+        before = Recording(str(tmp_path / "run" / "record"))
+        assert list(before.steps) == [2, 4, 6]
+        points = np.array(before.points[:2])
+
+        cats = load_checkpoint(checkpoint)
+        for _ in range(STEPS - EVERY):
+            step(cats)
+        close_simulation()
+
+        # frames and contacts of the steps before the checkpoint are kept,
+        # the ones after it are written again
+        recording = Recording(str(tmp_path / "run" / "record"))
+        expected = Recording(str(tmp_path / "expected" / "record"))
+        assert list(recording.steps) == [2, 4, 6, 8, 10]
+        assert np.array_equal(recording.points[:2], points)
+        assert np.array_equal(recording.points, expected.points)
+        assert np.array_equal(recording.statuses, expected.statuses)
+
+        log = ContactLog(str(tmp_path / "run" / "contacts"))
+        expected_log = ContactLog(str(tmp_path / "expected" / "contacts"))
+        assert list(log.step_ids) == list(range(1, STEPS + 1))
+        assert np.array_equal(log.offsets, expected_log.offsets)
+        assert np.array_equal(log.edges, expected_log.edges)
+
+
+class TestProfile:
+    @pytest.mark.parametrize("stencil", [const.FULL_STENCIL, const.HALF_STENCIL])
+    def test_phases(self, stencil):
+        STEPS = 3
+
+        config = Config().replace(
+            CATS_N=1000,
+            PLATE_WIDTH=100,
+            PLATE_HEIGHT=100,
+            MOVE_PATTERN_ID=const.MOVE_PATTERN_PHIS_ID,
+            NEIGHBOUR_STENCIL=stencil,
+        )
+        cats = init_simulation(config)
+        initial = cats.to_numpy()
+        for _ in range(STEPS):
+            step(cats)
+        expected = cats.status.to_numpy()
+
+        # the same steps as separate kernels
+        cats = init_simulation(config.replace(PROFILE=True))
+        cats.from_numpy(initial)
+        result = run_headless(cats, steps=STEPS)
+        assert np.array_equal(cats.status.to_numpy(), expected)
+
+        phases = ["move_cats", "count_cats", "scan_cells", "scatter_cats", "fight_cats"]
+        assert list(result["kernels_ms"]) == phases
+        assert result["pair_checks_per_cat"] > 0
+
+        report = format_profile(result["kernels_ms"])
+        assert all(phase in report for phase in phases)
+
+
+def _statuses_by_id(cats) -> np.ndarray:
+    statuses = np.zeros((cats.shape[0],), dtype=np.int32)
+    statuses[cats.id.to_numpy()] = cats.status.to_numpy()
+    return statuses
+
+
+class TestIncrementalGrid:
+    @pytest.mark.parametrize(
+        "params",
+        [
+            {"MIGRATION_THRESHOLD": 1.0},
+            {"MIGRATION_THRESHOLD": 0.0},
+            {"MIGRATION_THRESHOLD": 1.0, "NEIGHBOUR_STENCIL": const.HALF_STENCIL},
+            {"MIGRATION_THRESHOLD": 1.0, "REORDER_PERIOD": 2},
+        ],
+    )
+    def test_same_as_rebuild(self, params):
+        STEPS = 6
+
+        config = Config().replace(
+            CATS_N=2000,
+            PLATE_WIDTH=100,
+            PLATE_HEIGHT=100,
+            MOVE_RADIUS=0.5,
+            MOVE_PATTERN_ID=const.MOVE_PATTERN_PHIS_ID,
+            PROB_INTERACTION=const.DISABLE_PROB_INTER,
+            **params,
+        )
+        cats = init_simulation(config)
+        initial = cats.to_numpy()
+        for _ in range(STEPS):
+            step(cats)
+        expected = _statuses_by_id(cats)
+
+        cats = init_simulation(config.replace(INCREMENTAL_GRID=True))
+        cats.from_numpy(initial)
+        result = run_headless(cats, steps=STEPS)
+        # reorder_cats() permutes the cats by their storage order, which the
+        # patched storage keeps differently inside a cell, so compare by id
+        assert np.array_equal(_statuses_by_id(cats), expected)
+
+        migration = result["migration"]
+        assert 0 < migration["rate_per_step"] < 1
+        if config.MIGRATION_THRESHOLD == 0:
+            assert migration["rebuilds"] == STEPS
+        elif config.REORDER_PERIOD == 0:
+            # only the first step builds the storage
+            assert migration["rebuilds"] == 1
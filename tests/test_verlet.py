@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+import taichi as ti
+from helper import primitive_update_states, set_cat_init_positions
+
+import catsim.constants as const
+from catsim import verlet
+from catsim.cat import Cat, init_cat_env
+from catsim.constants import DISABLE_PROB_INTER
+from catsim.verlet import (
+    build_neighbour_lists,
+    get_verlet_stats,
+    move_cats_tracked,
+    needs_rebuild,
+    setup_verlet,
+    update_statuses_verlet,
+)
+
+
+class TestVerlet:
+    @pytest.mark.parametrize("stencil", [const.FULL_STENCIL, const.HALF_STENCIL])
+    @pytest.mark.parametrize(
+        "move_pattern, distance_type",
+        [
+            (const.MOVE_PATTERN_RANDOM_ID, const.EUCLIDEAN_DISTANCE),
+            (const.MOVE_PATTERN_LINE_ID, const.MANHATTAN_DISTANCE),
+            (const.MOVE_PATTERN_PHIS_ID, const.CHEBYSHEV_DISTANCE),
+        ],
+    )
+    def test_primitive_func(self, stencil, move_pattern, distance_type):
+        N, R0, R1, RADIUS, WIDTH, HEIGHT = 10000, 2, 8, 1, 1000, 1000
+        MOVE_RADIUS, SKIN, STEPS = 0.5, 4, 10
+
+        init_cat_env(
+            move_radius=MOVE_RADIUS,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=move_pattern,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+        setup_verlet(cat_n=N, r1=R1, skin=SKIN, width=WIDTH, height=HEIGHT)
+
+        cats = Cat.field(shape=(N,))
+        set_cat_init_positions(N, RADIUS, cats)
+
+        for _ in range(STEPS):
+            move_cats_tracked(cats, distance_type)
+            if needs_rebuild():
+                build_neighbour_lists(cats, distance_type, stencil)
+            update_statuses_verlet(cats, distance_type, stencil)
+
+            expected_statuses = ti.ndarray(dtype=ti.i32, shape=(N,))
+            primitive_update_states(N, cats, expected_statuses, distance_type, R0, R1)
+
+            assert np.array_equal(cats.status.to_numpy(), expected_statuses.to_numpy())
+
+        # slow cats: the lists are reused between builds
+        assert get_verlet_stats()["builds"] < STEPS
+
+    def test_buffer_grows(self):
+        N, R0, R1, WIDTH, HEIGHT = 1000, 2, 8, 50, 50
+
+        init_cat_env(
+            move_radius=R0,
+            r0=R0,
+            r1=R1,
+            width=WIDTH,
+            height=HEIGHT,
+            move_pattern=const.MOVE_PATTERN_RANDOM_ID,
+            prob_inter=DISABLE_PROB_INTER,
+        )
+        setup_verlet(cat_n=N, r1=R1, skin=2, width=WIDTH, height=HEIGHT)
+
+        cats = Cat.field(shape=(N,))
+        set_cat_init_positions(N, 1, cats)
+
+        move_cats_tracked(cats, const.EUCLIDEAN_DISTANCE)
+        assert needs_rebuild()
+        build_neighbour_lists(cats, const.EUCLIDEAN_DISTANCE, const.FULL_STENCIL)
+        update_statuses_verlet(cats, const.EUCLIDEAN_DISTANCE, const.FULL_STENCIL)
+
+        stats = get_verlet_stats()
+        # ~ (2 * 10)^2 / 50^2 of all cats are listed for every cat
+        assert stats["neighbours"] > N
+        assert stats["capacity"] >= stats["neighbours"]
+
+        expected_statuses = ti.ndarray(dtype=ti.i32, shape=(N,))
+        primitive_update_states(
+            N, cats, expected_statuses, const.EUCLIDEAN_DISTANCE, R0, R1
+        )
+        assert np.array_equal(cats.status.to_numpy(), expected_statuses.to_numpy())
+
+    def test_setup_again(self):
+        N, R1, WIDTH, HEIGHT = 100, 8, 50, 50
+
+        setup_verlet(cat_n=N, r1=R1, skin=2, width=WIDTH, height=HEIGHT)
+        tree = verlet._NEIGHBOURS_TREE
+
+        # the lists of the previous setup are freed
+        setup_verlet(cat_n=N, r1=R1, skin=2, width=WIDTH, height=HEIGHT)
+        assert tree.destroyed
+        assert not verlet._NEIGHBOURS_TREE.destroyed
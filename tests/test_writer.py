@@ -0,0 +1,56 @@
+import contextlib
+import json
+import os
+
+import pytest
+
+from catsim.writer import BackgroundWriter
+
+
+class _LineWriter(BackgroundWriter):
+    def __init__(self, path: str, fail_at: int = -1):
+        self.fail_at = fail_at
+        super().__init__(path, "lines", meta={"kind": "lines"}, written={"lines": 0})
+
+    @contextlib.contextmanager
+    def _open(self):
+        with open(os.path.join(self.path, "lines.txt"), "w") as f:
+            yield f
+
+    def _write(self, files, item):
+        if item == self.fail_at:
+            raise ValueError(f"bad item {item}")
+        files.write(f"{item}\n")
+        self._written["lines"] += 1
+
+    def _flush(self, files):
+        files.flush()
+
+
+class TestBackgroundWriter:
+    def test_write(self, tmp_path):
+        with _LineWriter(str(tmp_path)) as writer:
+            for item in range(5):
+                writer.put(item)
+
+        with open(tmp_path / "meta.json") as f:
+            assert json.load(f) == {"kind": "lines", "lines": 5}
+        assert (tmp_path / "lines.txt").read_text().split() == list("01234")
+
+    def test_error_is_raised(self, tmp_path):
+        writer = _LineWriter(str(tmp_path), fail_at=2)
+        for item in range(5):
+            writer.put(item)
+
+        with pytest.raises(RuntimeError) as e:
+            writer.close()
+        assert isinstance(e.value.__cause__, ValueError)
+
+        # the items after the error are dropped
+        with open(tmp_path / "meta.json") as f:
+            assert json.load(f)["lines"] == 2
+
+    def test_open_error(self, tmp_path):
+        (tmp_path / "lines.txt").mkdir()
+        with pytest.raises(OSError):
+            _LineWriter(str(tmp_path))